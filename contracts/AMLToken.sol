@@ -38,6 +38,23 @@ contract AMLToken is BurnableCrowdsaleToken {
   function transferToOwner(address fromWhom) onlyOwner {
     if (released) revert();
 
+    reclaimInternal(fromWhom);
+  }
+
+  /// @dev Reclaim tokens from multiple participants in one transaction.
+  ///      Participants with zero balance, e.g. already reclaimed, are skipped.
+  /// @param fromWhom addresses of the participants whose tokens we want to claim
+  function transferToOwnerMany(address[] fromWhom) onlyOwner {
+    if (released) revert();
+
+    for (uint i = 0; i < fromWhom.length; i++) {
+      if (balanceOf(fromWhom[i]) > 0) {
+        reclaimInternal(fromWhom[i]);
+      }
+    }
+  }
+
+  function reclaimInternal(address fromWhom) internal {
     uint amount = balanceOf(fromWhom);
     balances[fromWhom] = balances[fromWhom].sub(amount);
     balances[owner] = balances[owner].add(amount);
@@ -0,0 +1,109 @@
+/**
+ * This smart contract code is Copyright 2017 TokenMarket Ltd. For more information see https://tokenmarket.net
+ *
+ * Licensed under the Apache License, version 2.0: https://github.com/TokenMarketNet/ico/blob/master/LICENSE.txt
+ */
+
+pragma solidity ^0.4.8;
+
+import "./StandardTokenExt.sol";
+import "zeppelin/contracts/ownership/Ownable.sol";
+
+/**
+ * Issuer that can distribute tokens to multiple addresses in a single transaction.
+ *
+ * Works like Issuer, but issueMany() takes arrays of benefactors and amounts,
+ * so that large bounty and airdrop distributions do not need to pay
+ * the base transaction cost for every benefactor.
+ *
+ * Issuer act as a gate keeper to ensure there is no double issuance
+ * per address, in the case we need to do several issuance batches,
+ * there is a race condition or there is a fat finger error.
+ *
+ * Issuer contract gets allowance from the team multisig to distribute tokens.
+ *
+ * The owner can add more issuer accounts, so that a distribution can be sent
+ * from multiple accounts in parallel, each with its own nonce sequence.
+ *
+ */
+contract BatchIssuer is Ownable {
+
+  /** Map addresses whose tokens we have already issued. */
+  mapping(address => bool) public issued;
+
+  /** Centrally issued token we are distributing to our contributors */
+  StandardTokenExt public token;
+
+  /** Party (team multisig) who is in the control of the token pool. Note that this will be different from the owner address (scripted) that calls this contract. */
+  address public allower;
+
+  /** How many tokens have been issued. */
+  uint public issuedCount;
+
+  /** Accounts, in addition to the owner, that can issue tokens */
+  mapping(address => bool) public issuers;
+
+  /** Issue event **/
+  event Issued(address benefactor, uint amount);
+
+  /** Issuer account added or removed */
+  event IssuerChanged(address issuer, bool enabled);
+
+  modifier onlyIssuer() {
+    require(msg.sender == owner || issuers[msg.sender]);
+    _;
+  }
+
+  function BatchIssuer(address _owner, address _allower, StandardTokenExt _token) {
+    require(address(_owner) != address(0));
+    require(address(_allower) != address(0));
+    require(address(_token) != address(0));
+
+    owner = _owner;
+    allower = _allower;
+    token = _token;
+  }
+
+  /**
+   * Allow or disallow an account to issue tokens.
+   */
+  function setIssuer(address issuer, bool enabled) onlyOwner {
+    issuers[issuer] = enabled;
+    IssuerChanged(issuer, enabled);
+  }
+
+  function issue(address benefactor, uint amount) onlyIssuer {
+    if(issued[benefactor]) throw;
+    issueInternal(benefactor, amount);
+  }
+
+  /**
+   * Issue tokens to multiple benefactors.
+   *
+   * Benefactors that have already received their tokens are skipped,
+   * so that a batch can be safely resent if we do not know whether it went through.
+   *
+   * @param benefactors Addresses receiving tokens
+   * @param amounts Raw token amounts, including decimal multiplication, matching benefactors
+   */
+  function issueMany(address[] benefactors, uint[] amounts) onlyIssuer {
+    require(benefactors.length == amounts.length);
+
+    for(uint i=0; i<benefactors.length; i++) {
+      if(issued[benefactors[i]]) {
+        continue;
+      }
+      issueInternal(benefactors[i], amounts[i]);
+    }
+  }
+
+  function issueInternal(address benefactor, uint amount) internal {
+    // transferFrom() returns false instead of throwing on some tokens
+    require(token.transferFrom(allower, benefactor, amount));
+    issued[benefactor] = true;
+    issuedCount += amount;
+
+    Issued(benefactor, amount);
+  }
+
+}
@@ -0,0 +1,61 @@
+/**
+ * This smart contract code is Copyright 2018 TokenMarket Ltd. For more information see https://tokenmarket.net
+ *
+ * Licensed under the Apache License, version 2.0: https://github.com/TokenMarketNet/ico/blob/master/LICENSE.txt
+ */
+
+pragma solidity ^0.4.18;
+
+
+/**
+ * Aggregate multiple constant function calls to a single eth_call.
+ *
+ * Command line tools need to read state like balances or issuance status
+ * for tens of thousands of addresses before sending any transactions.
+ * Doing one eth_call per address is slow over a network connection.
+ *
+ * The results are returned as the first 32 byte word of each call return data,
+ * so only functions returning a single static value (uint, bool, address) are supported.
+ *
+ * This contract has no state and is never transacted with. Deploy it once per chain
+ * and give its address to the command line tools.
+ */
+contract ReadAggregator {
+
+  /**
+   * Call multiple contracts and collect their return values.
+   *
+   * @param targets Contract addresses to call
+   * @param callDataLengths Length of ABI encoded call data for each target
+   * @param callData ABI encoded call data for all targets concatenated together
+   * @return The first 32 byte word of each call return data
+   */
+  function aggregate(address[] targets, uint[] callDataLengths, bytes callData) public constant returns (bytes32[] results) {
+    require(targets.length == callDataLengths.length);
+
+    results = new bytes32[](targets.length);
+
+    uint offset = 0;
+    for(uint i=0; i<targets.length; i++) {
+      uint len = callDataLengths[i];
+      require(offset + len <= callData.length);
+
+      address target = targets[i];
+      bool success;
+      bytes32 result;
+
+      assembly {
+        // Skip the length word of bytes memory array
+        let input := add(add(callData, 32), offset)
+        let output := mload(0x40)
+        mstore(output, 0)
+        success := call(gas, target, 0, input, len, output, 32)
+        result := mload(output)
+      }
+
+      require(success);
+      results[i] = result;
+      offset += len;
+    }
+  }
+}
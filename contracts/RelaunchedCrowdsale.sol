@@ -78,4 +78,23 @@ contract RelaunchedCrowdsale is MintedTokenCappedCrowdsale {
     mintableToken.mint(_addr, _tokenAmount);
   }
 
+  /**
+   * Rebuild multiple previous investments and do a token reissuance in one transaction.
+   *
+   * Already restored transactions are skipped, so that a batch can be safely resent.
+   */
+  function setInvestorDataAndIssueNewTokenMany(address[] _addrs, uint[] _weiAmounts, uint[] _tokenAmounts, uint[] _originalTxHashes) onlyOwner public {
+
+    require(_addrs.length == _weiAmounts.length);
+    require(_addrs.length == _tokenAmounts.length);
+    require(_addrs.length == _originalTxHashes.length);
+
+    for(uint i=0; i<_addrs.length; i++) {
+      if(reissuedTransactions[_originalTxHashes[i]]) {
+        continue;
+      }
+      setInvestorDataAndIssueNewToken(_addrs[i], _weiAmounts[i], _tokenAmounts[i], _originalTxHashes[i]);
+    }
+  }
+
 }
@@ -21,7 +21,7 @@ import "zeppelin/contracts/ownership/Ownable.sol";
  *
  * - Prepare a spreadsheet for token allocation
  * - Deploy this contract, with the sum to tokens to be distributed, from the owner account
- * - Call setInvestor for all investors from the owner account using a local script and CSV input
+ * - Call setInvestor or setInvestors for all investors from the owner account, or from loader accounts set by the owner, using a local script and CSV input
  * - Move tokensToBeAllocated in this contract using StandardToken.transfer()
  * - Call lock from the owner account
  * - Wait until the freeze period is over
@@ -65,6 +65,9 @@ contract TokenVault is Ownable, Recoverable {
   /** We can also define our own token, which will override the ICO one ***/
   StandardTokenExt public token;
 
+  /** Accounts, in addition to the owner, that can load investor data. Lets us load from multiple accounts in parallel. */
+  mapping(address => bool) public loaders;
+
   /** What is our current state.
    *
    * Loading: Investor data is being loaded and contract not yet locked
@@ -81,6 +84,14 @@ contract TokenVault is Ownable, Recoverable {
 
   event Locked();
 
+  /** Loader account added or removed */
+  event LoaderChanged(address loader, bool enabled);
+
+  modifier onlyLoader() {
+    require(msg.sender == owner || loaders[msg.sender]);
+    _;
+  }
+
   /**
    * Create presale contract where lock up period is given days
    *
@@ -123,19 +134,53 @@ contract TokenVault is Ownable, Recoverable {
     tokensToBeAllocated = _tokensToBeAllocated;
   }
 
+  /**
+   * @dev Allow or disallow an account to load investor data
+   */
+  function setLoader(address loader, bool enabled) public onlyOwner {
+    loaders[loader] = enabled;
+    LoaderChanged(loader, enabled);
+  }
+
   /**
    * @dev Add a participant to this Vault
    * @param investor Address of the participant who will be added to this vault
    * @param amount Amount of tokens this participant is entitled to in total
    * @param _tokensPerSecond Define the tap: how many tokens we permit the participant to withdraw per second, 0 to disable tap
    */
-  function setInvestor(address investor, uint amount, uint _tokensPerSecond) public onlyOwner {
+  function setInvestor(address investor, uint amount, uint _tokensPerSecond) public onlyLoader {
 
     if(lockedAt > 0) {
       // Cannot add new investors after the vault is locked
       throw;
     }
 
+    setInvestorInternal(investor, amount, _tokensPerSecond);
+  }
+
+  /**
+   * @dev Add multiple participants to this Vault in one transaction
+   * @param investors Addresses of the participants who will be added to this vault
+   * @param amounts Amount of tokens each participant is entitled to in total
+   * @param _tokensPerSecond Tap for each participant, 0 to disable tap
+   */
+  function setInvestors(address[] investors, uint[] amounts, uint[] _tokensPerSecond) public onlyLoader {
+
+    if(lockedAt > 0) {
+      // Cannot add new investors after the vault is locked
+      throw;
+    }
+
+    require(investors.length == amounts.length);
+    require(investors.length == _tokensPerSecond.length);
+
+    for(uint i=0; i<investors.length; i++) {
+      setInvestorInternal(investors[i], amounts[i], _tokensPerSecond[i]);
+    }
+  }
+
+  function setInvestorInternal(address investor, uint amount, uint _tokensPerSecond) internal {
+
     if(amount == 0) throw; // No empty buys
 
     // Don't allow reset
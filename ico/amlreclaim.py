@@ -6,12 +6,15 @@ This code is separated from the main script to make it more testable.
 import csv
 import logging
 from collections import namedtuple
-from typing import List, Optional, Tuple
+from typing import List, Optional
 
 from web3.contract import Contract
 
-from ico.utils import validate_ethereum_address, check_succesful_tx
-from ico.utils import check_multiple_succesful_txs
+from ico.utils import validate_ethereum_address
+from ico.utils import multicall
+from ico.utils import chunked
+from ico.utils import get_chunk_size
+from ico.sender import PipelinedSender
 
 
 logger = logging.getLogger(__name__)
@@ -19,63 +22,66 @@ logger = logging.getLogger(__name__)
 #: A parsed CSV input entry
 Entry = namedtuple("Entry", ("address", "label"))
 
+#: Worst case gas cost of reclaiming a single address in AMLToken.transferToOwnerMany()
+RECLAIM_GAS_PER_ROW = 30000
 
-def reclaim_address(token: Contract, entry: Entry, tx_params: dict) -> Tuple[int, str]:
-    """Reclsaim tokens for a single participant.
 
-    :param token: Token contract we reclaim
-    :param owner: Token owner account
-    :param address: Etherereum address
-    :param label: User notification label regarding this address
-    :param tx_params: Ethereum transaction parameters to use
-    :return: 1 on reclaim, 0 on skip
-    """
-
-    # Make sure we are not fed bad input, raises
-    validate_ethereum_address(entry.address)
-
-    if token.functions.balanceOf(entry.address).call() == 0:
-        logger.info("%s: looks like already reclaimed %s", entry.address, entry.label)
-        return 0, None
+def get_balances(token: Contract, rows: List[Entry], aggregator: Optional[Contract]=None) -> List[int]:
+    """Snapshot token balances of all entries with a bulk read.
 
-    txid = token.functions.transferToOwner(entry.address).transact(tx_params)
-    logger.info("%s: reclaiming %s in txid %s", entry.address, entry.label, txid)
-    return 1, txid
+    :param aggregator: Optional ReadAggregator contract, see :py:func:`ico.utils.multicall`
+    """
+    return multicall(token.web3, [(token, "balanceOf", [entry.address]) for entry in rows], aggregator)
 
 
-def reclaim_all(token: Contract, reclaim_list: List[Entry], tx_params: dict) -> int:
+def reclaim_all(token: Contract, reclaim_list: List[Entry], tx_params: dict, balances: Optional[List[int]]=None, batch_size=100, max_in_flight=16, sender=None) -> int:
     """Reclaim all tokens from the given input sheet.
 
-    Process transactions parallel to speed up the operation.
+    Entries with zero balance are skipped and the rest is reclaimed with
+    transferToOwnerMany() in chunks that fit in the block gas limit.
+    Chunk transactions are pipelined to speed up the operation.
 
     :param tx_parms: Ethereum transaction parameters to use
+    :param balances: Balance snapshot from :py:func:`get_balances`. Read if not given.
+    :param sender: Use this instead of sending the transactions from the owner account, e.g. :py:class:`ico.dryrun.DryRunSender`
+    :return: Number of addresses reclaimed
     """
 
-    total_reclaimed = 0
-
-    tx_to_confirm = []  # List of txids to confirm
-    tx_batch_size = 16  # How many transactions confirm once
     web3 = token.web3
 
-    for entry in reclaim_list:
-        ops, txid = reclaim_address(token, entry, tx_params)
-        total_reclaimed += ops
+    if balances is None:
+        balances = get_balances(token, reclaim_list)
 
-        if not txid:
-            # Already reclaimed
+    to_reclaim = []
+    for entry, balance in zip(reclaim_list, balances):
+        # Make sure we are not fed bad input, raises
+        validate_ethereum_address(entry.address)
+
+        if balance == 0:
+            logger.info("%s: looks like already reclaimed %s", entry.address, entry.label)
             continue
 
-        tx_to_confirm.append(txid)
+        to_reclaim.append(entry)
+
+    if not to_reclaim:
+        return 0
+
+    tx_params = dict(tx_params)
+    owner = tx_params.pop("from")
+    if sender is None:
+        sender = PipelinedSender(web3, owner, max_in_flight=max_in_flight)
+    chunk_size = get_chunk_size(web3, RECLAIM_GAS_PER_ROW, batch_size)
 
-        # Confirm N transactions when batch max size is reached
-        if len(tx_to_confirm) >= tx_batch_size:
-            check_multiple_succesful_txs(web3, tx_to_confirm)
-            tx_to_confirm = []
+    for chunk in chunked(to_reclaim, chunk_size):
+        transaction = dict(tx_params, gas=100000 + RECLAIM_GAS_PER_ROW * len(chunk))
+        txid = sender.transact(token.functions.transferToOwnerMany([entry.address for entry in chunk]), transaction)
+        for entry in chunk:
+            logger.info("%s: reclaiming %s in txid %s", entry.address, entry.label, txid)
 
     # Confirm dangling transactions
-    check_multiple_succesful_txs(web3, tx_to_confirm)
+    sender.flush()
 
-    return total_reclaimed
+    return len(to_reclaim)
 
 
 def prepare_csv(stream, address_key, label_key) -> List[Entry]:
@@ -128,15 +134,14 @@ def prepare_csv(stream, address_key, label_key) -> List[Entry]:
     return output_rows
 
 
-def count_tokens_to_reclaim(token, rows: List[Entry]):
-    """Count how many tokens are on user balances to reclaim."""
+def count_tokens_to_reclaim(token, rows: List[Entry], balances: Optional[List[int]]=None):
+    """Count how many tokens are on user balances to reclaim.
 
-    total = 0
-
-    for idx, entry in enumerate(rows):
-        total += token.functions.balanceOf(entry.address).call()
+    :param balances: Balance snapshot from :py:func:`get_balances`. Read if not given.
+    """
 
-        if idx % 20 == 0:
-            logger.info("Prechecking balances %d / %d", idx, len(rows))
+    if balances is None:
+        logger.info("Prechecking balances of %d addresses", len(rows))
+        balances = get_balances(token, rows)
 
-    return total
+    return sum(balances)
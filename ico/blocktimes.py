@@ -0,0 +1,227 @@
+"""Persistent block number to timestamp cache shared by the extraction commands.
+
+Missing blocks are fetched with JSON-RPC batches of ``eth_getBlockByNumber`` calls.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from web3 import HTTPProvider
+from web3 import Web3
+
+from ico.utils import chunked
+from ico.utils import make_batch_request
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Default cache file in the current working directory
+DEFAULT_CACHE_FILE = "block-timestamps.sqlite"
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS timestamps (
+    block_number INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL
+);
+"""
+
+
+def _fetch_batch(web3: Web3, block_numbers: list) -> Dict[int, int]:
+    blocks = make_batch_request(web3, [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+    timestamps = {}
+    for block_number, block in zip(block_numbers, blocks):
+        if not block:
+            raise RuntimeError("Node does not have block {}".format(block_number))
+        timestamps[block_number] = block["timestamp"]
+    return timestamps
+
+
+def _get_worker_web3(local: threading.local, provider: HTTPProvider) -> Web3:
+    """Web3 of the current worker thread with its own provider."""
+    web3 = getattr(local, "web3", None)
+    if web3 is None:
+        web3 = local.web3 = Web3(HTTPProvider(provider.endpoint_uri, request_kwargs=provider.get_request_kwargs()))
+    return web3
+
+
+def fetch_block_timestamps(web3: Web3, block_numbers: Iterable[int], batch_size=200, max_workers=1) -> Dict[int, int]:
+    """Fetch block headers in JSON-RPC batches.
+
+    :param batch_size: How many blocks are asked in one batch request
+    :param max_workers: How many batch requests can be in flight at the same time. Only with a HTTP provider, each worker gets a provider of its own.
+    :return: Block number -> timestamp
+    """
+    batches = list(chunked(sorted(set(block_numbers)), batch_size))
+    provider = web3.providers[0]
+    if max_workers > 1 and not isinstance(provider, HTTPProvider):
+        # IPC and tester providers cannot be used from several threads
+        logger.warning("Cannot fetch block headers concurrently with %s, fetching them one batch at a time", provider)
+        max_workers = 1
+
+    timestamps = {}
+    if max_workers > 1 and len(batches) > 1:
+        local = threading.local()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(lambda batch: _fetch_batch(_get_worker_web3(local, provider), batch), batches):
+                timestamps.update(result)
+    else:
+        for batch in batches:
+            timestamps.update(_fetch_batch(web3, batch))
+    return timestamps
+
+
+class BlockTimestampCache:
+    """SQLite backed block number -> timestamp mapping.
+
+    Example::
+
+        cache = BlockTimestampCache("block-timestamps.sqlite", web3.version.network)
+        for event in events:
+            timestamp = cache.get_timestamp(web3, event["blockNumber"])
+        cache.close()
+    """
+
+    def __init__(self, path: str, network_id: str, commit_interval=1000, batch_size=200, max_workers=1):
+        """
+        :param path: SQLite file, created if it does not exist
+        :param network_id: Network of the blocks. A cache of one network cannot be used for another.
+        :param commit_interval: Commit after this many new timestamps
+        :param batch_size: How many missing blocks are fetched in one JSON-RPC batch
+        :param max_workers: How many batches are fetched concurrently
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.commit_interval = commit_interval
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('network_id', ?)", (str(network_id),))
+
+        stored_network_id = self.conn.execute("SELECT value FROM meta WHERE name='network_id'").fetchone()[0]
+        if stored_network_id != str(network_id):
+            raise RuntimeError("Block timestamp cache {} is for network {}, not for {}".format(path, stored_network_id, network_id))
+
+        #: Timestamps stored, but not yet committed
+        self.uncommitted = 0
+
+        #: How many blocks we have fetched from the node
+        self.fetch_count = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM timestamps").fetchone()[0]
+
+    def get(self, block_number: int) -> Optional[int]:
+        """Get a cached timestamp or None."""
+        row = self.conn.execute("SELECT timestamp FROM timestamps WHERE block_number=?", (block_number,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, block_numbers: Iterable[int]) -> Dict[int, int]:
+        """Get cached timestamps of multiple blocks, missing blocks are left out."""
+        block_numbers = list(set(block_numbers))
+        result = {}
+        # Stay under SQLite host parameter limit
+        for i in range(0, len(block_numbers), 500):
+            chunk = block_numbers[i:i + 500]
+            query = "SELECT block_number, timestamp FROM timestamps WHERE block_number IN ({})".format(",".join("?" * len(chunk)))
+            result.update(self.conn.execute(query, chunk))
+        return result
+
+    def store(self, timestamps: Dict[int, int]):
+        """Add timestamps to the cache."""
+        self.conn.executemany("INSERT OR REPLACE INTO timestamps (block_number, timestamp) VALUES (?, ?)", timestamps.items())
+        self.uncommitted += len(timestamps)
+        if self.uncommitted >= self.commit_interval:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def get_timestamp(self, web3: Web3, block_number: int) -> int:
+        """Get the timestamp of a block, from the node if it is not cached."""
+        timestamp = self.get(block_number)
+        if timestamp is None:
+            timestamp = web3.eth.getBlock(block_number)["timestamp"]
+            self.fetch_count += 1
+            self.store({block_number: timestamp})
+        return timestamp
+
+    def prefetch(self, web3: Web3, block_numbers: Iterable[int]) -> int:
+        """Make sure timestamps of all given blocks are cached.
+
+        :return: How many blocks were fetched from the node
+        """
+        block_numbers = set(block_numbers)
+        missing = block_numbers - set(self.get_many(block_numbers).keys())
+        fetched = fetch_block_timestamps(web3, missing, self.batch_size, self.max_workers)
+        self.store(fetched)
+        self.fetch_count += len(fetched)
+        return len(fetched)
+
+    def timestamp_events(self, web3: Web3, events: Iterable[dict], window=1000) -> Iterator[Tuple[dict, int]]:
+        """Attach block timestamps to a stream of events.
+
+        Events are read a window at a time. Blocks of the window missing from the cache are fetched in batches before the events of the window are yielded in their original order.
+
+        :param window: How many events are buffered
+        :return: Iterator of (event, timestamp) tuples
+        """
+        buffer = []
+        for event in events:
+            buffer.append(event)
+            if len(buffer) >= window:
+                yield from self._timestamp_window(web3, buffer)
+                buffer = []
+        yield from self._timestamp_window(web3, buffer)
+
+    def _timestamp_window(self, web3: Web3, events: list) -> Iterator[Tuple[dict, int]]:
+        if not events:
+            return
+        block_numbers = set(event["blockNumber"] for event in events)
+        timestamps = self.get_many(block_numbers)
+        missing = block_numbers - set(timestamps.keys())
+        if missing:
+            fetched = fetch_block_timestamps(web3, missing, self.batch_size, self.max_workers)
+            self.store(fetched)
+            self.fetch_count += len(fetched)
+            timestamps.update(fetched)
+        for event in events:
+            yield event, timestamps[event["blockNumber"]]
+
+    def import_json(self, json_path: str) -> int:
+        """Import the old ``block-timestamps.json`` file with string keys.
+
+        :return: Number of imported timestamps
+        """
+        with open(json_path, "rt") as inp:
+            data = json.load(inp)
+        self.store({int(block_number): int(timestamp) for block_number, timestamp in data.items()})
+        self.conn.commit()
+        return len(data)
+
+
+def open_timestamp_cache(web3: Web3, path: str=DEFAULT_CACHE_FILE, legacy_json_path: Optional[str]="block-timestamps.json", max_workers=1) -> BlockTimestampCache:
+    """Open the shared cache for the network web3 is connected to.
+
+    Timestamps from an old JSON cache file are imported when the SQLite cache is created.
+    """
+    cache = BlockTimestampCache(path, web3.version.network, max_workers=max_workers)
+    if legacy_json_path and not len(cache):
+        try:
+            logger.info("Imported %d timestamps from %s", cache.import_json(legacy_json_path), legacy_json_path)
+        except FileNotFoundError:
+            pass
+    return cache
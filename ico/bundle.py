@@ -0,0 +1,234 @@
+"""Offline signed transaction bundles.
+
+Bulk commands can sign their transactions with sequential nonces to a bundle file, which is broadcasted later with batched ``eth_sendRawTransaction`` calls.
+
+The bundle is a text file. The first line is a JSON header, each following line is one hex encoded raw transaction in nonce order::
+
+    {"version": 1, "from": "0x...", "chain_id": 1, "start_nonce": 120}
+    0xf86b...
+    0xf86b...
+"""
+import json
+import logging
+import os
+from typing import Iterable, List, Optional
+
+from eth_account import Account
+from eth_utils import keccak
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3 import Web3
+
+from ico.costs import CostTracker
+from ico.sender import TransactionSender
+from ico.utils import chunked
+from ico.utils import make_batch_request
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Bundle file format version written to the header
+BUNDLE_VERSION = 1
+
+#: Node errors telling that a raw transaction, or one with the same nonce, is already in the mempool or mined
+ALREADY_SENT_ERRORS = ("known transaction", "already known", "nonce too low")
+
+
+def get_chain_id(web3: Web3) -> Optional[int]:
+    """Ask the EIP-155 chain id from the node.
+
+    Network id is not the same thing, e.g. Ethereum Classic is network 1, but chain 61.
+
+    :return: Chain id or None if the node does not support ``eth_chainId``
+    """
+    try:
+        chain_id = web3.manager.request_blocking("eth_chainId", [])
+    except ValueError:
+        return None
+    return int(chain_id, 16) if isinstance(chain_id, str) else chain_id
+
+
+def is_already_sent(error: Exception) -> bool:
+    """Did the node reject a raw transaction because it has already been broadcasted."""
+    message = str(error).lower()
+    return any(text in message for text in ALREADY_SENT_ERRORS)
+
+
+class BundleSigner(TransactionSender):
+    """Sign transactions to a bundle file instead of broadcasting them.
+
+    See :py:class:`ico.sender.TransactionSender`.
+    Each transaction is written and synced to the disk as soon as it has been signed, so the bundle is usable up to the last signed transaction even if the command is interrupted.
+
+    Example::
+
+        signer = BundleSigner(web3, private_key, "distribution.bundle")
+        signer.transact(issuer.functions.issueMany(addresses, amounts), {"gas": 2000000, "gasPrice": gas_price})
+        signer.flush()
+    """
+
+    def __init__(self, web3: Web3, private_key: str, path: str, nonce: Optional[int]=None, chain_id: Optional[int]=None, journal=None):
+        """
+        :param private_key: Key of the account that pays for the transactions
+        :param path: Bundle file to create
+        :param nonce: Nonce of the first transaction. Defaults to the next nonce of the account on the node.
+        :param chain_id: EIP-155 chain id. Asked from the node if not given.
+        :param journal: Record signed transactions here as sent, see :py:class:`ico.sender.PipelinedSender`
+        """
+        self.web3 = web3
+        self.account = Account.privateKeyToAccount(private_key)
+        self.address = self.account.address
+        self.path = path
+        self.journal = journal
+
+        if nonce is None:
+            nonce = web3.eth.getTransactionCount(self.address, "pending")
+        self.nonce = self.start_nonce = nonce
+
+        if chain_id is None:
+            chain_id = get_chain_id(web3)
+            if chain_id is None:
+                raise RuntimeError("Node does not support eth_chainId, give the EIP-155 chain id explicitly")
+        self.chain_id = chain_id
+
+        #: Nothing gets mined while signing, see :py:class:`ico.sender.TransactionSender`
+        self.costs = CostTracker()
+
+        #: How many transactions we have signed
+        self.signed_count = 0
+
+        if os.path.exists(path):
+            raise RuntimeError("Bundle file {} already exists".format(path))
+
+        self.out = open(path, "wt")
+        header = {"version": BUNDLE_VERSION, "from": self.address, "chain_id": chain_id, "start_nonce": nonce}
+        self.write_line(json.dumps(header))
+
+    def write_line(self, line: str):
+        self.out.write(line + "\n")
+        self.out.flush()
+        os.fsync(self.out.fileno())
+
+    def transact(self, func, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Sign a contract function call.
+
+        :param tx_params: Transaction parameters. Must have ``gas`` and ``gasPrice``, so that the node is not asked to estimate them.
+        :return: Transaction hash
+        """
+        assert "gas" in tx_params and "gasPrice" in tx_params, "Signed transactions need explicit gas and gasPrice"
+        tx = func.buildTransaction(dict(tx_params, nonce=self.nonce, chainId=self.chain_id))
+        tx.pop("from", None)
+        return self.sign(tx, journal_keys)
+
+    def send_transaction(self, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Sign a plain transaction, e.g. ETH value transfer.
+
+        :return: Transaction hash
+        """
+        assert "gas" in tx_params and "gasPrice" in tx_params, "Signed transactions need explicit gas and gasPrice"
+        tx = dict(tx_params, nonce=self.nonce, chainId=self.chain_id)
+        tx.pop("from", None)
+        return self.sign(tx, journal_keys)
+
+    def sign(self, tx: dict, journal_keys: Iterable[str]=()) -> str:
+        """Sign a complete transaction and append it to the bundle."""
+        signed = self.account.signTransaction(tx)
+        txid = signed.hash.hex()
+        self.write_line(signed.rawTransaction.hex())
+
+        journal_keys = tuple(journal_keys)
+        if self.journal and journal_keys:
+            self.journal.mark_sent(journal_keys, txid, tx["nonce"], tx["gasPrice"])
+
+        self.nonce += 1
+        self.signed_count += 1
+        logger.debug("Signed %s with nonce %d", txid, tx["nonce"])
+        return txid
+
+    def poll(self) -> int:
+        return 0
+
+    def flush(self):
+        """Close the bundle file."""
+        if not self.out.closed:
+            self.out.close()
+
+
+class Bundle:
+    """Signed transactions read from a bundle file."""
+
+    def __init__(self, address: str, chain_id: Optional[int], start_nonce: int, raw_transactions: List[str]):
+        self.address = to_checksum_address(address)
+        self.chain_id = chain_id
+        self.start_nonce = start_nonce
+        self.raw_transactions = raw_transactions
+
+    @classmethod
+    def read(cls, path: str) -> "Bundle":
+        """Read a bundle file.
+
+        A partial last line, left by a signer that was killed in the middle of a write, is ignored.
+        """
+        with open(path, "rt") as inp:
+            lines = inp.read().split("\n")
+
+        # The last item is an empty string after the final newline or a torn write
+        if lines[-1]:
+            logger.warning("Ignoring torn last line in %s", path)
+        lines = lines[:-1]
+
+        header = json.loads(lines[0])
+        if header.get("version") != BUNDLE_VERSION:
+            raise RuntimeError("Unsupported bundle version {} in {}".format(header.get("version"), path))
+
+        return cls(header["from"], header["chain_id"], header["start_nonce"], [line for line in lines[1:] if line])
+
+    @property
+    def end_nonce(self) -> int:
+        """Nonce after the last transaction of the bundle."""
+        return self.start_nonce + len(self.raw_transactions)
+
+    def get_txids(self) -> List[str]:
+        """Hashes of the bundled transactions."""
+        return [HexBytes(keccak(hexstr=raw)).hex() for raw in self.raw_transactions]
+
+
+def _get_broadcast_txid(raw: str, result) -> str:
+    """Hash of a broadcasted transaction from the eth_sendRawTransaction result or error."""
+    if not isinstance(result, ValueError):
+        return HexBytes(result).hex()
+
+    if not is_already_sent(result):
+        raise result
+
+    txid = HexBytes(keccak(hexstr=raw)).hex()
+    logger.info("Node already has %s: %s", txid, result)
+    return txid
+
+
+def broadcast_bundle(web3: Web3, bundle: Bundle, batch_size=500) -> List[str]:
+    """Push the bundled transactions to the node, many in a single JSON-RPC batch.
+
+    Transactions whose nonce the account has already used are skipped, so an interrupted broadcast can be simply run again.
+    A transaction the node reports as already known or its nonce as used is taken as broadcasted.
+
+    :param batch_size: How many raw transactions are posted in one batch request
+    :return: Hashes of the broadcasted transactions
+    :raise RuntimeError: If the account nonce is behind the bundle, i.e. there is a gap that would leave the bundle stuck
+    """
+    next_nonce = web3.eth.getTransactionCount(bundle.address, "pending")
+    if next_nonce < bundle.start_nonce:
+        raise RuntimeError("Account {} is at nonce {}, but the bundle starts at nonce {}".format(bundle.address, next_nonce, bundle.start_nonce))
+
+    skip = min(next_nonce - bundle.start_nonce, len(bundle.raw_transactions))
+    if skip:
+        logger.info("Skipping %d transactions already known by the node", skip)
+
+    txids = []
+    for chunk in chunked(bundle.raw_transactions[skip:], batch_size):
+        results = make_batch_request(web3, [("eth_sendRawTransaction", [raw]) for raw in chunk], return_errors=True)
+        txids += [_get_broadcast_txid(raw, result) for raw, result in zip(chunk, results)]
+        logger.info("Broadcasted %d / %d transactions", skip + len(txids), len(bundle.raw_transactions))
+
+    return txids
@@ -9,8 +9,11 @@ from populus import Project
 from populus.utils.cli import request_account_unlock
 
 from ico.logutils import setup_console_logging
+from ico.utils import get_read_aggregator
+from ico.gasprice import get_gas_price_oracle
+from ico.dryrun import DryRunSender
 from ico.amlreclaim import prepare_csv
-from ico.amlreclaim import count_tokens_to_reclaim, reclaim_all
+from ico.amlreclaim import count_tokens_to_reclaim, reclaim_all, get_balances
 
 
 @click.command()
@@ -20,14 +23,20 @@ from ico.amlreclaim import count_tokens_to_reclaim, reclaim_all
 @click.option('--csv-file', nargs=1, help='CSV file containing distribution data', required=True)
 @click.option('--address-column', nargs=1, help='Name of CSV column containing Ethereum addresses', default="address")
 @click.option('--label-column', nargs=1, help='Name of CSV column containing label for addresses', default="label")
-@click.option('--gas-price', nargs=1, help='Gas price in GWei to used for the transactions')
-def main(chain, owner_address, token, csv_file, address_column, label_column, gas_price):
+@click.option('--gas-price', nargs=1, help='Gas price in GWei to used for the transactions. If not set use the gas price oracle.')
+@click.option('--max-gas-price', nargs=1, help='Never pay more than this gas price. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--batch-size', nargs=1, help='Max addresses reclaimed per transaction. Further limited by the block gas limit.', required=False, default=100, type=int)
+@click.option('--aggregator-address', nargs=1, help='Deployed ReadAggregator contract used to read balances of all addresses in few calls', required=False, default=None)
+@click.option('--dry-run', 'dry_run_report', nargs=1, help='Do not send anything, but simulate the reclaim transactions against the current chain state and write per transaction gas and failure report to this CSV file', required=False, default=None)
+def main(chain, owner_address, token, csv_file, address_column, label_column, gas_price, max_gas_price, batch_size, aggregator_address, dry_run_report):
     """Reclaim tokens that failed AML check.
 
     Before the token release, after AML/post sale KYC data has been assembled, go through the addresses that failed the checks and get back tokens from those buyers.
 
     Owner account must have balance to perform the the reclaim transactions.
 
+    With --dry-run, reclaim transactions are only simulated with eth_estimateGas to see the total gas cost and failing batches.
+
     Example:
 
         aml-reclaim \
@@ -53,7 +62,7 @@ def main(chain, owner_address, token, csv_file, address_column, label_column, ga
         logger.info("Owner account balance is %s ETH", from_wei(web3.eth.getBalance(owner_address), "ether"))
 
         # Goes through geth account unlock process if needed
-        if is_account_locked(web3, owner_address):
+        if not dry_run_report and is_account_locked(web3, owner_address):
             request_account_unlock(c, owner_address, timeout=3600*6)
             assert not is_account_locked(web3, owner_address)
 
@@ -66,11 +75,7 @@ def main(chain, owner_address, token, csv_file, address_column, label_column, ga
         logger.info("Total supply is %s", token.functions.totalSupply().call() / (10**decimals))
         logger.info("Owner account token balance is %s", token.functions.balanceOf(owner_address).call() / (10**decimals))
 
-        if gas_price:
-            gas_price = int(gas_price) * 10**9
-        else:
-            # Use default gas price with little multiplies to cut us at the front of the queue
-            gas_price = web3.eth.gasPrice * 1.2
+        gas_price = get_gas_price_oracle(web3, "reclaim", gas_price, max_gas_price).get_gas_price()
 
         tx_params = {
             "from": owner_address,
@@ -85,11 +90,21 @@ def main(chain, owner_address, token, csv_file, address_column, label_column, ga
 
         logger.info("Total %s rows", len(rows))
 
-        amount = count_tokens_to_reclaim(token, rows) / 10**decimals
+        # Same balance snapshot is used for counting and skipping already reclaimed addresses
+        balances = get_balances(token, rows, get_read_aggregator(c, aggregator_address))
+        amount = count_tokens_to_reclaim(token, rows, balances) / 10**decimals
         logger.info("Claiming total %f tokens", amount)
 
+        if dry_run_report:
+            sender = DryRunSender(web3, owner_address)
+            reclaim_all(token, rows, tx_params, balances=balances, batch_size=batch_size, sender=sender)
+            sender.write_report(dry_run_report)
+            logger.info("Dry run: %s", sender.get_summary())
+            logger.info("Per transaction report written to %s", dry_run_report)
+            return
+
         start_balance = from_wei(web3.eth.getBalance(owner_address), "ether")
-        reclaim_all(token, rows, tx_params)
+        reclaim_all(token, rows, tx_params, balances=balances, batch_size=batch_size)
 
         end_balance = from_wei(web3.eth.getBalance(owner_address), "ether")
         logger.info("Deployment cost is %f ETH", start_balance - end_balance)
@@ -0,0 +1,65 @@
+"""Broadcast a bundle of offline signed transactions."""
+import time
+
+import click
+from populus import Project
+
+from ico.bundle import Bundle
+from ico.bundle import broadcast_bundle
+from ico.bundle import get_chain_id
+from ico.utils import confirm_transactions
+
+
+@click.command()
+@click.option('--chain', nargs=1, default="mainnet", help='On which chain to broadcast - see populus.json')
+@click.option('--bundle-file', nargs=1, help='Bundle of signed transactions created with --sign-only', required=True)
+@click.option('--batch-size', nargs=1, help='How many raw transactions are posted in one JSON-RPC batch', required=False, default=500, type=int)
+@click.option('--wait/--no-wait', default=True, help='Wait until all broadcasted transactions are mined and check they did not fail')
+def main(chain, bundle_file, batch_size, wait):
+    """Broadcast offline signed transactions.
+
+    Bulk commands distribute-tokens, token-vault load and refund can sign their transactions
+    to a bundle file with --sign-only instead of sending them. This command pushes the bundle
+    to the node as fast as the node takes it and then waits for the receipts.
+
+    Transactions whose nonce has already been used by the account, or that the node already knows, are skipped,
+    so an interrupted broadcast can be run again with the same bundle.
+
+    Example:
+
+        broadcast-bundle --chain=mainnet --bundle-file=distribution.bundle
+    """
+
+    project = Project()
+
+    with project.get_chain(chain) as c:
+
+        web3 = c.web3
+        print("Web3 provider is", web3.providers[0])
+
+        bundle = Bundle.read(bundle_file)
+        print("Bundle has", len(bundle.raw_transactions), "transactions from", bundle.address, "nonces", bundle.start_nonce, "-", bundle.end_nonce - 1)
+
+        chain_id = get_chain_id(web3)
+        if chain_id is not None and bundle.chain_id is not None and bundle.chain_id != chain_id:
+            raise RuntimeError("Bundle is signed for chain {}, but the node is on chain {}".format(bundle.chain_id, chain_id))
+
+        start_time = time.time()
+        txids = broadcast_bundle(web3, bundle, batch_size)
+        print("Broadcasted", len(txids), "transactions in", time.time() - start_time, "seconds")
+
+        if not wait:
+            return
+
+        print("Waiting for", len(txids), "transactions to be mined")
+        results = confirm_transactions(web3, txids)
+        failed = [txid for txid, (receipt, tx_failed) in zip(txids, results) if tx_failed]
+        gas_used = sum(receipt["gasUsed"] for receipt, tx_failed in results)
+        print("Mined", len(results), "transactions using", gas_used, "gas,", len(failed), "failed")
+        for txid in failed:
+            print("Failed", txid)
+        print("All done! Enjoy your decentralized future.")
+
+
+if __name__ == "__main__":
+    main()
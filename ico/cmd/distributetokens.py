@@ -1,22 +1,262 @@
 """Distribute tokens in centrally issued crowdsale."""
 import csv
 import time
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
 
 import click
 from decimal import Decimal
 
 import sys
-from eth_utils import from_wei, to_wei
+from eth_utils import from_wei, to_wei, to_checksum_address
 from populus.utils.accounts import is_account_locked
 from populus import Project
 from populus.utils.cli import request_account_unlock
 from web3.middleware.signing import construct_sign_and_send_raw_middleware
 
 from ico.utils import check_succesful_tx
-from ico.utils import check_multiple_succesful_txs
+from ico.sender import build_sender
+from ico.sender import grant_sender_pool
+from ico.sender import read_private_keys
+from ico.sender import get_key_addresses
+from ico.dryrun import DryRunSender
+from ico.gaslimit import GasLimitPlanner
+from ico.journal import Journal
+from ico.journal import open_journal
+from ico.gasprice import get_gas_price_oracle
 from ico.etherscan import verify_contract
 from ico.etherscan import get_etherscan_link
 from ico.utils import get_constructor_arguments
+from ico.utils import get_chunk_size
+from ico.utils import chunked
+from ico.utils import get_read_aggregator
+from ico.utils import multicall
+
+
+#: Worst case gas cost of a single benefactor in BatchIssuer.issueMany()
+BATCH_ISSUE_GAS_PER_ROW = 80000
+
+#: Gas limit of Issuer.issue() if the node cannot estimate it
+ISSUE_FALLBACK_GAS = 200000
+
+
+def check_modes(address, issuer_address, private_key, sender_keys_file, journal_file, bundle_file, signing_key_file, dry_run_report) -> Optional[str]:
+    """Validate --dry-run and --sign-only options.
+
+    :return: Signing key with --sign-only
+    """
+    if dry_run_report:
+        if not issuer_address:
+            sys.exit("Deploy the issuer contract before a dry run, use --issuer-address")
+        if sender_keys_file or journal_file or bundle_file:
+            sys.exit("--dry-run cannot be used with --sender-keys-file, --journal or --sign-only")
+        return None
+
+    if not bundle_file:
+        return None
+
+    if not issuer_address:
+        sys.exit("Deploy the issuer contract before signing a bundle, use --issuer-address")
+    if sender_keys_file or journal_file:
+        sys.exit("--sign-only cannot be used with --sender-keys-file or --journal")
+    if not (private_key or signing_key_file):
+        sys.exit("--sign-only needs --private-key or --signing-key-file")
+    signing_key = private_key or read_private_keys(signing_key_file)[0]
+    if to_checksum_address(get_key_addresses([signing_key])[0]) != to_checksum_address(address):
+        sys.exit("Signing key does not belong to {}".format(address))
+    return signing_key
+
+
+def setup_accounts(c, address, private_key, sender_keys_file, batch_size, offline) -> List[str]:
+    """Add signing middleware for the keys we were given and unlock the deployer account.
+
+    :param offline: Nothing is sent from the deployer account, with --sign-only and --dry-run
+    :return: Addresses of the sender pool
+    """
+    web3 = c.web3
+
+    if private_key and not offline:
+        web3.middleware_stack.add(construct_sign_and_send_raw_middleware(private_key))
+
+    sender_addresses = []
+    if sender_keys_file:
+        if not batch_size:
+            sys.exit("Multiple senders need BatchIssuer contract, use --batch-size")
+        sender_keys = read_private_keys(sender_keys_file)
+        web3.middleware_stack.add(construct_sign_and_send_raw_middleware(sender_keys))
+        sender_addresses = get_key_addresses(sender_keys)
+        print("Using", len(sender_addresses), "sender accounts")
+
+    print("Web3 provider is", web3.providers[0])
+    print("Deployer account address is", address)
+    print("Deployer account balance is", from_wei(web3.eth.getBalance(address), "ether"), "ETH")
+
+    # Goes through geth account unlock process if needed
+    if not offline and is_account_locked(web3, address):
+        request_account_unlock(c, address, timeout=3600*6)
+        assert not is_account_locked(web3, address)
+
+    return sender_addresses
+
+
+def get_issuer(project, c, chain, address, token, issuer_address, master_address, batch_size, solc_version, transaction):
+    """Deploy a new issuer contract or use the existing one.
+
+    With --batch-size the issuer is BatchIssuer, otherwise Issuer.
+    """
+    web3 = c.web3
+
+    if batch_size:
+        issuer_contract_name = "BatchIssuer"
+    else:
+        issuer_contract_name = "Issuer"
+
+    Issuer = c.provider.get_base_contract_factory(issuer_contract_name)
+    if issuer_address:
+        print("Reusing existing issuer contract")
+        return Issuer(address=issuer_address)
+
+    # TODO: Fix Populus support this via an deploy argument
+    if "JSONFile" in c.registrar.registrar_backends:
+        del c.registrar.registrar_backends["JSONFile"]
+
+    # Create issuer contract
+    assert master_address, "You need to give master-address"
+    args = [address, master_address, token.address]
+    print("Deploying new issuer contract", args, "transaction parameters", transaction)
+    issuer, txhash = c.provider.deploy_contract(issuer_contract_name, deploy_transaction=transaction, deploy_args=args)
+
+    print("Deployment transaction is", txhash)
+    print("Waiting contract to be deployed")
+    check_succesful_tx(web3, txhash)
+
+    const_args = get_constructor_arguments(issuer, args)
+    print("Contract constructor arguments are", const_args)
+    chain_name = chain
+    fname = issuer_contract_name + ".sol"
+    browser_driver = "chrome"
+    verify_contract(
+        project=project,
+        libraries={},  # TODO: Figure out how to pass around
+        chain_name=chain_name,
+        address=issuer.address,
+        contract_name=issuer_contract_name,
+        contract_filename=fname,
+        constructor_args=const_args,
+        # libraries=runtime_data["contracts"][name]["libraries"],
+        browser_driver=browser_driver,
+        compiler=solc_version)
+    link = get_etherscan_link(chain_name, issuer.address)
+
+    print("Issuer verified contract is", link)
+    return issuer
+
+
+def read_rows(csv_file: str, address_column: str) -> List[dict]:
+    """Read the distribution CSV and check that we have unique addresses."""
+    print("Reading data", csv_file)
+    with open(csv_file, "rt") as inp:
+        reader = csv.DictReader(inp)
+        rows = [row for row in reader]
+
+    uniq_addresses = set()
+    for row in rows:
+        addr = row[address_column].strip()
+        if addr in uniq_addresses:
+            raise RuntimeError("Address appears twice in input data", addr)
+        uniq_addresses.add(addr)
+
+    return rows
+
+
+def get_issue_rows(rows: List[dict], row_range: range, address_column: str, amount_column: str, decimal_multiplier: int, allow_zero: bool, journaled: Set[str]) -> Iterator[Tuple[int, str, int]]:
+    """Validate rows and convert their amounts to raw token amounts.
+
+    Rows confirmed in the journal are left out, and zero amount rows if they are allowed.
+
+    :return: Iterator of (row index, address, raw token amount)
+    """
+    for i in row_range:
+        data = rows[i]
+        addr = data[address_column].strip()
+
+        if addr in journaled:
+            continue
+
+        tokens = Decimal(data[amount_column].strip())
+
+        tokens *= decimal_multiplier
+
+        if tokens == 0:
+            if not allow_zero:
+                raise RuntimeError("Encountered zero amount")
+            else:
+                continue
+
+        # http://stackoverflow.com/a/19965088/315168
+        if not tokens % 1 == 0:
+            raise RuntimeError("Could not issue tokens because after multiplication was not integer")
+
+        yield i, addr, int(tokens)
+
+
+def plan_issuance(issue_rows: Iterable[Tuple[int, str, int]], rows_end: int, issued: dict, issuer, sender, journal: Optional[Journal], gas_price_oracle) -> Iterator[Tuple[str, int]]:
+    """Skip rows the issuer has already issued and plan the rest.
+
+    :param rows_end: Index after the last row of this run, for the progress output
+    :return: Iterator of (address, raw token amount) to issue
+    """
+    start_time = time.time()
+    for i, addr, tokens in issue_rows:
+        print("Row", i,  "giving", tokens, "to", addr, "issuer", issuer.address, "time passed", time.time() - start_time, "gas price", gas_price_oracle.get_gas_price() / (10**9), sender.costs.get_summary(rows_left=rows_end - i))
+
+        if issued[addr]:
+            print("Already issued, skipping")
+            continue
+
+        if journal:
+            journal.plan([(addr, tokens)])
+
+        if isinstance(sender, DryRunSender):
+            sender.spend(tokens)
+
+        yield addr, tokens
+
+
+def issue_one_by_one(sender, issuer, gas_planner: GasLimitPlanner, gas_price_oracle, planned: Iterable[Tuple[str, int]]):
+    """Send an Issuer.issue() transaction per row."""
+    for addr, tokens in planned:
+        func = issuer.functions.issue(addr, tokens)
+        transaction = {
+            "gasPrice": gas_price_oracle.get_gas_price(),
+            "gas": gas_planner.get_gas_limit(func, fallback_gas=ISSUE_FALLBACK_GAS),
+        }
+        sender.transact(func, transaction, journal_keys=[addr])
+
+
+def issue_in_batches(sender, issuer, gas_planner: GasLimitPlanner, gas_price_oracle, planned: Iterable[Tuple[str, int]], chunk_size: int):
+    """Pack rows to BatchIssuer.issueMany() transactions of up to chunk_size rows."""
+    for batch in chunked(planned, chunk_size):
+        benefactors = [addr for addr, tokens in batch]
+        amounts = [tokens for addr, tokens in batch]
+        func = issuer.functions.issueMany(benefactors, amounts)
+        transaction = {
+            "gasPrice": gas_price_oracle.get_gas_price(),
+            "gas": gas_planner.get_gas_limit(func, fallback_gas=100000 + BATCH_ISSUE_GAS_PER_ROW * len(batch)),
+        }
+        txid = sender.transact(func, transaction, journal_keys=benefactors, rows=len(batch))
+        print("Issuing batch of", len(batch), "rows in", txid)
+
+
+def print_outcome(sender, dry_run_report: Optional[str], bundle_file: Optional[str]):
+    """Write the dry run report or tell what was signed or spent."""
+    if dry_run_report:
+        sender.write_report(dry_run_report)
+        print("Dry run:", sender.get_summary())
+        print("Per transaction report written to", dry_run_report)
+    elif bundle_file:
+        print("Signed", sender.signed_count, "transactions to", bundle_file, "- broadcast them with broadcast-bundle")
+    else:
+        print("Distribution cost:", sender.costs.get_summary())
 
 
 @click.command()
@@ -29,19 +269,47 @@ from ico.utils import get_constructor_arguments
 @click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=10000)
 @click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0)
 @click.option('--issuer-address', nargs=1, help='The address of the issuer contract - leave out for the first run to deploy a new issuer contract', required=False, default=None)
-@click.option('--gas-price', nargs=1, help='Override gas price. If not set use the default * 2.0. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--gas-price', nargs=1, help='Override gas price. If not set use the gas price oracle. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--max-gas-price', nargs=1, help='Never pay more than this gas price. Specify in Gwei e.g. 50.', required=False, default=None)
 @click.option('--master-address', nargs=1, help='The team multisig wallet address that does StandardToken.approve() for the issuer contract', required=False, default=None)
 @click.option('--solc-version', nargs=1, help='Menu item for the solc compiler verification on EtherScan', required=False, default="v0.4.24+commit.e67f0147")
 @click.option('--allow-zero/--no-allow-zero', default=False, help='Stops the script if a zero amount row is encountered')
 @click.option('--private-key',  default=None, help='private-key used for making transactions')
-def main(chain, address, token, csv_file, limit, start_from, issuer_address, address_column, amount_column, allow_zero, master_address, gas_price, solc_version, private_key):
+@click.option('--max-in-flight', nargs=1, help='How many unconfirmed issue transactions we keep in the mempool at once', required=False, default=16, type=int)
+@click.option('--stuck-timeout', nargs=1, help='Rebroadcast a transaction not mined in this many seconds with a higher gas price. Leave out to disable.', required=False, default=None, type=int)
+@click.option('--batch-size', nargs=1, help='Issue up to this many rows per transaction using BatchIssuer contract. The batch is further limited by the block gas limit. 0 uses the one row per transaction Issuer contract.', required=False, default=0, type=int)
+@click.option('--aggregator-address', nargs=1, help='Deployed ReadAggregator contract used to read already issued status for all rows in few calls', required=False, default=None)
+@click.option('--sender-keys-file', nargs=1, help='File of private keys, one per line. Transactions are spread over these accounts for parallel nonce sequences. Requires --batch-size. The --address account makes them issuers.', required=False, default=None)
+@click.option('--journal', 'journal_file', nargs=1, help='SQLite file where the progress is recorded. Rerunning with the same journal skips confirmed rows without checking them from the chain.', required=False, default=None)
+@click.option('--sign-only', 'bundle_file', nargs=1, help='Do not send anything, but sign the transactions to this bundle file for broadcast-bundle command. Needs --issuer-address and --private-key or --signing-key-file.', required=False, default=None)
+@click.option('--signing-key-file', nargs=1, help='File with the private key of --address for --sign-only', required=False, default=None)
+@click.option('--chain-id', nargs=1, help='EIP-155 chain id for --sign-only. Asked from the node if not given. Needed when the node does not support eth_chainId.', required=False, default=None, type=int)
+@click.option('--dry-run', 'dry_run_report', nargs=1, help='Do not send anything, but simulate the transactions against the current chain state and write per transaction gas and failure report to this CSV file. Needs --issuer-address.', required=False, default=None)
+def main(chain, address, token, csv_file, limit, start_from, issuer_address, address_column, amount_column, allow_zero, master_address, gas_price, max_gas_price, solc_version, private_key, max_in_flight, batch_size, aggregator_address, journal_file, sender_keys_file, stuck_timeout, bundle_file, signing_key_file, dry_run_report, chain_id):
     """Distribute tokens to centrally issued crowdsale participant or bounty program participants.
 
     Reads in distribution data as CSV. Then uses Issuer contract to distribute tokens.
     All token counts are multiplied by token contract decimal specifier. E.g. if CSV has amount 15.5,
     token has 2 decimal places, we will issue out 1550 raw token amount.
 
-    To speed up the issuance, transactions are verified in batches. Each batch is 16 transactions at a time.
+    To speed up the issuance, nonces are managed locally and up to --max-in-flight transactions are kept unconfirmed in the mempool.
+    A new transaction is sent as soon as any of the pending ones confirms.
+
+    With --batch-size, BatchIssuer contract is used instead of Issuer and multiple rows are packed to a single issueMany() transaction.
+    The same issuer contract type must be used for the subsequent runs.
+
+    With --sender-keys-file, rows are sharded across multiple accounts, each keeping --max-in-flight
+    transactions in the mempool. The accounts need ETH for gas.
+
+    With --journal, the state of each row is recorded in a local SQLite file.
+    If the run is interrupted, rerun with the same journal: confirmed rows are skipped
+    and only transactions that were in flight are checked.
+
+    With --sign-only, transactions are signed with sequential nonces to a bundle file instead of sending them.
+    The key can stay on a cold machine, and the bundle is broadcasted later with broadcast-bundle command.
+    The --address account must not send other transactions before the bundle has been broadcasted.
+
+    With --dry-run, transactions are only simulated with eth_estimateGas to see the total gas cost and failing rows before spending any ETH.
 
     Example (first run):
 
@@ -59,17 +327,8 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
 
         web3 = c.web3
 
-        if private_key:
-            web3.middleware_stack.add(construct_sign_and_send_raw_middleware(private_key))
-
-        print("Web3 provider is", web3.providers[0])
-        print("Deployer account address is", address)
-        print("Deployer account balance is", from_wei(web3.eth.getBalance(address), "ether"), "ETH")
-
-        # Goes through geth account unlock process if needed
-        if is_account_locked(web3, address):
-            request_account_unlock(c, address, timeout=3600*6)
-            assert not is_account_locked(web3, address)
+        signing_key = check_modes(address, issuer_address, private_key, sender_keys_file, journal_file, bundle_file, signing_key_file, dry_run_report)
+        sender_addresses = setup_accounts(c, address, private_key, sender_keys_file, batch_size, offline=bool(bundle_file or dry_run_report))
 
         Token = c.provider.get_base_contract_factory('CentrallyIssuedToken')
         token = Token(address=token)
@@ -85,10 +344,8 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
 
         decimal_multiplier = 10**decimals
 
-        if gas_price:
-            gas_price = int(gas_price) * 10**9
-        else:
-            gas_price = web3.eth.gasPrice * 2
+        gas_price_oracle = get_gas_price_oracle(web3, "distribute", gas_price, max_gas_price)
+        gas_price = gas_price_oracle.get_gas_price()
 
         transaction = {
             "from": address,
@@ -97,45 +354,7 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
 
         print("Using gas price of", gas_price / 10**9, "GWei")
 
-        Issuer = c.provider.get_base_contract_factory('Issuer')
-        if not issuer_address:
-
-            # TODO: Fix Populus support this via an deploy argument
-            if "JSONFile" in c.registrar.registrar_backends:
-                del c.registrar.registrar_backends["JSONFile"]
-
-            # Create issuer contract
-            assert master_address, "You need to give master-address"
-            args = [address, master_address, token.address]
-            print("Deploying new issuer contract", args, "transaction parameters", transaction)
-            issuer, txhash = c.provider.deploy_contract("Issuer", deploy_transaction=transaction, deploy_args=args)
-
-            print("Deployment transaction is", txhash)
-            print("Waiting contract to be deployed")
-            check_succesful_tx(web3, txhash)
-
-            const_args = get_constructor_arguments(issuer, args)
-            print("Contract constructor arguments are", const_args)
-            chain_name = chain
-            fname = "Issuer.sol"
-            browser_driver = "chrome"
-            verify_contract(
-                project=project,
-                libraries={},  # TODO: Figure out how to pass around
-                chain_name=chain_name,
-                address=issuer.address,
-                contract_name="Issuer",
-                contract_filename=fname,
-                constructor_args=const_args,
-                # libraries=runtime_data["contracts"][name]["libraries"],
-                browser_driver=browser_driver,
-                compiler=solc_version)
-            link = get_etherscan_link(chain_name, issuer.address)
-
-            print("Issuer verified contract is", link)
-        else:
-            print("Reusing existing issuer contract")
-            issuer = Issuer(address=issuer_address)
+        issuer = get_issuer(project, c, chain, address, token, issuer_address, master_address, batch_size, solc_version, transaction)
 
         print("Issuer contract is", issuer.address)
         print("Currently issued", issuer.functions.issuedCount().call())
@@ -146,79 +365,59 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
         allowance = token.functions.allowance(master_address, issuer.address).call()
         print("Issuer allowance", allowance)
 
-        if allowance == 0 or not master_address:
+        if allowance == 0:
             sys.exit("Please use Token.approve() to give some allowance for the issuer contract by master address")
 
-        print("Reading data", csv_file)
-        with open(csv_file, "rt") as inp:
-            reader = csv.DictReader(inp)
-            rows = [row for row in reader]
-
-        # Check that we have unique addresses
-        uniq_addresses = set()
-        for row in rows:
-            addr = row[address_column].strip()
-            if addr in uniq_addresses:
-                raise RuntimeError("Address appears twice in input data", addr)
-            uniq_addresses.add(addr)
-
-        # Start distribution
-        start_time = time.time()
-        start_balance = from_wei(web3.eth.getBalance(address), "ether")
-
-        tx_to_confirm = []   # List of txids to confirm
-        tx_batch_size = 16  # How many transactions confirm once
-
-        print("Total rows", len(rows))
-
-        for i in range(start_from, min(start_from+limit, len(rows))):
-            data = rows[i]
-            addr = data[address_column].strip()
-            tokens = Decimal(data[amount_column].strip())
-
-            tokens *= decimal_multiplier
+        rows = read_rows(csv_file, address_column)
 
-            end_balance = from_wei(web3.eth.getBalance(address), "ether")
-            spent = start_balance - end_balance
+        journal, journaled = open_journal(web3, journal_file, context="distribute-tokens:{}".format(issuer.address))
 
-            if tokens == 0:
-                if not allow_zero:
-                    raise RuntimeError("Encountered zero amount")
-                else:
-                    continue
+        aggregator = get_read_aggregator(c, aggregator_address)
 
-            # http://stackoverflow.com/a/19965088/315168
-            if not tokens % 1 == 0:
-                raise RuntimeError("Could not issue tokens because after multiplication was not integer")
+        if sender_addresses:
+            granted = grant_sender_pool(issuer, address, sender_addresses, "issuers", "setIssuer", {"gasPrice": gas_price}, aggregator)
+            print("Granted issuer rights to", granted, "new sender accounts")
 
-            transaction = {
-                "from": address,
-                "gasPrice": gas_price,
-                "gas": 200000,  # Use 100k limit
-            }
+        # Estimate gas once per transaction shape instead of a fixed limit or an estimate per row
+        gas_planner = GasLimitPlanner(web3, address)
 
-            tokens = int(tokens)
+        sender = build_sender(web3, address, sender_addresses, bundle_file=bundle_file, signing_key=signing_key, chain_id=chain_id, dry_run=bool(dry_run_report), max_in_flight=max_in_flight, journal=journal, stuck_timeout=stuck_timeout, max_gas_price=gas_price_oracle.max_gas_price, gas_planner=gas_planner)
+        if dry_run_report:
+            sender.add_limit("issuer allowance", allowance)
+            sender.add_limit("master balance", token.functions.balanceOf(master_address).call())
+            print("Dry run, simulating transactions")
+        elif bundle_file:
+            print("Signing transactions to", bundle_file, "starting from nonce", sender.nonce)
 
-            print("Row", i,  "giving", tokens, "to", addr, "issuer", issuer.address, "time passed", time.time() - start_time, "ETH passed", spent, "gas price", transaction["gasPrice"] / (10**9))
-
-            if issuer.functions.issued(addr).call():
-                print("Already issued, skipping")
-                continue
-
-            txid = issuer.functions.issue(addr, tokens).transact(transaction)
-
-            tx_to_confirm.append(txid)
-
-            # Confirm N transactions when batch max size is reached
-            if len(tx_to_confirm) >= tx_batch_size:
-                check_multiple_succesful_txs(web3, tx_to_confirm)
-                tx_to_confirm = []
+        print("Total rows", len(rows))
+        print("Keeping", max_in_flight, "transactions in flight per sender account")
+
+        # Read issued status for all rows we are going to process in one go,
+        # rows confirmed in the journal need no checking
+        row_range = range(start_from, min(start_from+limit, len(rows)))
+        row_addresses = [rows[i][address_column].strip() for i in row_range]
+        row_addresses = [addr for addr in row_addresses if addr not in journaled]
+        print("Checking already issued status of", len(row_addresses), "addresses")
+        issued = dict(zip(row_addresses, multicall(web3, [(issuer, "issued", [addr]) for addr in row_addresses], aggregator)))
+
+        issue_rows = get_issue_rows(rows, row_range, address_column, amount_column, decimal_multiplier, allow_zero, journaled)
+        planned = plan_issuance(issue_rows, row_range.stop, issued, issuer, sender, journal, gas_price_oracle)
+
+        if batch_size:
+            chunk_size = get_chunk_size(web3, BATCH_ISSUE_GAS_PER_ROW, batch_size)
+            print("Issuing up to", chunk_size, "rows per transaction")
+            issue_in_batches(sender, issuer, gas_planner, gas_price_oracle, planned, chunk_size)
+        else:
+            issue_one_by_one(sender, issuer, gas_planner, gas_price_oracle, planned)
 
         # Confirm dangling transactions
-        check_multiple_succesful_txs(web3, tx_to_confirm)
+        sender.flush()
+
+        if journal:
+            print("Journal row status", journal.get_counts())
+            journal.close()
 
-        end_balance = from_wei(web3.eth.getBalance(address), "ether")
-        print("Deployment cost is", start_balance - end_balance, "ETH")
+        print_outcome(sender, dry_run_report, bundle_file)
         print("All done! Enjoy your decentralized future.")
 
 
@@ -1,6 +1,7 @@
 """Distribute tokens in centrally issued crowdsale using an external id."""
 import csv
 import time
+from typing import List, Optional, Set
 
 import click
 from decimal import Decimal
@@ -12,10 +13,143 @@ from populus import Project
 from populus.utils.cli import request_account_unlock
 
 from ico.utils import check_succesful_tx, validate_ethereum_address
-from ico.utils import check_multiple_succesful_txs
+from ico.sender import PipelinedSender
+from ico.journal import Journal
+from ico.journal import open_journal
+from ico.gasprice import get_gas_price_oracle
+from ico.gaslimit import GasLimitPlanner
 from ico.etherscan import verify_contract
 from ico.etherscan import get_etherscan_link
 from ico.utils import get_constructor_arguments
+from ico.utils import get_read_aggregator
+from ico.utils import multicall
+
+
+def parse_external_id(value: str):
+    """Read an external id CSV cell as the main loop does, None if it is not an integer."""
+    try:
+        return int(value.strip())
+    except ValueError:
+        return None
+
+
+def get_issuer(project, c, chain, address, token, issuer_address, master_address, solc_version, transaction):
+    """Deploy a new IssuerWithId contract or use the existing one."""
+    web3 = c.web3
+
+    IssuerWithId = c.provider.get_base_contract_factory('IssuerWithId')
+    if issuer_address:
+        print("Using existing issuer contract")
+        return IssuerWithId(address=issuer_address)
+
+    # TODO: Fix Populus support this via an deploy argument
+    if "JSONFile" in c.registrar.registrar_backends:
+        del c.registrar.registrar_backends["JSONFile"]
+
+    # Create issuer contract
+    assert master_address, "You need to give master-address"
+    args = [address, master_address, token.address]
+    print("Deploying new issuer contract", args, "transaction parameters", transaction)
+    issuer, txhash = c.provider.deploy_contract("IssuerWithId", deploy_transaction=transaction, deploy_args=args)
+
+    print("Deployment transaction is", txhash)
+    print("Waiting contract to be deployed")
+    check_succesful_tx(web3, txhash)
+
+    const_args = get_constructor_arguments(issuer, args)
+    print("Contract constructor arguments are", const_args)
+    chain_name = chain
+    fname = "IssuerWithId.sol"
+    browser_driver = "chrome"
+    verify_contract(
+        project=project,
+        libraries={},  # TODO: Figure out how to pass around
+        chain_name=chain_name,
+        address=issuer.address,
+        contract_name="IssuerWithId",
+        contract_filename=fname,
+        constructor_args=const_args,
+        browser_driver=browser_driver,
+        compiler=solc_version)
+    link = get_etherscan_link(chain_name, issuer.address)
+    print("Issuer verified contract is", link)
+    return issuer
+
+
+def read_rows(csv_file: str, address_column: str, external_id_column: str) -> List[dict]:
+    """Read the distribution CSV and blank out invalid addresses."""
+    print("Reading data", csv_file)
+    with open(csv_file, "rt") as inp:
+        reader = csv.DictReader(inp)
+        rows = [row for row in reader]
+
+    # Prevalidate addresses
+    # For distributetokens.py this is done by combine-csv
+    # Here we do it inline and make skip addresses that are not valid.
+    for idx, row in enumerate(rows):
+        addr = row[address_column].strip()
+        try:
+            if addr:
+                validate_ethereum_address(addr)
+        except ValueError as e:
+            print("Invalid Ethereum address on row:", idx+1, "address:", addr, "reason:", str(e), "external_id:", row[external_id_column])
+            # Proceed regardless of invalid data
+            row[address_column] = ""
+
+    return rows
+
+
+def issue_rows(sender: PipelinedSender, issuer, gas_planner: GasLimitPlanner, gas_price_oracle, rows: List[dict], row_range: range, address_column: str, amount_column: str, external_id_column: str, decimal_multiplier: int, allow_addresless: bool, issued: dict, journal: Optional[Journal], journaled: Set[str]):
+    """Send an IssuerWithId.issue() transaction per row that has not been issued yet."""
+    start_time = time.time()
+
+    for i in row_range:
+        data = rows[i]
+        addr = data[address_column].strip()
+        external_id = data[external_id_column].strip()
+
+        if str(parse_external_id(external_id)) in journaled:
+            continue
+
+        tokens = Decimal(data[amount_column].strip())
+
+        tokens *= decimal_multiplier
+
+        if addr == "":
+            if not allow_addresless:
+                raise RuntimeError("Encountered missing address")
+            else:
+                continue
+
+        if not external_id:
+            raise RuntimeError("Missing external id on row #{}".format(i+1))
+
+        # http://stackoverflow.com/a/19965088/315168
+        if not tokens % 1 == 0:
+            raise RuntimeError("Could not issue tokens because after multiplication was not integer")
+
+        transaction = {
+            "gasPrice": gas_price_oracle.get_gas_price(),
+        }
+
+        tokens = int(tokens)
+        external_id = int(external_id)
+
+        if not external_id > 0:
+            raise RuntimeError("External id must be a positive integer on row #{}".format(i+1))
+
+        print("Row", i,  "giving", tokens, "to", addr, "issuer", issuer.address, "time passed", time.time() - start_time, "gas price", transaction["gasPrice"] / (10**9), sender.costs.get_summary(rows_left=row_range.stop - i))
+
+        if issued[external_id]:
+            print("Already issued, skipping")
+            continue
+
+        if journal:
+            journal.plan([(external_id, tokens)])
+
+        func = issuer.functions.issue(addr, tokens, external_id)
+        transaction["gas"] = gas_planner.get_gas_limit(func, fallback_gas=100000)
+        sender.transact(func, transaction, journal_keys=[external_id])
 
 
 @click.command()
@@ -29,11 +163,16 @@ from ico.utils import get_constructor_arguments
 @click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=1000)
 @click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0)
 @click.option('--issuer-address', nargs=1, help='The address of the issuer contract - leave out for the first run to deploy a new issuer contract', required=False, default=None)
-@click.option('--gas-price', nargs=1, help='Override gas price. If not set use the default * 2.0. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--gas-price', nargs=1, help='Override gas price. If not set use the gas price oracle. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--max-gas-price', nargs=1, help='Never pay more than this gas price. Specify in Gwei e.g. 50.', required=False, default=None)
 @click.option('--master-address', nargs=1, help='The team multisig wallet address that does StandardToken.approve() for the issuer contract', required=False, default=None)
 @click.option('--solc-version', nargs=1, help='Menu item for the solc compiler verification on EtherScan', required=False, default="v0.4.16+commit.d7661dd9")
 @click.option('--allow-addresless', default=True, help='If address column is not filled in skip the participant')
-def main(chain, address, token, csv_file, limit, start_from, issuer_address, address_column, amount_column, external_id_column, allow_addresless, master_address, gas_price, solc_version):
+@click.option('--aggregator-address', nargs=1, help='Deployed ReadAggregator contract used to read already issued status for all rows in few calls', required=False, default=None)
+@click.option('--max-in-flight', nargs=1, help='How many unconfirmed issue transactions we keep in the mempool at once', required=False, default=16, type=int)
+@click.option('--stuck-timeout', nargs=1, help='Rebroadcast a transaction not mined in this many seconds with a higher gas price. Leave out to disable.', required=False, default=None, type=int)
+@click.option('--journal', 'journal_file', nargs=1, help='SQLite file where the progress is recorded. Rerunning with the same journal skips confirmed rows without checking them from the chain.', required=False, default=None)
+def main(chain, address, token, csv_file, limit, start_from, issuer_address, address_column, amount_column, external_id_column, allow_addresless, master_address, gas_price, max_gas_price, solc_version, aggregator_address, max_in_flight, journal_file, stuck_timeout):
     """Distribute tokens to centrally issued crowdsale participant or bounty program participants using an external key.
 
     Reads in distribution data as CSV. Then uses Issuer contract to distribute tokens.
@@ -43,7 +182,11 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
     The external id uniquely identifies participants. This is different from the distribute-tokens where the
     Ethereum address uniquely identifies participants.
 
-    To speed up the issuance, transactions are verified in batches. Each batch is 16 transactions at a time.
+    To speed up the issuance, nonces are managed locally and up to --max-in-flight transactions are kept unconfirmed in the mempool.
+
+    With --journal, the state of each external id is recorded in a local SQLite file.
+    If the run is interrupted, rerun with the same journal: confirmed rows are skipped
+    and only transactions that were in flight are checked.
 
     First have a issuer contract created:
 
@@ -104,10 +247,8 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
 
         decimal_multiplier = 10**decimals
 
-        if gas_price:
-            gas_price = int(gas_price) * 10**9
-        else:
-            gas_price = web3.eth.gasPrice * 2
+        gas_price_oracle = get_gas_price_oracle(web3, "distribute", gas_price, max_gas_price)
+        gas_price = gas_price_oracle.get_gas_price()
 
         transaction = {
             "from": address,
@@ -116,43 +257,7 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
 
         print("Using gas price of", gas_price / 10**9, "GWei")
 
-        IssuerWithId = c.provider.get_base_contract_factory('IssuerWithId')
-        if not issuer_address:
-
-            # TODO: Fix Populus support this via an deploy argument
-            if "JSONFile" in c.registrar.registrar_backends:
-                del c.registrar.registrar_backends["JSONFile"]
-
-            # Create issuer contract
-            assert master_address, "You need to give master-address"
-            args = [address, master_address, token.address]
-            print("Deploying new issuer contract", args, "transaction parameters", transaction)
-            issuer, txhash = c.provider.deploy_contract("IssuerWithId", deploy_transaction=transaction, deploy_args=args)
-
-            print("Deployment transaction is", txhash)
-            print("Waiting contract to be deployed")
-            check_succesful_tx(web3, txhash)
-
-            const_args = get_constructor_arguments(issuer, args)
-            print("Contract constructor arguments are", const_args)
-            chain_name = chain
-            fname = "IssuerWithId.sol"
-            browser_driver = "chrome"
-            verify_contract(
-                project=project,
-                libraries={},  # TODO: Figure out how to pass around
-                chain_name=chain_name,
-                address=issuer.address,
-                contract_name="IssuerWithId",
-                contract_filename=fname,
-                constructor_args=const_args,
-                browser_driver=browser_driver,
-                compiler=solc_version)
-            link = get_etherscan_link(chain_name, issuer.address)
-            print("Issuer verified contract is", link)
-        else:
-            print("Using existing issuer contract")
-            issuer = IssuerWithId(address=issuer_address)
+        issuer = get_issuer(project, c, chain, address, token, issuer_address, master_address, solc_version, transaction)
 
         print("Issuer contract is", issuer.address)
         print("Currently issued", issuer.functions.issuedCount().call())
@@ -163,91 +268,37 @@ def main(chain, address, token, csv_file, limit, start_from, issuer_address, add
         allowance = token.functions.allowance(master_address, issuer.address).call()
         print("Issuer allowance", allowance)
 
-        if allowance == 0 or not master_address:
+        if allowance == 0:
             sys.exit("Please use Token.approve() to give some allowance for the issuer contract by master address")
 
-        print("Reading data", csv_file)
-        with open(csv_file, "rt") as inp:
-            reader = csv.DictReader(inp)
-            rows = [row for row in reader]
-
-        # Prevalidate addresses
-        # For distributetokens.py this is done by combine-csv
-        # Here we do it inline and make skip addresses that are not valid.
-        for idx, row in enumerate(rows):
-            addr = row[address_column].strip()
-            try:
-                if addr:
-                    validate_ethereum_address(addr)
-            except ValueError as e:
-                print("Invalid Ethereum address on row:", idx+1, "address:", addr, "reason:", str(e), "external_id:", row[external_id_column])
-                # Proceed regardless of invalid data
-                row[address_column] = ""
-
-        # Start distribution
-        start_time = time.time()
-        start_balance = from_wei(web3.eth.getBalance(address), "ether")
-
-        tx_to_confirm = []   # List of txids to confirm
-        tx_batch_size = 16  # How many transactions confirm once
+        rows = read_rows(csv_file, address_column, external_id_column)
 
-        print("Total rows", len(rows))
-
-        for i in range(start_from, min(start_from+limit, len(rows))):
-            data = rows[i]
-            addr = data[address_column].strip()
-            external_id = data[external_id_column].strip()
-            tokens = Decimal(data[amount_column].strip())
-
-            tokens *= decimal_multiplier
-
-            end_balance = from_wei(web3.eth.getBalance(address), "ether")
-            spent = start_balance - end_balance
-
-            if addr == "":
-                if not allow_addresless:
-                    raise RuntimeError("Encountered missing address")
-                else:
-                    continue
-
-            if not external_id:
-                raise RuntimeError("Missing external id on row #{}".format(i+1))
-
-            # http://stackoverflow.com/a/19965088/315168
-            if not tokens % 1 == 0:
-                raise RuntimeError("Could not issue tokens because after multiplication was not integer")
+        journal, journaled = open_journal(web3, journal_file, context="distribute-tokens-ext-id:{}".format(issuer.address))
 
-            transaction = {
-                "from": address,
-                "gasPrice": gas_price,
-                "gas": 100000,  # Use 100k gas unit limit
-            }
+        gas_planner = GasLimitPlanner(web3, address)
+        sender = PipelinedSender(web3, address, max_in_flight=max_in_flight, journal=journal, stuck_timeout=stuck_timeout, max_gas_price=gas_price_oracle.max_gas_price, gas_planner=gas_planner)
 
-            tokens = int(tokens)
-            external_id = int(external_id)
-
-            if not external_id > 0:
-                raise RuntimeError("External id must be a positive integer on row #{}".format(i+1))
-
-            print("Row", i,  "giving", tokens, "to", addr, "issuer", issuer.address, "time passed", time.time() - start_time, "ETH passed", spent, "gas price", transaction["gasPrice"] / (10**9))
-
-            if issuer.functions.issued(external_id).call():
-                print("Already issued, skipping")
-                continue
+        print("Total rows", len(rows))
 
-            txid = issuer.functions.issue(addr, tokens, external_id).transact(transaction)
-            tx_to_confirm.append(txid)
+        # Read issued status for all external ids we are going to process in one go,
+        # rows with bad data are dealt with in the main loop
+        row_range = range(start_from, min(start_from+limit, len(rows)))
+        aggregator = get_read_aggregator(c, aggregator_address)
+        row_ids = [parse_external_id(rows[i][external_id_column]) for i in row_range]
+        row_ids = sorted(set(external_id for external_id in row_ids if external_id is not None and external_id > 0 and str(external_id) not in journaled))
+        print("Checking already issued status of", len(row_ids), "external ids")
+        issued = dict(zip(row_ids, multicall(web3, [(issuer, "issued", [external_id]) for external_id in row_ids], aggregator)))
 
-            # Confirm N transactions when batch max size is reached
-            if len(tx_to_confirm) >= tx_batch_size:
-                check_multiple_succesful_txs(web3, tx_to_confirm)
-                tx_to_confirm = []
+        issue_rows(sender, issuer, gas_planner, gas_price_oracle, rows, row_range, address_column, amount_column, external_id_column, decimal_multiplier, allow_addresless, issued, journal, journaled)
 
         # Confirm dangling transactions
-        check_multiple_succesful_txs(web3, tx_to_confirm)
+        sender.flush()
+
+        if journal:
+            print("Journal row status", journal.get_counts())
+            journal.close()
 
-        end_balance = from_wei(web3.eth.getBalance(address), "ether")
-        print("Deployment cost is", start_balance - end_balance, "ETH")
+        print("Distribution cost:", sender.costs.get_summary())
         print("All done! Enjoy your decentralized future.")
 
 
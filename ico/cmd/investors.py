@@ -1,19 +1,43 @@
 """Extract crowdsale investor data."""
-import csv
-import datetime
-from collections import OrderedDict
+import sys
 
 import click
 from eth_utils import from_wei
 from populus import Project
 
+from ico.eventindex import DEFAULT_INDEX_FILE
+from ico.eventindex import index_and_read_many
+from ico.eventindex import open_event_index
+from ico.blocktimes import DEFAULT_CACHE_FILE
+from ico.blocktimes import open_timestamp_cache
+from ico.extractpipeline import investor_rows
+from ico.extractpipeline import merge_investors
+from ico.extractpipeline import write_csv
+
 
 @click.command()
 @click.option('--chain', nargs=1, default="mainnet", help='On which chain to deploy - see populus.json')
-@click.option('--address', nargs=1, help='CrowdsaleContract address to scan', required=True)
+@click.option('--address', nargs=1, help='Contract address to scan. Can be given multiple times to scan several contracts in one pass.', required=True, multiple=True)
+@click.option('--contract-name', nargs=1, help='Contract type of each --address in the same order, e.g. PresaleFundCollector, PreICOProxyBuyer or PaymentForwarder. MintedTokenCappedCrowdsale if not given.', required=False, multiple=True)
+@click.option('--event', 'event_names', nargs=1, help='Payment event to read. Can be given multiple times.', required=False, multiple=True, default=("Invested", "PaymentForwarded"))
 @click.option('--csv-file', nargs=1, help='CSV fil to write', default=None)
-def main(chain, address, csv_file):
-    """Extract crowdsale contract investors."""
+@click.option('--from-block', nargs=1, help='Start scanning events from this block, e.g. the contract deployment block', required=False, default=0, type=int)
+@click.option('--timestamp-cache', nargs=1, help='SQLite file where block timestamps are cached between runs', required=False, default=DEFAULT_CACHE_FILE)
+@click.option('--fetch-workers', nargs=1, help='How many block header batch requests are made concurrently, HTTP providers only', required=False, default=1, type=int)
+@click.option('--event-index', nargs=1, help='SQLite file where events are indexed between runs, only new blocks are scanned', required=False, default=DEFAULT_INDEX_FILE)
+@click.option('--reorg-depth', nargs=1, help='How many last indexed blocks are scanned again to catch chain reorganisations', required=False, default=12, type=int)
+def main(chain, address, contract_name, event_names, csv_file, from_block, timestamp_cache, fetch_workers, event_index, reorg_depth):
+    """Extract crowdsale contract investors.
+
+    With several contracts the events of all of them are read in one sweep and the investors are merged per contract.
+
+    Example:
+
+        extract-investor-data \
+            --address=0x0... --contract-name=PresaleFundCollector \
+            --address=0x1... --contract-name=MintedTokenCappedCrowdsale \
+            --csv-file=investors.csv
+    """
 
     project = Project()
 
@@ -24,59 +48,50 @@ def main(chain, address, csv_file):
         # Sanity check
         print("Block number is", web3.eth.blockNumber)
 
-        Crowdsale = c.provider.get_contract_factory('MintedTokenCappedCrowdsale')
-        crowdsale = Crowdsale(address=address)
+        if len(contract_name) > len(address):
+            sys.exit("Got more --contract-name than --address options")
+        contract_name = list(contract_name) + ["MintedTokenCappedCrowdsale"] * (len(address) - len(contract_name))
+
+        events = []
+        for contract_address, name in zip(address, contract_name):
+            Contract = c.provider.get_base_contract_factory(name)
+            contract = Contract(address=contract_address)
 
-        print("Total amount raised is", from_wei(crowdsale.functions.weiRaised().call(), "ether"), "ether")
+            abi_names = [item.get("name") for item in contract.abi]
+            if "weiRaised" in abi_names:
+                print("Total amount raised by", contract_address, "is", from_wei(contract.functions.weiRaised().call(), "ether"), "ether")
+
+            contract_events = [getattr(contract.events, event_name)() for event_name in event_names if event_name in abi_names]
+            if not contract_events:
+                sys.exit("{} {} does not have any of the events {}".format(name, contract_address, ", ".join(event_names)))
+            events += contract_events
+
+        timestamps = open_timestamp_cache(web3, timestamp_cache, max_workers=fetch_workers)
 
         print("Getting events")
-        events = crowdsale.events.Invested().createFilter(fromBlock=0).get_all_entries()
+        index = open_event_index(web3, event_index, reorg_depth)
+        events_read = index_and_read_many(index, events, from_block)
 
         # Merge several transactions from the same address to one
-        print("Analysing", len(events), "raw events")
-        address_data = OrderedDict()
-        for e in events:
-            address = e["args"]["investor"]
-            data = address_data.get(address, {})
-
-            # TODO: Not sure if we get events in block order
-            timestamp = web3.eth.getBlock(e["blockNumber"])["timestamp"]
-            current_first = data.get("first_payment", 99999999999999999)
-            if timestamp < current_first:
-                data["first_payment"] = timestamp
-
-            data["raised"] = data.get("raised", 0) + from_wei(e["args"]["weiAmount"], "ether")
-            data["tokens"] = data.get("tokens", 0) + e["args"]["tokenAmount"]
-            address_data[address] = data
+        per_contract = len(address) > 1
+        address_data = merge_investors(timestamps.timestamp_events(web3, events_read), per_contract)
+        event_count = sum(index.count_events(event.address, event.event_name, from_block) for event in events)
+
+        print("Fetched", timestamps.fetch_count, "block timestamps from the node")
+        timestamps.close()
+        index.close()
 
         if csv_file:
             print("Writing results to", csv_file)
-            with open(csv_file, 'w', newline='') as out:
-                writer = csv.writer(out)
-
-                writer.writerow(["Address", "First payment at", "Invested ETH", "Received tokens"])
-
-                for address, data in address_data.items():
-                    timestamp = data["first_payment"]
-                    dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
-                    writer.writerow([
-                        address,
-                        dt.isoformat(),
-                        str(data["raised"]),
-                        str(data["tokens"])
-                    ])
+            header = ["Address", "First payment at", "Invested ETH", "Received tokens"]
+            if per_contract:
+                header = ["Contract"] + header
+            write_csv(csv_file, header, investor_rows(address_data))
         else:
-            for address, data in address_data.items():
-                timestamp = data["first_payment"]
-                dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
-                print(
-                    address,
-                    dt.isoformat(),
-                    str(data["raised"]),
-                    str(data["tokens"])
-                )
-
-        print("Total", len(address_data), "investors")
+            for row in investor_rows(address_data):
+                print(*row)
+
+        print("Total", len(address_data), "investors from", event_count, "raw events")
         print("All done! Enjoy your decentralized future.")
 
 
@@ -1,27 +1,34 @@
 """Extract crowdsale raw investmetn data."""
-import csv
-import datetime
-import json
-import os
-
 import click
-from decimal import Decimal
 from eth_utils import from_wei
 from populus import Project
 
+from ico.eventindex import DEFAULT_INDEX_FILE
+from ico.eventindex import index_and_read
+from ico.eventindex import open_event_index
+from ico.blocktimes import DEFAULT_CACHE_FILE
+from ico.blocktimes import open_timestamp_cache
+from ico.extractpipeline import counted
+from ico.extractpipeline import investment_rows
+from ico.extractpipeline import write_csv
+
 
 @click.command()
 @click.option('--chain', nargs=1, default="mainnet", help='On which chain to deploy - see populus.json')
 @click.option('--address', nargs=1, help='CrowdsaleContract address to scan', required=True)
 @click.option('--csv-file', nargs=1, help='CSV file to write', default=None, required=True)
-def main(chain, address, csv_file):
+@click.option('--from-block', nargs=1, help='Start scanning events from this block, e.g. the contract deployment block', required=False, default=0, type=int)
+@click.option('--timestamp-cache', nargs=1, help='SQLite file where block timestamps are cached between runs', required=False, default=DEFAULT_CACHE_FILE)
+@click.option('--fetch-workers', nargs=1, help='How many block header batch requests are made concurrently, HTTP providers only', required=False, default=1, type=int)
+@click.option('--event-index', nargs=1, help='SQLite file where events are indexed between runs, only new blocks are scanned', required=False, default=DEFAULT_INDEX_FILE)
+@click.option('--reorg-depth', nargs=1, help='How many last indexed blocks are scanned again to catch chain reorganisations', required=False, default=12, type=int)
+def main(chain, address, csv_file, from_block, timestamp_cache, fetch_workers, event_index, reorg_depth):
     """Extract crowdsale invested events.
 
     This is useful for RelaunchCrowdsale to rebuild the data.
     """
 
     project = Project()
-    timestamp_filename = "block-timestamps.json"
 
     with project.get_chain(chain) as c:
 
@@ -44,55 +51,22 @@ def main(chain, address, csv_file):
         print("Total amount raised is", from_wei(crowdsale.functions.weiRaised().call(), "ether"), "ether")
 
         print("Getting events")
-        events = crowdsale.events.Invested().createFilter(fromBlock=0).get_all_entries()
+        index = open_event_index(web3, event_index, reorg_depth)
+        events = index_and_read(index, crowdsale.events.Invested(), from_block)
 
         print("Writing results to", csv_file)
 
         # Block number -> timestamp mappings
-        timestamps = {}
-
-        # Load cached timestamps
-        if os.path.exists(timestamp_filename):
-            with open(timestamp_filename, "rt") as inp:
-                timestamps = json.load(inp)
-
-        with open(csv_file, 'w', newline='') as out:
-            writer = csv.writer(out)
-
-            writer.writerow(["Address", "Payment at", "Tx hash", "Tx index", "Invested ETH", "Received tokens"])
-
-            for idx, e in enumerate(events):
-
-                if idx % 100 == 0:
-                    print("Writing event", idx)
-                    # Save cached timestamps
-                    with open(timestamp_filename, "wt") as out:
-                        json.dump(timestamps, out)
-
-                block_number = e["blockNumber"]
-                if block_number not in timestamps:
-                    timestamps[block_number] = web3.eth.getBlock(block_number)["timestamp"]
-
-                amount = Decimal(e["args"]["tokenAmount"]) / Decimal(decimal_multiplier)
-
-                tokens = amount * decimal_multiplier
+        timestamps = open_timestamp_cache(web3, timestamp_cache, max_workers=fetch_workers)
 
-                # http://stackoverflow.com/a/19965088/315168
-                if not tokens % 1 == 0:
-                    raise RuntimeError("Could not convert token amount to decimal format. It was not an integer after restoring non-fractional balance: {} {} {}".format(tokens, amount, decimal_multiplier))
+        rows = investment_rows(timestamps.timestamp_events(web3, counted(events, 100)), decimal_multiplier)
+        event_count = write_csv(csv_file, ["Address", "Payment at", "Tx hash", "Tx index", "Invested ETH", "Received tokens"], rows)
 
-                timestamp = timestamps[block_number]
-                dt = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
-                writer.writerow([
-                    e["args"]["investor"],
-                    dt.isoformat(),
-                    e["transactionHash"],
-                    e["transactionIndex"],
-                    from_wei(e["args"]["weiAmount"], "ether"),
-                    amount,
-                ])
+        print("Fetched", timestamps.fetch_count, "block timestamps from the node")
+        timestamps.close()
+        index.close()
 
-        print("Total", len(events), "invest events")
+        print("Total", event_count, "invest events")
         print("All done! Enjoy your decentralized future.")
 
 
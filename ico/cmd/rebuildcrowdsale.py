@@ -6,15 +6,121 @@ import datetime
 
 import click
 from decimal import Decimal
+from typing import List, Set, Tuple
 from eth_utils import from_wei
 from eth_utils import to_wei
 from populus.utils.accounts import is_account_locked
 from populus import Project
 from populus.utils.cli import request_account_unlock
 
-from ico.utils import check_succesful_tx
-from ico.utils import check_multiple_succesful_txs
-from ico.utils import get_constructor_arguments
+from ico.utils import multicall
+from ico.utils import get_read_aggregator
+from ico.utils import chunked
+from ico.utils import get_chunk_size
+from ico.sender import build_sender
+from ico.journal import open_journal
+from ico.gasprice import get_gas_price_oracle
+
+
+#: Worst case gas cost of restoring a single investment in setInvestorDataAndIssueNewTokenMany()
+RESTORE_GAS_PER_ROW = 150000
+
+
+#: (row index, investor address, invested wei, raw token amount, original txid as int)
+Investment = Tuple[int, str, int, int, int]
+
+
+def read_investments(csv_file: str, start_from: int, limit: int, multiplier: int) -> List[Investment]:
+    """Parse the selected CSV rows before touching the chain.
+
+    :param multiplier: Raw token amount multiplier, e.g. 10**18
+    """
+    print("Reading data", csv_file)
+    with open(csv_file, "rt") as inp:
+        reader = csv.DictReader(inp)
+        rows = [row for row in reader]
+
+    print("Source data has", len(rows), "rows")
+    print("Importing rows", start_from, "-", start_from + limit)
+
+    investments = []
+    for i in range(start_from, min(start_from+limit, len(rows))):
+        data = rows[i]
+        addr = data["Address"]
+        wei = to_wei(data["Invested ETH"], "ether")
+        fractional_tokens = Decimal(data["Received tokens"])
+        orig_txid = int(data["Tx hash"], 16)
+        # orig_tx_index = int(data["Tx index"])
+
+        tokens = fractional_tokens * multiplier
+
+        # http://stackoverflow.com/a/19965088/315168
+        if not tokens % 1 == 0:
+            raise RuntimeError("Could not issue tokens because after multiplication was not integer: {} {} {}".format(tokens, fractional_tokens, multiplier))
+
+        investments.append((i, addr, wei, int(tokens), orig_txid))
+
+    return investments
+
+
+def skip_journaled(investments: List[Investment], journaled: Set[str]) -> List[Investment]:
+    """Drop investments confirmed in the journal."""
+    for i, addr, wei, tokens, orig_txid in investments:
+        if hex(orig_txid) in journaled:
+            print("Row", i, "confirmed in the journal, skipping")
+    return [investment for investment in investments if hex(investment[4]) not in journaled]
+
+
+def plan_restore(web3, relaunched_crowdsale, investments: List[Investment], aggregator) -> List[Investment]:
+    """Pick investments not restored yet and check the crowdsale cap for them.
+
+    One bulk read tells which transactions have been already restored.
+    The totals are read once and advanced locally.
+    """
+    restored = multicall(web3, [(relaunched_crowdsale, "getRestoredTransactionStatus", [orig_txid]) for i, addr, wei, tokens, orig_txid in investments], aggregator)
+
+    wei_raised = relaunched_crowdsale.functions.weiRaised().call()
+    tokens_sold = relaunched_crowdsale.functions.tokensSold().call()
+    maximum_sellable_tokens = relaunched_crowdsale.functions.maximumSellableTokens().call()
+
+    to_restore = []
+    seen_txids = set()
+    for investment, already_restored in zip(investments, restored):
+        i, addr, wei, tokens, orig_txid = investment
+        if already_restored or orig_txid in seen_txids:
+            print("Row", i, "already restored, skipping")
+            continue
+        seen_txids.add(orig_txid)
+
+        wei_raised += wei
+        tokens_sold += tokens
+
+        # See if our cap calculation is screwed, matches MintedTokenCappedCrowdsale.isBreakingCap()
+        if tokens_sold > maximum_sellable_tokens:
+            raise RuntimeError("Cap error on row {}: tokens sold would be {}, cap is {}".format(i, tokens_sold, maximum_sellable_tokens))
+
+        to_restore.append(investment)
+
+    print("Restoring", len(to_restore), "investments, weiRaised will be", wei_raised, "tokensSold will be", tokens_sold)
+    return to_restore
+
+
+def restore(sender, relaunched_crowdsale, to_restore: List[Investment], chunk_size: int, gas_price_oracle):
+    """Send setInvestorDataAndIssueNewTokenMany() a chunk at a time."""
+    start_time = time.time()
+    transaction = {}
+
+    for chunk in chunked(to_restore, chunk_size):
+        transaction["gas"] = 100000 + RESTORE_GAS_PER_ROW * len(chunk)
+        transaction["gasPrice"] = gas_price_oracle.get_gas_price()
+        func = relaunched_crowdsale.functions.setInvestorDataAndIssueNewTokenMany(
+            [addr for i, addr, wei, tokens, orig_txid in chunk],
+            [wei for i, addr, wei, tokens, orig_txid in chunk],
+            [tokens for i, addr, wei, tokens, orig_txid in chunk],
+            [orig_txid for i, addr, wei, tokens, orig_txid in chunk],
+        )
+        txid = sender.transact(func, transaction, journal_keys=[hex(orig_txid) for i, addr, wei, tokens, orig_txid in chunk], rows=len(chunk))
+        print("Rows", chunk[0][0], "-", chunk[-1][0], "restoring", len(chunk), "investments in", txid, "time passed", time.time() - start_time, "gas price", transaction["gasPrice"], sender.costs.get_summary(rows_left=len(to_restore) - sender.costs.row_count))
 
 
 @click.command()
@@ -25,11 +131,26 @@ from ico.utils import get_constructor_arguments
 @click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=1000)
 @click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0)
 @click.option('--multiplier', nargs=1, help='Token amount multiplier, to fix decimal place, as 10^exponent', required=False, default=1)
-def main(chain, address, contract_address, csv_file, limit, start_from, multiplier):
+@click.option('--batch-size', nargs=1, help='Max investments restored per transaction. Further limited by the block gas limit.', required=False, default=50, type=int)
+@click.option('--max-in-flight', nargs=1, help='How many unconfirmed restore transactions we keep in the mempool at once', required=False, default=16, type=int)
+@click.option('--stuck-timeout', nargs=1, help='Rebroadcast a transaction not mined in this many seconds with a higher gas price. Leave out to disable.', required=False, default=None, type=int)
+@click.option('--aggregator-address', nargs=1, help='Deployed ReadAggregator contract used to read restore status of all rows in few calls', required=False, default=None)
+@click.option('--max-gas-price', nargs=1, help='Never pay more than this gas price. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--journal', 'journal_file', nargs=1, help='SQLite file where the restore progress is recorded. Rerunning with the same journal skips confirmed investments without checking them from the chain.', required=False, default=None)
+@click.option('--dry-run', 'dry_run_report', nargs=1, help='Do not send anything, but simulate the restore transactions against the current chain state and write per transaction gas and failure report to this CSV file', required=False, default=None)
+def main(chain, address, contract_address, csv_file, limit, start_from, multiplier, batch_size, max_in_flight, aggregator_address, max_gas_price, journal_file, stuck_timeout, dry_run_report):
     """Rebuild data on relaunched CrowdsaleToken contract.
 
     This allows you rerun investment data to fix potential errors in the contract.
 
+    Investments are restored in batches with setInvestorDataAndIssueNewTokenMany().
+    The crowdsale cap is checked locally against a single snapshot of weiRaised and tokensSold.
+
+    With --journal, the state of each original transaction is recorded in a local SQLite file,
+    so that an interrupted run can be resumed without checking confirmed rows from the chain.
+
+    With --dry-run, restore transactions are only simulated with eth_estimateGas to see the total gas cost and failing rows.
+
     Example::
 
         rebuild-crowdsale --address=0x001FC7d7E506866aEAB82C11dA515E9DD6D02c25  --chain=kovan --contract-address=0xf09e4a27a02afd29590a989cb2dda9af8eebc77f --start-from=0 --limit=600 --multiplier=12 --csv-file=inputdata.csv
@@ -47,17 +168,14 @@ def main(chain, address, contract_address, csv_file, limit, start_from, multipli
         print("Owner address is", address)
         print("Owner balance is", from_wei(web3.eth.getBalance(address), "ether"), "ETH")
 
+        if dry_run_report and journal_file:
+            sys.exit("--dry-run cannot be used with --journal")
+
         # Goes through geth account unlock process if needed
-        if is_account_locked(web3, address):
+        if not dry_run_report and is_account_locked(web3, address):
             request_account_unlock(c, address, timeout=3600*6)
 
-        print("Reading data", csv_file)
-        with open(csv_file, "rt") as inp:
-            reader = csv.DictReader(inp)
-            rows = [row for row in reader]
-
-        print("Source data has", len(rows), "rows")
-        print("Importing rows", start_from, "-", start_from + limit)
+        investments = read_investments(csv_file, start_from, limit, 10**multiplier)
 
         RelaunchedCrowdsale = c.provider.get_base_contract_factory('RelaunchedCrowdsale')
         relaunched_crowdsale = RelaunchedCrowdsale(address=contract_address)
@@ -67,67 +185,34 @@ def main(chain, address, contract_address, csv_file, limit, start_from, multipli
 
         assert relaunched_crowdsale.functions.owner().call() == address, "We are not the crowdsale owner. Real owner is {}, we are {}".format(relaunched_crowdsale.functions.owner().call(), address)
 
-        multiplier = 10**multiplier
-
-        start_time = time.time()
-        start_balance = from_wei(web3.eth.getBalance(address), "ether")
-
-        tx_to_confirm = []   # List of txids to confirm
-        tx_batch_size = 16  # How many transactions confirm once
-        cap_check = True
-
-        for i in range(start_from, min(start_from+limit, len(rows))):
-            data = rows[i]
-            addr = data["Address"]
-            wei = to_wei(data["Invested ETH"], "ether")
-            fractional_tokens = Decimal(data["Received tokens"])
-            orig_txid = int(data["Tx hash"], 16)
-            # orig_tx_index = int(data["Tx index"])
+        journal, journaled = open_journal(web3, journal_file, context="rebuild-crowdsale:{}".format(relaunched_crowdsale.address))
+        investments = skip_journaled(investments, journaled)
 
-            tokens = fractional_tokens * multiplier
+        to_restore = plan_restore(web3, relaunched_crowdsale, investments, get_read_aggregator(c, aggregator_address))
 
-            transaction = {
-                "from": address,
-                "gasPrice": int(web3.eth.gasPrice * 1.2)
-            }
+        gas_price_oracle = get_gas_price_oracle(web3, "rebuild", max_gas_price_gwei=max_gas_price)
 
-            # http://stackoverflow.com/a/19965088/315168
-            if not tokens % 1 == 0:
-                raise RuntimeError("Could not issue tokens because after multiplication was not integer: {} {} {}".format(tokens, fractional_tokens, multiplier))
+        chunk_size = get_chunk_size(web3, RESTORE_GAS_PER_ROW, batch_size)
+        sender = build_sender(web3, address, dry_run=bool(dry_run_report), max_in_flight=max_in_flight, journal=journal, stuck_timeout=stuck_timeout, max_gas_price=gas_price_oracle.max_gas_price)
 
-            end_balance = from_wei(web3.eth.getBalance(address), "ether")
-            spent = start_balance - end_balance
-            print("Row", i,  "giving", tokens, "to", addr, "from tx", orig_txid, "ETH spent", spent, "time passed", time.time() - start_time, "gas price", transaction["gasPrice"])
+        if journal:
+            journal.plan([(hex(orig_txid), tokens) for i, addr, wei, tokens, orig_txid in to_restore])
 
-            if relaunched_crowdsale.functions.getRestoredTransactionStatus(orig_txid).call():
-                print("Already restored, skipping")
-                continue
-
-            tokens = int(tokens)
-
-            if cap_check:
-                # See if our cap calculation is screwed
-                if relaunched_crowdsale.functions.isBreakingCap(
-                    wei,
-                    tokens,
-                    relaunched_crowdsale.functions.weiRaised().call(),
-                    relaunched_crowdsale.functions.tokensSold().call()
-                ).call():
-                    raise RuntimeError("Cap error")
-
-            txid = relaunched_crowdsale.transact(transaction).setInvestorDataAndIssueNewToken(addr, wei, tokens, orig_txid)
-            tx_to_confirm.append(txid)
-
-            # Confirm N transactions when batch max size is reached
-            if len(tx_to_confirm) >= tx_batch_size:
-                check_multiple_succesful_txs(web3, tx_to_confirm)
-                tx_to_confirm = []
+        restore(sender, relaunched_crowdsale, to_restore, chunk_size, gas_price_oracle)
 
         # Confirm dangling transactions
-        check_multiple_succesful_txs(web3, tx_to_confirm)
-
-        end_balance = from_wei(web3.eth.getBalance(address), "ether")
-        print("Deployment cost is", start_balance - end_balance, "ETH")
+        sender.flush()
+
+        if journal:
+            print("Journal row status", journal.get_counts())
+            journal.close()
+
+        if dry_run_report:
+            sender.write_report(dry_run_report)
+            print("Dry run:", sender.get_summary())
+            print("Per transaction report written to", dry_run_report)
+        else:
+            print("Restore cost:", sender.costs.get_summary())
         print("All done! Enjoy your decentralized future.")
 
 
@@ -1,24 +1,89 @@
 """Distribute ETH refunds."""
 import csv
-import datetime
-import json
-import os
+import sys
 import time
 from decimal import Decimal
-import shutil
+from typing import List, Optional
 
 import click
 from eth_utils import from_wei
 from eth_utils import is_checksum_address
+from eth_utils import to_checksum_address
 from eth_utils import to_wei
 
 from populus.utils.accounts import is_account_locked
 from populus import Project
 from populus.utils.cli import request_account_unlock
 
-from ico.utils import check_succesful_tx
+from ico.sender import PipelinedSender
+from ico.sender import read_private_keys
+from ico.sender import get_key_addresses
+from ico.bundle import BundleSigner
+from ico.gasprice import get_gas_price_oracle
+from ico.refundstate import RefundStateLog
+from ico.refundstate import SENDING
+from ico.refundstate import open_state_log
+from ico.refundstate import resume_refunds
 
 
+#: Gas limit for refund transactions, leaves room for wallet contracts with a payable fallback
+REFUND_GAS_LIMIT = 100000
+
+
+def get_signing_key(hot_wallet_address: str, signing_key_file: Optional[str]) -> str:
+    """Read the --sign-only key and check it belongs to the hot wallet."""
+    if not signing_key_file:
+        sys.exit("--sign-only needs --signing-key-file")
+    signing_key = read_private_keys(signing_key_file)[0]
+    if to_checksum_address(get_key_addresses([signing_key])[0]) != to_checksum_address(hot_wallet_address):
+        sys.exit("Signing key does not belong to {}".format(hot_wallet_address))
+    return signing_key
+
+
+def read_rows(csv_file: str, id_column: str, address_column: str) -> List[dict]:
+    """Read the refund CSV and check that we have unique ids."""
+    print("Reading data", csv_file)
+    with open(csv_file, "rt", encoding='utf-8-sig') as inp:
+        reader = csv.DictReader(inp)
+        rows = [row for row in reader]
+
+    uniq_ids = set()
+    for row in rows:
+        print(row)
+        id = row[id_column].strip()
+        if id in uniq_ids:
+            raise RuntimeError("Id appears twice in input data", id)
+        uniq_ids.add(id)
+
+        addr = row[address_column]
+        if not is_checksum_address(addr):
+            print("Not a checksummed address", addr)
+
+    return rows
+
+
+def send_refunds(sender, state: RefundStateLog, rows: List[dict], row_range: range, address_column: str, amount_column: str, id_column: str, gas_price_oracle):
+    """Send a refund per row that has not been refunded yet."""
+    start_time = time.time()
+
+    for i in row_range:
+        data = rows[i]
+        addr = data[address_column].strip()
+        id = data[id_column].strip()
+        amount = Decimal(data[amount_column].strip())
+        amount_wei = to_wei(amount, "ether")
+
+        if state.is_refunded(id):
+            print("Already refunded", id, addr, amount)
+            continue
+
+        # The sender does not change its nonce while waiting for a free slot
+        state.record(id, address=addr, amount_wei=amount_wei, nonce=sender.nonce, status=SENDING)
+
+        txid = sender.send_transaction({"to": addr, "value": amount_wei, "gasPrice": gas_price_oracle.get_gas_price(), "gas": REFUND_GAS_LIMIT}, journal_keys=[id])
+        duration = time.time() - start_time
+        print("Transferring", id, amount_wei, "to", addr, "txid", txid, "duration", duration)
+
 
 @click.command()
 @click.option('--chain', nargs=1, default="mainnet", help='On which chain to deploy - see populus.json')
@@ -29,13 +94,27 @@ from ico.utils import check_succesful_tx
 @click.option('--id-column', nargs=1, help='Name of CSV column containing unique identifier for all refund participants (usually email)', default="email")
 @click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=1000)
 @click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0)
-@click.option('--state-file', nargs=1, help='JSON file where we keep the state', required=True)
-def main(chain, hot_wallet_address, csv_file, limit, start_from, address_column, amount_column, id_column, state_file):
+@click.option('--state-file', nargs=1, help='Log file where we keep the state. An old style .json state file is migrated to a .jsonl log next to it.', required=True)
+@click.option('--max-gas-price', nargs=1, help='Never pay more than this gas price. Specify in Gwei e.g. 50.', required=False, default=None)
+@click.option('--max-in-flight', nargs=1, help='How many unconfirmed refund transactions we keep in the mempool at once', required=False, default=16, type=int)
+@click.option('--stuck-timeout', nargs=1, help='Rebroadcast a transaction not mined in this many seconds with a higher gas price. Leave out to disable.', required=False, default=None, type=int)
+@click.option('--sign-only', 'bundle_file', nargs=1, help='Do not send anything, but sign the refunds to this bundle file for broadcast-bundle command', required=False, default=None)
+@click.option('--signing-key-file', nargs=1, help='File with the private key of the hot wallet for --sign-only', required=False, default=None)
+@click.option('--chain-id', nargs=1, help='EIP-155 chain id for --sign-only. Asked from the node if not given. Needed when the node does not support eth_chainId.', required=False, default=None, type=int)
+def main(chain, hot_wallet_address, csv_file, limit, start_from, address_column, amount_column, id_column, state_file, max_gas_price, max_in_flight, stuck_timeout, bundle_file, signing_key_file, chain_id):
     """Distribute ETh refunds.
 
     Reads in funds distribution data as CSV. Then sends funds from a local address.
 
-    The refund status is stored as a JSON file.
+    The refund status is stored as an append-only log of JSON lines, one line written and synced to the disk per state change.
+    Old JSON state files are migrated: giving --state-file=refund-state.json reads it and continues with refund-state.jsonl.
+
+    Nonces are managed locally and up to --max-in-flight refunds are kept unconfirmed in the mempool.
+    Each refund is recorded with its nonce before it is broadcasted, so a rerun after a crash never pays the same id twice.
+    The hot wallet must not be used by anything else during the refund.
+
+    With --sign-only, refunds are signed to a bundle file instead of sending them and recorded as sent in the state log.
+    Broadcast the bundle with broadcast-bundle before the next refund run, so that the refunds resolve from the chain.
 
     Example:
 
@@ -52,12 +131,7 @@ def main(chain, hot_wallet_address, csv_file, limit, start_from, address_column,
         yyy@xxx.com,61.52,0x0B8EceBc18153166Beec1b568D510B55B560789D
     """
 
-    # Make a backup of the state file
-    if os.path.exists(state_file):
-        assert state_file.endswith(".json")
-        backup_name = state_file.replace(".json", "." + datetime.datetime.utcnow().isoformat() + ".bak.json")
-        print("Backing up state file to", backup_name)
-        shutil.copy(state_file, backup_name)
+    state = open_state_log(state_file)
 
     project = Project()
 
@@ -68,67 +142,41 @@ def main(chain, hot_wallet_address, csv_file, limit, start_from, address_column,
         print("Hot wallet address is", hot_wallet_address)
         print("Hot wallet balance is", from_wei(web3.eth.getBalance(hot_wallet_address), "ether"), "ETH")
 
+        signing_key = get_signing_key(hot_wallet_address, signing_key_file) if bundle_file else None
+
         # Goes through geth account unlock process if needed
-        if is_account_locked(web3, hot_wallet_address):
+        if not bundle_file and is_account_locked(web3, hot_wallet_address):
             request_account_unlock(c, hot_wallet_address, timeout=3600*6)
             assert not is_account_locked(web3, hot_wallet_address)
 
-        print("Reading data", csv_file)
-        with open(csv_file, "rt", encoding='utf-8-sig') as inp:
-            reader = csv.DictReader(inp)
-            rows = [row for row in reader]
-
-        # Check that we have unique addresses
-        uniq_ids = set()
-        for row in rows:
-            print(row)
-            id = row[id_column].strip()
-            if id in uniq_ids:
-                raise RuntimeError("Id appears twice in input data", id)
-            uniq_ids.add(id)
+        rows = read_rows(csv_file, id_column, address_column)
 
-            addr = row[address_column]
-            if not is_checksum_address(addr):
-                print("Not a checksummed address", addr)
+        resume_refunds(state, web3, hot_wallet_address)
 
         # Start distribution
-        start_time = time.time()
         start_balance = from_wei(web3.eth.getBalance(hot_wallet_address), "ether")
 
-        print("Total rows", len(rows))
+        gas_price_oracle = get_gas_price_oracle(web3, "refund", max_gas_price_gwei=max_gas_price)
 
-        if os.path.exists(state_file):
-            with open(state_file, "rt") as inp:
-                state = json.load(inp)
+        print("Total rows", len(rows))
+        if bundle_file:
+            sender = BundleSigner(web3, signing_key, bundle_file, chain_id=chain_id, journal=state)
+            print("Signing refunds to", bundle_file, "starting from nonce", sender.nonce)
         else:
-            state = {}
-
-        for i in range(start_from, min(start_from+limit, len(rows))):
-            data = rows[i]
-            addr = data[address_column].strip()
-            id = data[id_column].strip()
-            amount = Decimal(data[amount_column].strip())
-            amount_wei = to_wei(amount, "ether")
-
-            if id in state:
-                print("Already refunded", id, addr, amount)
-                continue
+            sender = PipelinedSender(web3, hot_wallet_address, max_in_flight=max_in_flight, journal=state, stuck_timeout=stuck_timeout, max_gas_price=gas_price_oracle.max_gas_price)
+            print("Starting from nonce", sender.nonce, "keeping", max_in_flight, "refunds in flight")
 
-            # Use non-default gas price for speedier processing
-            gas_price = int(web3.eth.gasPrice * 3)
+        send_refunds(sender, state, rows, range(start_from, min(start_from+limit, len(rows))), address_column, amount_column, id_column, gas_price_oracle)
 
-            txid = web3.eth.sendTransaction({"from": hot_wallet_address, "to": addr, "value": amount_wei, "gasPrice": gas_price})
-            duration = time.time() - start_time
-            print("Transferring", id, amount_wei, "to", addr, "txid", txid, "duration", duration)
+        # Confirm dangling transactions
+        sender.flush()
+        state.close()
 
-            state[id] = txid
-            with open(state_file, "wt") as out:
-                json.dump(state, out)
-
-            check_succesful_tx(web3, txid, timeout=300)
-
-        end_balance = from_wei(web3.eth.getBalance(hot_wallet_address), "ether")
-        print("Refund cost is", start_balance - end_balance, "ETH")
+        if bundle_file:
+            print("Signed", sender.signed_count, "refunds to", bundle_file, "- broadcast them with broadcast-bundle")
+        else:
+            end_balance = from_wei(web3.eth.getBalance(hot_wallet_address), "ether")
+            print("Refund cost is", start_balance - end_balance, "ETH")
         print("All done! Enjoy your decentralized future.")
 
 
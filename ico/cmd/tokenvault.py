@@ -1,6 +1,7 @@
 """Load a token vault."""
 import csv
 import time
+from typing import List, Optional, Tuple
 
 import click
 from decimal import Decimal
@@ -9,18 +10,39 @@ import sys
 from eth_utils import from_wei, is_checksum_address, to_checksum_address
 from web3 import Web3
 from web3.contract import Contract
+from web3.middleware.signing import construct_sign_and_send_raw_middleware
 
 from populus.utils.accounts import is_account_locked
 from populus import Project
 from populus.utils.cli import request_account_unlock
 
 from ico.utils import check_succesful_tx
-from ico.utils import check_multiple_succesful_txs
+from ico.utils import multicall
+from ico.utils import get_read_aggregator
+from ico.utils import chunked
+from ico.utils import get_chunk_size
+from ico.sender import TransactionSender
+from ico.sender import build_sender
+from ico.sender import grant_sender_pool
+from ico.sender import read_private_keys
+from ico.sender import get_key_addresses
+from ico.journal import open_journal
+from ico.bundle import BundleSigner
+from ico.dryrun import DryRunSender
+from ico.gasprice import get_gas_price_oracle
+from ico.vaultmodel import get_currently_claimable
+from ico.vaultmodel import get_final_claim_at
+from ico.vaultmodel import read_vault_investors
+from ico.vaultmodel import VaultSnapshot
 from ico.etherscan import verify_contract
 from ico.etherscan import get_etherscan_link
 from ico.utils import get_constructor_arguments
 
 
+#: Worst case gas cost of a single investor in TokenVault.setInvestors()
+SET_INVESTOR_GAS_PER_ROW = 70000
+
+
 def deploy(project: Project, chain, chain_name, web3: Web3, address: str, token: Contract, freeze_ends_at: int, tokens_to_be_allocated: int):
 
     # TODO: Fix Populus support this via an deploy argument
@@ -65,20 +87,13 @@ def deploy(project: Project, chain, chain_name, web3: Web3, address: str, token:
     return token_vault
 
 
-def load(chain, web3: Web3, address: str, csv_file: str, token: Contract, address_column: str, amount_column: str, duration_column: str, vault_address: str, override_checksum: bool):
-
-    decimals = token.functions.decimals().call()
-    decimal_multiplier = 10 ** decimals
-    transaction = {"from": address}
-
-    TokenVault = chain.provider.get_base_contract_factory('TokenVault')
-    token_vault = TokenVault(address=vault_address)
-
-    # Check that our tokens are the same
-    assert token_vault.functions.token().call() == token.address
+def read_investors(csv_file: str, address_column: str, amount_column: str, duration_column: str, decimal_multiplier: int, override_checksum: bool) -> List[Tuple[str, int, int]]:
+    """Read investor data CSV.
 
-    print("Starting to import investor data to ", token_vault.address)
+    Addresses must be unique and amounts positive.
 
+    :return: List of (address, raw amount, tokens per second)
+    """
     print("Reading data", csv_file)
     with open(csv_file, "rt") as inp:
         reader = csv.DictReader(inp)
@@ -86,80 +101,138 @@ def load(chain, web3: Web3, address: str, csv_file: str, token: Contract, addres
 
     # Check that we have unique addresses
     uniq_addresses = set()
-    total = 0
     for row in rows:
         addr = row[address_column].strip()
-        amount = row[amount_column].strip()
-
         if addr in uniq_addresses:
             raise RuntimeError("Address appears twice in input data", addr)
         uniq_addresses.add(addr)
-        amount = Decimal(amount)
-        total += amount
+        amount = Decimal(row[amount_column].strip())
         if amount <= 0:
             raise RuntimeError("Invalid amount:".format(amount))
 
-    if token_vault.functions.tokensToBeAllocated().call() != total * decimal_multiplier:
-        raise RuntimeError("Expected total amount {}, CSV sum is {}".format(token_vault.functions.tokensToBeAllocated().call(), int(total * decimal_multiplier)))
+    return [parse_investor(i, data, address_column, amount_column, duration_column, decimal_multiplier, override_checksum) for i, data in enumerate(rows)]
 
-    # Start distribution
-    start_time = time.time()
-    start_balance = from_wei(web3.eth.getBalance(address), "ether")
 
-    tx_to_confirm = []  # List of txids to confirm
-    tx_batch_size = 16  # How many transactions confirm once
+def parse_investor(i: int, data: dict, address_column: str, amount_column: str, duration_column: str, decimal_multiplier: int, override_checksum: bool) -> Tuple[str, int, int]:
+    """Convert a CSV row to (address, raw amount, tokens per second)."""
+    addr = data[address_column].strip()
+    tokens = Decimal(data[amount_column].strip())
 
-    print("Total rows", len(rows))
+    tokens *= decimal_multiplier
 
-    for i in range(len(rows)):
-        data = rows[i]
-        addr = data[address_column].strip()
-        tokens = Decimal(data[amount_column].strip())
+    # http://stackoverflow.com/a/19965088/315168
+    if not tokens % 1 == 0:
+        raise RuntimeError("Could not issue tokens because after multiplication was not integer")
 
-        tokens *= decimal_multiplier
+    tokens = int(tokens)
 
-        end_balance = from_wei(web3.eth.getBalance(address), "ether")
-        spent = start_balance - end_balance
+    duration = int(data[duration_column].strip())
+    if duration > 0:
+        tokens_per_second = int(tokens / duration)
+    else:
+        tokens_per_second = 0
 
-        # http://stackoverflow.com/a/19965088/315168
-        if not tokens % 1 == 0:
-            raise RuntimeError("Could not issue tokens because after multiplication was not integer")
+    if not is_checksum_address(addr):
+        if override_checksum:
+            print("WARNING: not a checksummed Ethereum address at row", i, ":", format(addr))
+            addr = to_checksum_address(addr)
+        else:
+            raise RuntimeError("Address not checksummed", addr, "Use --override-checksum to override if you know what you are doing.")
 
-        tokens = int(tokens)
+    return addr, tokens, tokens_per_second
 
-        duration = int(row[duration_column].strip())
-        if duration > 0:
-            tokens_per_second = int(tokens / duration)
-        else:
-            tokens_per_second = 0
 
-        print("Row", i, "giving", tokens, "to", addr, "vault", token_vault.address, "time passed", time.time() - start_time, "ETH spent", spent)
+def print_load_outcome(sender):
+    """Tell what was signed, simulated or spent."""
+    if isinstance(sender, BundleSigner):
+        print("Signed", sender.signed_count, "load transactions to", sender.path, "- broadcast them with broadcast-bundle")
+    elif isinstance(sender, DryRunSender):
+        print("Dry run:", sender.get_summary())
+    else:
+        print("Load cost:", sender.costs.get_summary())
+
+
+def load(chain, web3: Web3, address: str, csv_file: str, token: Contract, address_column: str, amount_column: str, duration_column: str, vault_address: str, override_checksum: bool, batch_size=100, max_in_flight=16, aggregator: Contract=None, journal_file: str=None, sender_addresses: List[str]=None, stuck_timeout: int=None, bundle_file: str=None, signing_key: str=None, chain_id: int=None, dry_run=False, start_from=0, limit=None) -> TransactionSender:
+    """Load investor data to the vault.
+
+    Rows are loaded with setInvestors() in chunks that fit in the block gas limit.
+    Investors already in the vault are skipped based on one bulk read of the vault balances.
+    Investors confirmed in the journal are skipped without reading them from the vault.
+    The CSV total is checked against the vault over all rows, also when loading only a batch of them.
+
+    :param sender_addresses: Pool of accounts the load transactions are sharded over. The owner makes them loaders.
+    :param bundle_file: Sign the transactions with signing_key to this bundle instead of sending them
+    :param chain_id: EIP-155 chain id of the bundle, asked from the node if not given
+    :param dry_run: Only simulate the transactions
+    :param start_from: First row to load (zero based)
+    :param limit: How many rows to load in this batch, all if not given
+    :return: The sender used, e.g. for the dry run report
+    """
+
+    decimals = token.functions.decimals().call()
+    decimal_multiplier = 10 ** decimals
+
+    TokenVault = chain.provider.get_base_contract_factory('TokenVault')
+    token_vault = TokenVault(address=vault_address)
+
+    # Check that our tokens are the same
+    assert token_vault.functions.token().call() == token.address
+
+    print("Starting to import investor data to ", token_vault.address)
+
+    investors = read_investors(csv_file, address_column, amount_column, duration_column, decimal_multiplier, override_checksum)
+    total = sum(tokens for addr, tokens, tokens_per_second in investors)
+    if token_vault.functions.tokensToBeAllocated().call() != total:
+        raise RuntimeError("Expected total amount {}, CSV sum is {}".format(token_vault.functions.tokensToBeAllocated().call(), total))
+
+    row_end = len(investors) if limit is None else min(start_from + limit, len(investors))
+    print("Loading rows", start_from, "-", row_end, "of", len(investors))
+    investors = investors[start_from:row_end]
+
+    total_rows = len(investors)
+    journal, journaled = open_journal(web3, journal_file, context="token-vault-load:{}".format(token_vault.address))
+    investors = [investor for investor in investors if investor[0] not in journaled]
+
+    # See who is already in the vault with a single bulk read
+    balances = multicall(web3, [(token_vault, "balances", [addr]) for addr, tokens, tokens_per_second in investors], aggregator)
+    to_load = [investor for investor, balance in zip(investors, balances) if balance == 0]
+    print("Total rows", total_rows, "already loaded", total_rows - len(to_load))
+
+    if journal:
+        journal.plan([(addr, tokens) for addr, tokens, tokens_per_second in to_load])
 
-        if not is_checksum_address(addr):
-            if override_checksum:
-                print("WARNING: not a checksummed Ethereum address at row", i, ":", format(addr))
-                addr = to_checksum_address(addr)
-            else:
-                raise RuntimeError("Address not checksummed", addr, "Use --override-checksum to override if you know what you are doing.")
+    # Start distribution
+    start_time = time.time()
 
-        if token_vault.functions.balances(addr).call() > 0:
-            print("Already issued, skipping")
-            continue
+    chunk_size = get_chunk_size(web3, SET_INVESTOR_GAS_PER_ROW, batch_size)
+    if sender_addresses:
+        granted = grant_sender_pool(token_vault, address, sender_addresses, "loaders", "setLoader", {}, aggregator)
+        print("Granted loader rights to", granted, "new sender accounts")
 
-        txid = token_vault.functions.setInvestor(addr, tokens, tokens_per_second).transact(transaction)
+    sender = build_sender(web3, address, sender_addresses, bundle_file=bundle_file, signing_key=signing_key, chain_id=chain_id, dry_run=dry_run, max_in_flight=max_in_flight, journal=journal, stuck_timeout=stuck_timeout)
 
-        tx_to_confirm.append(txid)
+    transaction = {}
+    if bundle_file or dry_run:
+        # Signed and simulated transactions cannot ask the node for the gas price later
+        transaction["gasPrice"] = get_gas_price_oracle(web3, "distribute").get_gas_price()
 
-        # Confirm N transactions when batch max size is reached
-        if len(tx_to_confirm) >= tx_batch_size:
-            check_multiple_succesful_txs(web3, tx_to_confirm)
-            tx_to_confirm = []
+    for idx, chunk in enumerate(chunked(to_load, chunk_size)):
+        transaction["gas"] = 100000 + SET_INVESTOR_GAS_PER_ROW * len(chunk)
+        investor_addresses = [addr for addr, tokens, tokens_per_second in chunk]
+        amounts = [tokens for addr, tokens, tokens_per_second in chunk]
+        taps = [tokens_per_second for addr, tokens, tokens_per_second in chunk]
+        txid = sender.transact(token_vault.functions.setInvestors(investor_addresses, amounts, taps), dict(transaction), journal_keys=investor_addresses, rows=len(chunk))
+        print("Chunk", idx, "loading", len(chunk), "investors to vault", token_vault.address, "in", txid, "time passed", time.time() - start_time, sender.costs.get_summary(rows_left=len(to_load) - sender.costs.row_count))
 
     # Confirm dangling transactions
-    check_multiple_succesful_txs(web3, tx_to_confirm)
+    sender.flush()
+
+    if journal:
+        print("Journal row status", journal.get_counts())
+        journal.close()
 
-    end_balance = from_wei(web3.eth.getBalance(address), "ether")
-    print("Deployment cost is", start_balance - end_balance, "ETH")
+    print_load_outcome(sender)
+    return sender
 
 
 def lock(chain, web3: Web3, address: str, token: Contract, vault_address: str):
@@ -183,52 +256,140 @@ def lock(chain, web3: Web3, address: str, token: Contract, vault_address: str):
     check_succesful_tx(web3, txid)
 
 
-def inspect(chain, vault_address: str, decimals: int):
+def inspect(chain, vault_address: str, decimals: int, aggregator: Contract=None, from_block=0, at_block: int=None, chunk_size=500, out=sys.stdout):
+    """Write the state of all vault investors as CSV.
+
+    Investors are read in chunks with :py:func:`multicall` and rows are written as each chunk arrives. Currently claimable amount, taps and the final claim time are derived from the raw vault storage in Python.
+
+    :param at_block: Read a consistent snapshot at this block, the latest block if not given
+    """
+    web3 = chain.web3
     TokenVault = chain.provider.get_base_contract_factory('TokenVault')
     token_vault = TokenVault(address=vault_address)
     decimal_multiplier = 10 ** decimals
-    claiming_starts = token_vault.functions.freezeEndsAt().call()
-    csv_row = "{addr},{amount},{claimed},{curr},{tps},{tph},{tpd},{final}"
-    csv_first_row = {
-        "addr": "address",
-        "amount": "amount",
-        "claimed": "claimed",
-        "curr": "currently claimable",
-        "tps": "tokens per second",
-        "tph": "tokens per hour",
-        "tpd": "tokens per day",
-        "final": "final claim after"
-    }
-
-    print (csv_row.format(**csv_first_row))
 
-    events = token_vault.events.Allocated().createFilter(fromBlock=0).get_all_entries()
+    if at_block is None:
+        at_block = web3.eth.blockNumber
+    now = web3.eth.getBlock(at_block)["timestamp"]
+    claiming_starts = token_vault.functions.freezeEndsAt().call(block_identifier=at_block)
 
-    for e in events:
-        participant_addr = e["args"]["investor"]
-        participant_balance = token_vault.functions.balances(participant_addr).call()
-        participant_claimed = token_vault.functions.claimed(participant_addr).call()
-        participant_tokens_per_second = token_vault.functions.tokensPerSecond(participant_addr).call()
-        participant_currently_claimable = token_vault.functions.getCurrentlyClaimableAmount(participant_addr).call()
+    writer = csv.writer(out)
+    writer.writerow(["address", "amount", "claimed", "currently claimable", "tokens per second", "tokens per hour", "tokens per day", "final claim after"])
 
-        final_claim = int(claiming_starts + (participant_balance / participant_tokens_per_second))
+    for participant_addr, participant_balance, participant_claimed, participant_last_claimed_at, participant_tokens_per_second in read_vault_investors(web3, token_vault, from_block, at_block, aggregator, chunk_size):
+        participant_currently_claimable = get_currently_claimable(participant_balance, participant_claimed, claiming_starts, participant_last_claimed_at, participant_tokens_per_second, now)
+        final_claim = get_final_claim_at(participant_balance, claiming_starts, participant_tokens_per_second)
         hourly_tap = participant_tokens_per_second * 3600
         daily_tap = participant_tokens_per_second * 86400
 
-        participant_row = {
-            "addr": participant_addr,
-            "amount": participant_balance / decimal_multiplier,
-            "claimed": participant_claimed / decimal_multiplier,
-            "curr": participant_currently_claimable / decimal_multiplier,
-            "tps": participant_tokens_per_second / decimal_multiplier,
-            "tph": hourly_tap / decimal_multiplier,
-            "tpd": daily_tap / decimal_multiplier,
-            "final": time.ctime(final_claim)
-        }
-        print(csv_row.format(**participant_row))
+        writer.writerow([
+            participant_addr,
+            participant_balance / decimal_multiplier,
+            participant_claimed / decimal_multiplier,
+            participant_currently_claimable / decimal_multiplier,
+            participant_tokens_per_second / decimal_multiplier,
+            hourly_tap / decimal_multiplier,
+            daily_tap / decimal_multiplier,
+            time.ctime(final_claim),
+        ])
+
+
+def check_modes(action, address, sender_keys_file, journal_file, bundle_file, signing_key_file, dry_run_report) -> Optional[str]:
+    """Validate --dry-run and --sign-only options.
+
+    :return: Signing key with --sign-only
+    """
+    if dry_run_report:
+        if action != "load":
+            sys.exit("--dry-run works only with load action")
+        if sender_keys_file or journal_file or bundle_file:
+            sys.exit("--dry-run cannot be used with --sender-keys-file, --journal or --sign-only")
+        return None
+
+    if not bundle_file:
+        return None
+
+    if action != "load":
+        sys.exit("--sign-only works only with load action")
+    if sender_keys_file or journal_file:
+        sys.exit("--sign-only cannot be used with --sender-keys-file or --journal")
+    if not signing_key_file:
+        sys.exit("--sign-only needs --signing-key-file")
+    signing_key = read_private_keys(signing_key_file)[0]
+    if to_checksum_address(get_key_addresses([signing_key])[0]) != to_checksum_address(address):
+        sys.exit("Signing key does not belong to {}".format(address))
+    return signing_key
+
+
+def setup_accounts(c, address: str, sender_keys_file: Optional[str], offline: bool) -> List[str]:
+    """Add signing middleware for the sender pool and unlock the owner account.
+
+    :param offline: Nothing is sent from the owner account, with --sign-only and --dry-run
+    :return: Addresses of the sender pool
+    """
+    web3 = c.web3
+
+    sender_addresses = []
+    if sender_keys_file:
+        sender_keys = read_private_keys(sender_keys_file)
+        web3.middleware_stack.add(construct_sign_and_send_raw_middleware(sender_keys))
+        sender_addresses = get_key_addresses(sender_keys)
+
+    # Goes through geth account unlock process if needed
+    if not offline and is_account_locked(web3, address):
+        request_account_unlock(c, address, timeout=3600*6)
+        assert not is_account_locked(web3, address)
+
+    return sender_addresses
+
+
+def get_decimals(token: Contract) -> int:
+    try:
+        decimals = token.functions.decimals().call()
+    except ValueError:
+        sys.exit("Token contract does not have support for decimal places, cannot work with it")
+
+    assert decimals >= 0
+    return decimals
+
+
+def run_load(c, web3: Web3, address: str, csv_file: str, token: Contract, address_column: str, amount_column: str, duration_column: str, vault_address: str, override_checksum: bool, dry_run_report: Optional[str], **kwargs):
+    """Check load options, load and write the dry run report.
+
+    :param kwargs: Passed to :py:func:`load`
+    """
+    if vault_address == None:
+        sys.exit("vault_address missing")
+
+    if address_column == None:
+        sys.exit("address_column missing")
+
+    if amount_column == None:
+        sys.exit("amount_column missing")
+
+    sender = load(c, web3, address, csv_file, token, address_column, amount_column, duration_column, vault_address, override_checksum, dry_run=bool(dry_run_report), **kwargs)
+    if dry_run_report:
+        sender.write_report(dry_run_report)
+        print("Per transaction dry run report written to", dry_run_report)
+    else:
+        print("Data loaded to the vault.")
+
+
+def take_snapshot(c, vault_address: str, decimals: int, snapshot_file: Optional[str], **kwargs):
+    """Save the state of all vault investors for vault-unlock-report.
+
+    :param kwargs: Passed to :py:meth:`VaultSnapshot.read`
+    """
+    if not snapshot_file:
+        sys.exit("snapshot needs --snapshot-file")
+    TokenVault = c.provider.get_base_contract_factory('TokenVault')
+    snapshot = VaultSnapshot.read(c.web3, TokenVault(address=vault_address), decimals, **kwargs)
+    snapshot.save(snapshot_file)
+    print("Snapshot of", len(snapshot.investors), "investors at block", snapshot.block_number, "written to", snapshot_file)
+
 
 @click.command()
-@click.option('--action', nargs=1, help='One of: deploy, load, lock', required=False, default=None)
+@click.option('--action', nargs=1, help='One of: deploy, load, lock, inspect, snapshot', required=False, default=None)
 @click.option('--chain', nargs=1, default="mainnet", help='On which chain to deploy - see populus.json')
 @click.option('--address', nargs=1, help='The account that deploys the vault contract, controls the contract and pays for the gas fees', required=True)
 @click.option('--token-address', nargs=1, help='Token contract address', required=True)
@@ -236,15 +397,28 @@ def inspect(chain, vault_address: str, decimals: int):
 @click.option('--address-column', nargs=1, help='Name of CSV column containing Ethereum addresses', default="address")
 @click.option('--amount-column', nargs=1, help='Name of CSV column containing decimal token amounts', default="amount")
 @click.option('--duration-column', nargs=1, help='Name of CSV column containing duration of vesting, in seconds if tap is enabled, 0 otherwise', default="duration")
-@click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=1000)
-@click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0)
+@click.option('--limit', nargs=1, help='How many items to import in this batch', required=False, default=1000, type=int)
+@click.option('--start-from', nargs=1, help='First row to import (zero based)', required=False, default=0, type=int)
 @click.option('--vault-address', nargs=1, help='The address of the vault contract - leave out for the first run to deploy a new issuer contract', required=False, default=None)
 @click.option('--freeze-ends-at', nargs=1, help='UNIX timestamp when vault freeze ends for deployment', required=False, default=None, type=int)
 @click.option('--tokens-to-be-allocated', nargs=1, help='Manually verified count of tokens to be set in the vault', required=False, default=None, type=int)
 @click.option('--override-checksum', is_flag=True, help='Skip checksum checks for addresses. Use this only if you understand the risks')
 @click.option('--print-timestamp', is_flag=True, help='Print timestamp in the end of the output')
 @click.option('--less-verbose', is_flag=True, help='Only print meaningful output. Ideal for CSV exports')
-def main(chain, address, token_address, csv_file, limit, start_from, vault_address, address_column, amount_column, duration_column, action, freeze_ends_at, tokens_to_be_allocated, override_checksum, print_timestamp, less_verbose):
+@click.option('--batch-size', nargs=1, help='Max investors loaded per setInvestors() transaction. Further limited by the block gas limit.', required=False, default=100, type=int)
+@click.option('--max-in-flight', nargs=1, help='How many unconfirmed load transactions we keep in the mempool at once', required=False, default=16, type=int)
+@click.option('--stuck-timeout', nargs=1, help='Rebroadcast a transaction not mined in this many seconds with a higher gas price. Leave out to disable.', required=False, default=None, type=int)
+@click.option('--aggregator-address', nargs=1, help='Deployed ReadAggregator contract used to read vault state for all investors in few calls', required=False, default=None)
+@click.option('--sender-keys-file', nargs=1, help='File of private keys, one per line. Load transactions are spread over these accounts for parallel nonce sequences. The owner account makes them loaders.', required=False, default=None)
+@click.option('--journal', 'journal_file', nargs=1, help='SQLite file where the load progress is recorded. Rerunning with the same journal skips confirmed investors without reading them from the vault.', required=False, default=None)
+@click.option('--sign-only', 'bundle_file', nargs=1, help='With load, do not send anything, but sign the load transactions to this bundle file for broadcast-bundle command', required=False, default=None)
+@click.option('--signing-key-file', nargs=1, help='File with the private key of the owner --address for --sign-only', required=False, default=None)
+@click.option('--chain-id', nargs=1, help='EIP-155 chain id for --sign-only. Asked from the node if not given. Needed when the node does not support eth_chainId.', required=False, default=None, type=int)
+@click.option('--from-block', nargs=1, help='With inspect, start scanning events from this block, e.g. the vault deployment block', required=False, default=0, type=int)
+@click.option('--at-block', nargs=1, help='With inspect and snapshot, read the vault state at this block for a consistent snapshot', required=False, default=None, type=int)
+@click.option('--snapshot-file', nargs=1, help='With snapshot, JSON file where the state of all vault investors is written for offline vault-unlock-report', required=False, default=None)
+@click.option('--dry-run', 'dry_run_report', nargs=1, help='With load, do not send anything, but simulate the load transactions against the current chain state and write per transaction gas and failure report to this CSV file', required=False, default=None)
+def main(chain, address, token_address, csv_file, limit, start_from, vault_address, address_column, amount_column, duration_column, action, freeze_ends_at, tokens_to_be_allocated, override_checksum, print_timestamp, less_verbose, batch_size, max_in_flight, aggregator_address, journal_file, sender_keys_file, stuck_timeout, bundle_file, signing_key_file, dry_run_report, from_block, at_block, snapshot_file, chain_id):
     """TokenVault control script.
 
     1) Deploys a token vault contract
@@ -252,6 +426,13 @@ def main(chain, address, token_address, csv_file, limit, start_from, vault_addre
     2) Reads in distribution data as CSV
 
     3) Locks vault
+
+    With load and --sign-only, the load transactions are signed with the owner key to a bundle file
+    that is broadcasted later with broadcast-bundle command.
+
+    With load and --dry-run, the load transactions are only simulated with eth_estimateGas.
+
+    With snapshot, the state of all investors is saved for vault-unlock-report, which simulates the vesting schedule without a node.
     """
 
     project = Project()
@@ -260,20 +441,13 @@ def main(chain, address, token_address, csv_file, limit, start_from, vault_addre
 
         web3 = c.web3
 
-        # Goes through geth account unlock process if needed
-        if is_account_locked(web3, address):
-            request_account_unlock(c, address, timeout=3600*6)
-            assert not is_account_locked(web3, address)
+        signing_key = check_modes(action, address, sender_keys_file, journal_file, bundle_file, signing_key_file, dry_run_report)
+        sender_addresses = setup_accounts(c, address, sender_keys_file, offline=bool(bundle_file or dry_run_report))
 
         Token = c.provider.get_base_contract_factory('FractionalERC20')
         token = Token(address=token_address)
 
-        try:
-            decimals = token.functions.decimals().call()
-        except ValueError:
-            sys.exit("Token contract does not have support for decimal places, cannot work with it")
-
-        assert decimals >= 0
+        decimals = get_decimals(token)
 
         if not less_verbose:
             print("Web3 provider is", web3.providers[0])
@@ -286,23 +460,14 @@ def main(chain, address, token_address, csv_file, limit, start_from, vault_addre
             deploy(project, c, chain, web3, address, token, freeze_ends_at, tokens_to_be_allocated * (10**decimals))
             print("TokenVault deployed.")
         elif action == "load":
-
-            if vault_address == None:
-                sys.exit("vault_address missing")
-
-            if address_column == None:
-                sys.exit("address_column missing")
-
-            if amount_column == None:
-                sys.exit("amount_column missing")
-
-            load(c, web3, address, csv_file, token, address_column, amount_column, duration_column, vault_address, override_checksum)
-            print("Data loaded to the vault.")
+            run_load(c, web3, address, csv_file, token, address_column, amount_column, duration_column, vault_address, override_checksum, dry_run_report, batch_size=batch_size, max_in_flight=max_in_flight, aggregator=get_read_aggregator(c, aggregator_address), journal_file=journal_file, sender_addresses=sender_addresses, stuck_timeout=stuck_timeout, bundle_file=bundle_file, signing_key=signing_key, chain_id=chain_id, start_from=start_from, limit=limit)
         elif action == "lock":
             lock(c, web3, address, token, vault_address)
             print("Vault locked. Now duck and wait.")
         elif action == "inspect":
-            inspect(c, vault_address, decimals)
+            inspect(c, vault_address, decimals, aggregator=get_read_aggregator(c, aggregator_address), from_block=from_block, at_block=at_block)
+        elif action == "snapshot":
+            take_snapshot(c, vault_address, decimals, snapshot_file, from_block=from_block, at_block=at_block, aggregator=get_read_aggregator(c, aggregator_address))
         else:
             sys.exit("Unknown action: {}".format(action))
 
@@ -0,0 +1,57 @@
+"""Simulate the token vault vesting schedule offline."""
+import datetime
+
+import click
+
+from ico.extractpipeline import format_timestamp
+from ico.extractpipeline import write_csv
+from ico.vaultmodel import VaultSnapshot
+
+
+@click.command()
+@click.option('--snapshot-file', nargs=1, help='Vault snapshot written by token-vault --action=snapshot', required=True)
+@click.option('--csv-file', nargs=1, help='CSV file where the unlock curve is written', required=True)
+@click.option('--start', nargs=1, help='UNIX timestamp of the first point of the curve, the freeze end if not given', required=False, default=None, type=int)
+@click.option('--end', nargs=1, help='UNIX timestamp of the last point of the curve, when the last tokens unlock if not given', required=False, default=None, type=int)
+@click.option('--step', nargs=1, help='Seconds between the points of the curve', required=False, default=86400, type=int)
+@click.option('--claimable-at', nargs=1, help='UNIX timestamp for which per investor claimable amounts are written to --claimable-file', required=False, default=None, type=int)
+@click.option('--claimable-file', nargs=1, help='CSV file of per investor claimable amounts at --claimable-at', required=False, default=None)
+def main(snapshot_file, csv_file, start, end, step, claimable_at, claimable_file):
+    """Token vault unlock report without node access.
+
+    Reads the investor balances, claims and taps from a snapshot file and computes how many
+    tokens the vault unlocks over time.
+
+    Example:
+
+        token-vault --action=snapshot --vault-address=0x... --snapshot-file=vault.json ...
+
+        vault-unlock-report --snapshot-file=vault.json --csv-file=unlocks.csv
+    """
+
+    snapshot = VaultSnapshot.load(snapshot_file)
+    decimal_multiplier = 10 ** snapshot.decimals
+    print("Vault", snapshot.vault_address, "has", len(snapshot.investors), "investors at block", snapshot.block_number)
+
+    if start is None:
+        start = snapshot.freeze_ends_at
+
+    if end is None:
+        end = snapshot.get_last_unlock_at()
+
+    rows = ([format_timestamp(timestamp), timestamp, unlocked / decimal_multiplier, total / decimal_multiplier] for timestamp, unlocked, total in snapshot.get_unlock_curve(start, end, step))
+    count = write_csv(csv_file, ["Date", "Timestamp", "Unlocked", "Unlocked total"], rows)
+    print("Wrote", count, "points from", format_timestamp(start), "to", format_timestamp(end), "to", csv_file)
+
+    if claimable_file:
+        if claimable_at is None:
+            claimable_at = int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp())
+        claimable = snapshot.get_claimable(claimable_at)
+        write_csv(claimable_file, ["Address", "Claimable at " + format_timestamp(claimable_at)], ([address, amount / decimal_multiplier] for address, amount in claimable.items()))
+        print("Total", sum(claimable.values()) / decimal_multiplier, "tokens claimable at", format_timestamp(claimable_at))
+
+    print("All done! Enjoy your decentralized future.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Transaction cost accounting from receipts."""
+from decimal import Decimal
+from typing import Optional
+
+from eth_utils import from_wei
+
+
+class CostTracker:
+    """Sum up gasUsed × gasPrice of confirmed transactions.
+
+    Example::
+
+        costs = CostTracker()
+        costs.add(receipt["gasUsed"], tx["gasPrice"], rows=50)
+        print(costs.get_summary(rows_left=1000))
+    """
+
+    def __init__(self):
+
+        #: Total cost of confirmed transactions in wei
+        self.total_wei = 0
+
+        #: Total gas used by confirmed transactions
+        self.gas_used = 0
+
+        #: Confirmed transaction count
+        self.tx_count = 0
+
+        #: Rows carried by confirmed transactions
+        self.row_count = 0
+
+        #: Cost of the last confirmed transaction in wei
+        self.last_tx_wei = 0
+
+    def add(self, gas_used: int, gas_price: int, rows=1) -> int:
+        """Account a confirmed transaction.
+
+        Failed transactions cost too, so they should be added as well.
+
+        :param rows: How many input rows the transaction carried, e.g. batch size
+        :return: Cost of the transaction in wei
+        """
+        cost = gas_used * gas_price
+        self.total_wei += cost
+        self.gas_used += gas_used
+        self.tx_count += 1
+        self.row_count += rows
+        self.last_tx_wei = cost
+        return cost
+
+    @property
+    def total_eth(self) -> Decimal:
+        return from_wei(self.total_wei, "ether")
+
+    def get_average_per_row(self) -> Optional[int]:
+        """Average cost of a row in wei, or None if nothing has been confirmed yet."""
+        if not self.row_count:
+            return None
+        return self.total_wei // self.row_count
+
+    def estimate_remaining(self, rows_left: int) -> Optional[int]:
+        """Projected cost of the rows not yet confirmed in wei, or None if we have no data."""
+        average = self.get_average_per_row()
+        if average is None:
+            return None
+        return average * rows_left
+
+    def get_summary(self, rows_left: Optional[int]=None) -> str:
+        """Human readable cost status line."""
+        summary = "spent {} ETH in {} transactions for {} rows".format(self.total_eth, self.tx_count, self.row_count)
+        if rows_left is not None:
+            remaining = self.estimate_remaining(rows_left)
+            if remaining is not None:
+                summary += ", projected {} ETH for remaining {} rows".format(from_wei(remaining, "ether"), rows_left)
+        return summary
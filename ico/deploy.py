@@ -18,6 +18,7 @@ from populus.utils.accounts import is_account_locked
 from web3.contract import Contract
 
 from ico.utils import get_contract_by_name
+from ico.gasprice import GasPriceOracle
 from ico.definition import load_crowdsale_definitions
 from ico.definition import get_jinja_context
 from ico.definition import interpolate_data
@@ -29,10 +30,11 @@ from ico.etherscan import verify_contract
 from ico.etherscan import get_etherscan_link
 
 
-def deploy_contract(project: Project, chain, deploy_address, contract_def: dict, chain_name: str, need_unlock=True) -> Contract:
+def deploy_contract(project: Project, chain, deploy_address, contract_def: dict, chain_name: str, need_unlock=True, gas_price_oracle: GasPriceOracle=None) -> Contract:
     """Deploy a single contract.
 
     :param need_unlock: Do the account unlock procedure (disable for testrpc)
+    :param gas_price_oracle: Share the oracle across multiple deployments
     """
 
     web3 = chain.web3
@@ -48,8 +50,10 @@ def deploy_contract(project: Project, chain, deploy_address, contract_def: dict,
             # Deploy can last max 1 h
             request_account_unlock(chain, deploy_address, timeout=3600)
 
-    # Use non-default gas price for speedier processing
-    gas_price = int(web3.eth.gasPrice * 2)
+    if not gas_price_oracle:
+        gas_price_oracle = GasPriceOracle(web3, "deploy")
+
+    gas_price = gas_price_oracle.get_gas_price()
 
     transaction = {"from": deploy_address, "gasPrice": gas_price}
     kwargs = dict(**contract_def["arguments"])  # Unwrap YAML CommentedMap
@@ -108,6 +112,9 @@ def deploy_crowdsale(project: Project, chain, yaml_filename: str, source_definit
 
     need_unlock = runtime_data.get("unlock_deploy_address", True)
 
+    max_gas_price = runtime_data.get("max_gas_price")
+    gas_price_oracle = GasPriceOracle(chain.web3, "deploy", max_gas_price=int(max_gas_price) * 10**9 if max_gas_price else None)
+
     for name, contract_def in runtime_data["contracts"].items():
 
         contract_name = contract_def["contract_name"]
@@ -132,7 +139,7 @@ def deploy_crowdsale(project: Project, chain, yaml_filename: str, source_definit
         # Store expanded data for output
         runtime_data["contracts"][name] = expanded_contract_def
 
-        contracts[name] = deploy_contract(project, chain, deploy_address, expanded_contract_def, chain_name, need_unlock=need_unlock)
+        contracts[name] = deploy_contract(project, chain, deploy_address, expanded_contract_def, chain_name, need_unlock=need_unlock, gas_price_oracle=gas_price_oracle)
         statistics["deployed"] += 1
 
         # Perform manual verification of the deployed contract
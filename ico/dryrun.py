@@ -0,0 +1,174 @@
+"""Dry run bulk commands without spending ETH.
+
+Transactions are simulated with batched ``eth_estimateGas`` calls against the current chain state, nothing is signed or broadcasted.
+"""
+import csv
+import logging
+from collections import namedtuple
+from typing import Iterable, List, Optional
+
+from eth_utils import from_wei
+from web3 import Web3
+
+from ico.costs import CostTracker
+from ico.sender import TransactionSender
+from ico.utils import make_batch_request
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Put to the summary and to the report
+INDEPENDENT_WARNING = "Transactions were simulated independently against the current chain state, only the given limits were added up over the rows"
+
+
+#: Outcome of one simulated transaction
+DryRunResult = namedtuple("DryRunResult", ("index", "keys", "rows", "gas_limit", "gas_estimate", "gas_price", "error"))
+
+
+class DryRunSender(TransactionSender):
+    """Simulate transactions instead of sending them.
+
+    See :py:class:`ico.sender.TransactionSender`.
+
+    Example::
+
+        sender = DryRunSender(web3, address)
+        sender.transact(issuer.functions.issueMany(addresses, amounts), {"gas": 2000000, "gasPrice": gas_price}, journal_keys=addresses)
+        sender.flush()
+        print(sender.get_summary())
+        sender.write_report("dry-run.csv")
+    """
+
+    def __init__(self, web3: Web3, address: str, batch_size=100):
+        """
+        :param address: The account that would send the transactions
+        :param batch_size: How many transactions are estimated in one JSON-RPC batch
+        """
+        self.web3 = web3
+        self.address = address
+        self.batch_size = batch_size
+        self.nonce = web3.eth.getTransactionCount(address, "pending")
+
+        #: Estimated cost of the transactions that would succeed
+        self.costs = CostTracker()
+
+        #: Simulation outcomes in the order the transactions were given
+        self.results = []  # type: List[DryRunResult]
+
+        #: Transactions waiting for the next estimate batch
+        self.queue = []
+
+        #: Limit name -> available amount
+        self.limits = {}
+
+        #: Amount the rows so far would use from each limit
+        self.spent = 0
+
+    def add_limit(self, name: str, available: int):
+        """Fail transactions once the rows spend more than this, e.g. the allowance of the issuer contract.
+
+        All limits are checked against the same running total given with :py:meth:`spend`.
+        """
+        self.limits[name] = available
+
+    def spend(self, amount: int):
+        """Add the amount of a row that goes to the next transaction."""
+        self.spent += amount
+
+    def get_limit_error(self) -> Optional[str]:
+        for name, available in self.limits.items():
+            if self.spent > available:
+                return "rows up to this need {}, more than {} {}".format(self.spent, name, available)
+        return None
+
+    def transact(self, func, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Simulate a contract function call.
+
+        :return: Placeholder transaction id for the output
+        """
+        tx_params = dict(tx_params)
+        if "gas" not in tx_params:
+            # Do not let web3 estimate here, a failing estimate is what we want to report
+            tx_params["gas"] = self.web3.eth.getBlock("latest")["gasLimit"]
+        tx = func.buildTransaction(dict(tx_params, **{"from": self.address}))
+        return self.simulate(tx, journal_keys, rows)
+
+    def send_transaction(self, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Simulate a plain transaction, e.g. ETH value transfer."""
+        return self.simulate(dict(tx_params, **{"from": self.address}), journal_keys, rows)
+
+    def simulate(self, tx: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        journal_keys = tuple(journal_keys)
+        if rows is None:
+            rows = len(journal_keys) or 1
+        if "gasPrice" not in tx:
+            tx["gasPrice"] = self.web3.eth.gasPrice
+
+        index = len(self.results) + len(self.queue)
+        self.queue.append((index, journal_keys, rows, tx, self.get_limit_error()))
+        if len(self.queue) >= self.batch_size:
+            self.poll()
+        return "dry-run-{}".format(index)
+
+    def poll(self) -> int:
+        """Estimate the queued transactions in one batch."""
+        if not self.queue:
+            return 0
+
+        calls = []
+        for index, keys, rows, tx, limit_error in self.queue:
+            params = {key: hex(value) if isinstance(value, int) else value for key, value in tx.items() if key in ("from", "to", "data", "value", "gas", "gasPrice")}
+            calls.append(("eth_estimateGas", [params]))
+
+        estimates = make_batch_request(self.web3, calls, return_errors=True)
+        for (index, keys, rows, tx, limit_error), estimate in zip(self.queue, estimates):
+            gas_limit = tx.get("gas")
+            if limit_error:
+                result = DryRunResult(index, keys, rows, gas_limit, None if isinstance(estimate, Exception) else estimate, tx["gasPrice"], limit_error)
+            elif isinstance(estimate, Exception):
+                result = DryRunResult(index, keys, rows, gas_limit, None, tx["gasPrice"], str(estimate))
+            elif gas_limit and estimate >= gas_limit:
+                # Node caps the estimate to the gas limit we gave
+                result = DryRunResult(index, keys, rows, gas_limit, estimate, tx["gasPrice"], "out of gas")
+            else:
+                result = DryRunResult(index, keys, rows, gas_limit, estimate, tx["gasPrice"], None)
+                self.costs.add(estimate, tx["gasPrice"], rows)
+
+            if result.error:
+                logger.warning("Dry run transaction %d for %s would fail: %s", index, ", ".join(keys), result.error)
+
+            self.results.append(result)
+
+        count = len(self.queue)
+        self.queue = []
+        return count
+
+    def flush(self):
+        """Estimate all remaining transactions."""
+        self.poll()
+
+    def get_failed(self) -> List[DryRunResult]:
+        return [result for result in self.results if result.error]
+
+    def get_summary(self) -> str:
+        """Human readable outcome of the dry run."""
+        failed = self.get_failed()
+        return "{} transactions for {} rows, {} would fail, {} rows ok using {} gas, estimated cost {} ETH. {}.".format(
+            len(self.results),
+            sum(result.rows for result in self.results),
+            len(failed),
+            self.costs.row_count,
+            self.costs.gas_used,
+            from_wei(self.costs.total_wei, "ether"),
+            INDEPENDENT_WARNING)
+
+    def write_report(self, fname: str):
+        """Write per transaction outcome to a CSV file."""
+        with open(fname, "wt") as out:
+            writer = csv.writer(out)
+            writer.writerow(["# " + INDEPENDENT_WARNING])
+            writer.writerow(["Transaction", "Keys", "Rows", "Gas limit", "Estimated gas", "Gas price", "Estimated cost (ETH)", "Error"])
+            for result in self.results:
+                cost = from_wei(result.gas_estimate * result.gas_price, "ether") if result.gas_estimate is not None else ""
+                writer.writerow([result.index, " ".join(result.keys), result.rows, result.gas_limit, result.gas_estimate, result.gas_price, cost, result.error or ""])
@@ -0,0 +1,232 @@
+"""Incremental local index of contract events.
+
+Decoded events are stored to a SQLite file with the last indexed block of each (contract, event) pair, and the last ``reorg_depth`` blocks are scanned again on update.
+"""
+import json
+import logging
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from ico.logscan import LogScanner
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Default index file in the current working directory
+DEFAULT_INDEX_FILE = "event-index.sqlite"
+
+#: Events the extraction commands read from the index
+SUPPORTED_EVENTS = ("Invested", "Issued", "Allocated", "Transfer", "PaymentForwarded")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS progress (
+    address TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    first_block INTEGER NOT NULL,
+    last_block INTEGER NOT NULL,
+    PRIMARY KEY (address, event_name)
+);
+
+CREATE TABLE IF NOT EXISTS events (
+    address TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    transaction_index INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    block_hash TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (address, event_name, block_number, log_index)
+);
+"""
+
+
+def _encode_arg(value):
+    if isinstance(value, bytes):
+        return {"bytes": Web3.toHex(value)}
+    raise TypeError("Cannot store event argument {}".format(value))
+
+
+def _decode_arg(value: dict):
+    if set(value.keys()) == {"bytes"}:
+        return HexBytes(value["bytes"])
+    return value
+
+
+class EventIndex:
+    """SQLite backed store of decoded events.
+
+    Example::
+
+        index = EventIndex("event-index.sqlite", web3.version.network)
+        index.update(crowdsale.events.Invested(), from_block=deployment_block)
+        for event in index.get_events(crowdsale.address, "Invested"):
+            print(event["args"]["investor"])
+        index.close()
+    """
+
+    def __init__(self, path: str, network_id: str, reorg_depth=12):
+        """
+        :param path: SQLite file, created if it does not exist
+        :param network_id: Network of the events. An index of one network cannot be used for another.
+        :param reorg_depth: How many last indexed blocks are scanned again on update
+        """
+        self.path = path
+        self.reorg_depth = reorg_depth
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('network_id', ?)", (str(network_id),))
+
+        stored_network_id = self.conn.execute("SELECT value FROM meta WHERE name='network_id'").fetchone()[0]
+        if stored_network_id != str(network_id):
+            raise RuntimeError("Event index {} is for network {}, not for {}".format(path, stored_network_id, network_id))
+
+    def close(self):
+        self.conn.close()
+
+    def get_progress(self, address: str, event_name: str) -> Optional[tuple]:
+        """Get (first_block, last_block) indexed for an event, or None if we have not indexed it."""
+        return self.conn.execute("SELECT first_block, last_block FROM progress WHERE address=? AND event_name=?", (address, event_name)).fetchone()
+
+    def update(self, event, from_block=0, to_block: Optional[int]=None, scanner: Optional[LogScanner]=None) -> int:
+        """Index new blocks of an event.
+
+        :param event: Contract event instance, e.g. ``crowdsale.events.Invested()``
+        :param from_block: First block to index when the event has not been indexed before
+        :param to_block: Index up to this block, the latest block if not given
+        :param scanner: Use this scanner instead of the default one
+        :return: Number of events added
+        """
+        return self.update_many([event], from_block, to_block, scanner)
+
+    def update_many(self, events: List, from_block=0, to_block: Optional[int]=None, scanner: Optional[LogScanner]=None) -> int:
+        """Index new blocks of several events with one sweep over the block range.
+
+        The sweep starts from the earliest block any of the events needs. Events and progress are committed after each scanned block range.
+
+        :param events: Contract event instances of one or more contracts
+        :return: Number of events added
+        """
+        web3 = events[0].web3
+        if to_block is None:
+            to_block = web3.eth.blockNumber
+        scanner = scanner or LogScanner(web3)
+
+        # (address, event name) -> (first block, block where we start this run)
+        plan = {}
+        for event in events:
+            progress = self.get_progress(event.address, event.event_name)
+            if progress is None or from_block < progress[0]:
+                # Nothing indexed yet, or asked for earlier blocks than we have
+                plan[(event.address, event.event_name)] = (from_block, from_block)
+            else:
+                plan[(event.address, event.event_name)] = (progress[0], max(progress[0], progress[1] - self.reorg_depth + 1))
+
+        pending = [event for event in events if plan[(event.address, event.event_name)][1] <= to_block]
+        if not pending:
+            return 0
+
+        keys = set((event.address, event.event_name) for event in pending)
+        start = min(plan[key][1] for key in keys)
+        logger.info("Indexing %d event types from block %d to %d", len(pending), start, to_block)
+
+        count = 0
+        for chunk_start, chunk_end, decoded in scanner.scan_chunks(pending, start, to_block):
+            # Commit each chunk, so an interrupted run continues from the last scanned chunk
+            with self.conn:
+                covered = [key for key in keys if plan[key][1] <= chunk_end]
+                for key in covered:
+                    self.conn.execute("DELETE FROM events WHERE address=? AND event_name=? AND block_number>=? AND block_number<=?", key + (max(plan[key][1], chunk_start), chunk_end))
+
+                for e in decoded:
+                    key = (e["address"], e["event"])
+                    if e["blockNumber"] < plan[key][1]:
+                        # Already indexed
+                        continue
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO events (address, event_name, block_number, transaction_index, log_index, transaction_hash, block_hash, args) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        key + (e["blockNumber"], e["transactionIndex"], e["logIndex"], Web3.toHex(e["transactionHash"]), Web3.toHex(e["blockHash"]), json.dumps(dict(e["args"]), default=_encode_arg)))
+                    count += 1
+
+                for key in covered:
+                    self.conn.execute("INSERT OR REPLACE INTO progress (address, event_name, first_block, last_block) VALUES (?, ?, ?, ?)", key + (plan[key][0], chunk_end))
+
+        return count
+
+    def update_contract(self, contract, from_block=0, to_block: Optional[int]=None) -> int:
+        """Index all supported events the contract ABI has.
+
+        :return: Number of events added
+        """
+        if to_block is None:
+            to_block = contract.web3.eth.blockNumber
+        event_names = [item["name"] for item in contract.abi if item["type"] == "event" and item["name"] in SUPPORTED_EVENTS]
+        return sum(self.update(getattr(contract.events, event_name)(), from_block, to_block) for event_name in event_names)
+
+    def get_events(self, address: str, event_name: str, from_block=0) -> Iterable[AttributeDict]:
+        """Read indexed events in block order.
+
+        Events look like the ones from ``get_event_data()``.
+        """
+        return self.get_events_many([(address, event_name)], from_block)
+
+    def get_events_many(self, keys: List[Tuple[str, str]], from_block=0) -> Iterable[AttributeDict]:
+        """Read indexed events of several contracts and event types merged in block order.
+
+        :param keys: List of (address, event name)
+        """
+        where = " OR ".join(["(address=? AND event_name=?)"] * len(keys))
+        params = [value for key in keys for value in key] + [from_block]
+        cursor = self.conn.execute(
+            "SELECT address, event_name, block_number, transaction_index, log_index, transaction_hash, block_hash, args FROM events WHERE ({}) AND block_number>=? ORDER BY block_number, log_index".format(where),
+            params)
+        for address, event_name, block_number, transaction_index, log_index, transaction_hash, block_hash, args in cursor:
+            yield AttributeDict({
+                "event": event_name,
+                "address": address,
+                "args": AttributeDict(json.loads(args, object_hook=_decode_arg)),
+                "blockNumber": block_number,
+                "transactionIndex": transaction_index,
+                "logIndex": log_index,
+                "transactionHash": HexBytes(transaction_hash),
+                "blockHash": HexBytes(block_hash),
+            })
+
+    def count_events(self, address: str, event_name: str, from_block=0) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM events WHERE address=? AND event_name=? AND block_number>=?", (address, event_name, from_block)).fetchone()[0]
+
+
+def open_event_index(web3: Web3, path: str=DEFAULT_INDEX_FILE, reorg_depth=12) -> EventIndex:
+    """Open the shared index for the network web3 is connected to."""
+    return EventIndex(path, web3.version.network, reorg_depth)
+
+
+def index_and_read(index: EventIndex, event, from_block=0) -> Iterable[AttributeDict]:
+    """Bring the index of an event up to date and read all its events.
+
+    :param event: Contract event instance, e.g. ``crowdsale.events.Invested()``
+    """
+    return index_and_read_many(index, [event], from_block)
+
+
+def index_and_read_many(index: EventIndex, events: List, from_block=0) -> Iterable[AttributeDict]:
+    """Bring the index of several events up to date with one sweep and read their events merged in block order.
+
+    :param events: Contract event instances, e.g. ``[crowdsale.events.Invested(), forwarder.events.PaymentForwarded()]``
+    """
+    added = index.update_many(events, from_block)
+    logger.info("Indexed %d new events", added)
+    return index.get_events_many([(event.address, event.event_name) for event in events], from_block)
@@ -0,0 +1,124 @@
+"""Streaming stages of the event extraction commands.
+
+Extractors are built as generator pipelines::
+
+    range scan / event index -> timestamp join -> format rows -> CSV writer
+
+Every stage pulls from the previous one, so only one window of events is held in the memory at a time, no matter how many events the contract has. The only exception is the investor table, where we keep one aggregate per investor address.
+"""
+import csv
+import datetime
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from eth_utils import from_wei
+
+
+def format_timestamp(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat()
+
+
+def investment_rows(timestamped_events: Iterable[Tuple[dict, int]], decimal_multiplier: int) -> Iterator[list]:
+    """Format Invested events to raw investment CSV rows."""
+    for e, timestamp in timestamped_events:
+        amount = Decimal(e["args"]["tokenAmount"]) / Decimal(decimal_multiplier)
+
+        tokens = amount * decimal_multiplier
+
+        # http://stackoverflow.com/a/19965088/315168
+        if not tokens % 1 == 0:
+            raise RuntimeError("Could not convert token amount to decimal format. It was not an integer after restoring non-fractional balance: {} {} {}".format(tokens, amount, decimal_multiplier))
+
+        yield [
+            e["args"]["investor"],
+            format_timestamp(timestamp),
+            e["transactionHash"],
+            e["transactionIndex"],
+            from_wei(e["args"]["weiAmount"], "ether"),
+            amount,
+        ]
+
+
+def issuance_rows(timestamped_events: Iterable[Tuple[dict, int]], decimals: int) -> Iterator[list]:
+    """Format Issued events to issuance CSV rows."""
+    decimal_multiplier = 10**decimals
+    for e, timestamp in timestamped_events:
+        tokens = Decimal(e["args"]["amount"]) / decimal_multiplier
+        tokens = tokens.quantize(Decimal(10 ** -decimals))
+        yield [
+            e["args"]["id"],
+            format_timestamp(timestamp),
+            e["transactionHash"],
+            str(tokens),
+        ]
+
+
+def get_investment(e: dict) -> Tuple[str, int, int]:
+    """Read (investor, wei amount, token amount) from a payment event.
+
+    Understands ``Invested`` of crowdsales and ``PreICOProxyBuyer``, ``Invested`` of ``PresaleFundCollector`` and ``PaymentForwarded``. Presale and payment forwarder events do not have a token amount, it is given as zero.
+    """
+    args = e["args"]
+    if e["event"] == "PaymentForwarded":
+        return args["benefactor"], args["amount"], 0
+    elif "weiAmount" in args:
+        return args["investor"], args["weiAmount"], args["tokenAmount"]
+    elif "value" in args:
+        return args["investor"], args["value"], 0
+    raise RuntimeError("Not a payment event: {}".format(e["event"]))
+
+
+def merge_investors(timestamped_events: Iterable[Tuple[dict, int]], per_contract=False) -> OrderedDict:
+    """Merge several payment events from the same address to one.
+
+    :param per_contract: Keep investments to different contracts apart
+    :return: Address, or (contract address, address) if per_contract, -> dict(first_payment, raised, tokens)
+    """
+    address_data = OrderedDict()
+    for e, timestamp in timestamped_events:
+        investor, wei_amount, token_amount = get_investment(e)
+        key = (e["address"], investor) if per_contract else investor
+        data = address_data.get(key)
+        if data is None:
+            data = address_data[key] = {"first_payment": timestamp, "raised": 0, "tokens": 0}
+        data["first_payment"] = min(data["first_payment"], timestamp)
+        data["raised"] += from_wei(wei_amount, "ether")
+        data["tokens"] += token_amount
+    return address_data
+
+
+def investor_rows(address_data: OrderedDict) -> Iterator[list]:
+    """Format merged investors to CSV rows.
+
+    Per contract tables get the contract address as the first column.
+    """
+    for key, data in address_data.items():
+        yield list(key if isinstance(key, tuple) else [key]) + [
+            format_timestamp(data["first_payment"]),
+            str(data["raised"]),
+            str(data["tokens"]),
+        ]
+
+
+def counted(items: Iterable, progress_interval: Optional[int]=None, label="Writing event") -> Iterator:
+    """Pass items through and print progress."""
+    for idx, item in enumerate(items):
+        if progress_interval and idx % progress_interval == 0:
+            print(label, idx)
+        yield item
+
+
+def write_csv(csv_file: str, header: List[str], rows: Iterable[list]) -> int:
+    """Write rows to a CSV file as they come.
+
+    :return: Number of rows written
+    """
+    count = 0
+    with open(csv_file, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
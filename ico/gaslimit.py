@@ -0,0 +1,88 @@
+"""Gas limit planning for bulk commands.
+
+Gas is estimated once per contract, function and argument shape, and the estimate is reused with a safety margin.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+from web3 import Web3
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_gas_class(func) -> Tuple[str, str, int]:
+    """Transactions in the same class need the same gas.
+
+    Contract address, function selector and the length of ABI encoded arguments.
+    The length captures the shape of the arguments, e.g. the number of addresses passed in an array.
+
+    :param func: Bound contract function
+    """
+    data = func._encode_transaction_data()
+    return func.address, data[:10], len(data)
+
+
+class GasLimitPlanner:
+    """Cache gas estimates per (contract, function, argument shape).
+
+    Example::
+
+        planner = GasLimitPlanner(web3, address)
+        for addr, amount in rows:
+            func = issuer.functions.issue(addr, amount)
+            sender.transact(func, {"gas": planner.get_gas_limit(func), "gasPrice": gas_price})
+    """
+
+    def __init__(self, web3: Web3, address: str, margin=1.25):
+        """
+        :param address: The account that sends the transactions
+        :param margin: Multiply the estimate with this for the gas limit
+        """
+        self.web3 = web3
+        self.address = address
+        self.margin = margin
+
+        #: Gas class -> gas limit
+        self.cache: Dict[Tuple[str, str, int], int] = {}
+
+        #: How many times we have asked the node
+        self.estimate_count = 0
+
+        self.block_gas_limit = web3.eth.getBlock("latest")["gasLimit"]
+
+    def get_gas_limit(self, func, tx_params: Optional[dict]=None, fallback_gas: Optional[int]=None) -> int:
+        """Get the gas limit for a contract function call.
+
+        :param func: Bound contract function, e.g. ``issuer.functions.issue(addr, amount)``
+        :param tx_params: Other transaction parameters that affect gas, e.g. ``value``
+        :param fallback_gas: Gas limit if the node cannot estimate, i.e. the transaction would fail. The transaction is then sent anyway and fails the usual way. None raises the estimate error.
+        """
+        gas_class = get_gas_class(func)
+        gas_limit = self.cache.get(gas_class)
+        if gas_limit is not None:
+            return gas_limit
+
+        tx = {"from": self.address, "to": func.address, "data": func._encode_transaction_data()}
+        if tx_params and "value" in tx_params:
+            tx["value"] = tx_params["value"]
+
+        try:
+            estimate = self.web3.eth.estimateGas(tx)
+        except Exception as e:
+            # Node and tester chain raise different exceptions for a throwing call
+            if fallback_gas is None:
+                raise
+            logger.warning("Could not estimate gas for %s: %s, using %d", func.fn_name, e, fallback_gas)
+            return fallback_gas
+
+        self.estimate_count += 1
+        gas_limit = min(int(estimate * self.margin), self.block_gas_limit)
+        logger.info("Estimated %d gas for %s, data length %d, gas limit %d", estimate, func.fn_name, gas_class[2], gas_limit)
+        self.cache[gas_class] = gas_limit
+        return gas_limit
+
+    def invalidate(self, gas_class: Tuple[str, str, int]):
+        """A transaction of this class ran out of gas, estimate again on the next call."""
+        if self.cache.pop(gas_class, None):
+            logger.warning("Gas limit for %s was not enough, estimating again", gas_class)
@@ -0,0 +1,109 @@
+"""Gas price oracle shared by the command line tools.
+
+Picks a percentile of the gas prices paid in recent blocks and caches it for a while.
+"""
+import logging
+import time
+from typing import List, Optional
+
+from web3 import Web3
+
+from ico.utils import make_batch_request
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Percentile of recent transaction gas prices each kind of job pays
+STRATEGIES = {
+    # A handful of transactions where the operator is waiting at the terminal
+    "deploy": 75,
+
+    # Bulk jobs where throughput comes from pipelining, not from outbidding others
+    "distribute": 50,
+    "refund": 50,
+    "reclaim": 50,
+    "rebuild": 50,
+}
+
+
+def percentile(values: List[int], pct: float) -> int:
+    """Nearest rank percentile of sorted values."""
+    assert values
+    assert 0 <= pct <= 100
+    idx = int(round(pct / 100 * (len(values) - 1)))
+    return values[idx]
+
+
+class GasPriceOracle:
+    """Suggest gas price based on recent blocks.
+
+    Example::
+
+        oracle = GasPriceOracle(web3, "distribute", max_gas_price=50 * 10**9)
+        for addr, amount in rows:
+            sender.transact(issuer.functions.issue(addr, amount), {"gasPrice": oracle.get_gas_price(), "gas": 200000})
+    """
+
+    def __init__(self, web3: Web3, strategy="distribute", block_count=20, ttl=60, max_gas_price: Optional[int]=None, override: Optional[int]=None):
+        """
+        :param strategy: One of :py:data:`STRATEGIES`
+        :param block_count: How many latest blocks we sample
+        :param ttl: How many seconds a suggested gas price is reused
+        :param max_gas_price: Ceiling in wei, never suggest more than this
+        :param override: Fixed gas price in wei given by the user, skips the oracle
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown gas price strategy {}, use one of {}".format(strategy, ", ".join(STRATEGIES.keys())))
+
+        self.web3 = web3
+        self.strategy = strategy
+        self.block_count = block_count
+        self.ttl = ttl
+        self.max_gas_price = max_gas_price
+        self.override = override
+
+        self.cached_gas_price = None
+        self.cached_at = 0
+
+    def get_gas_price(self) -> int:
+        """Get the suggested gas price in wei."""
+
+        if self.override:
+            return self.override
+
+        now = time.time()
+        if self.cached_gas_price is None or now - self.cached_at >= self.ttl:
+            self.cached_gas_price = self.fetch_gas_price()
+            self.cached_at = now
+
+        return self.cached_gas_price
+
+    def fetch_gas_price(self) -> int:
+        """Sample recent blocks for gas prices.
+
+        Empty blocks happen on testnets - fall back to what the node suggests.
+        """
+        latest = self.web3.eth.blockNumber
+        first = max(0, latest - self.block_count + 1)
+        blocks = make_batch_request(self.web3, [("eth_getBlockByNumber", [hex(n), True]) for n in range(first, latest + 1)])
+        prices = sorted(tx["gasPrice"] for block in blocks if block for tx in block["transactions"])
+
+        if prices:
+            gas_price = percentile(prices, STRATEGIES[self.strategy])
+        else:
+            gas_price = self.web3.eth.gasPrice
+
+        if self.max_gas_price and gas_price > self.max_gas_price:
+            logger.warning("Suggested gas price %d GWei is over the ceiling %d GWei", gas_price // 10**9, self.max_gas_price // 10**9)
+            gas_price = self.max_gas_price
+
+        logger.info("Gas price for %s is %f GWei, sampled %d transactions in blocks %d - %d", self.strategy, gas_price / 10**9, len(prices), first, latest)
+        return gas_price
+
+
+def get_gas_price_oracle(web3: Web3, strategy: str, gas_price_gwei: Optional[str]=None, max_gas_price_gwei: Optional[str]=None) -> GasPriceOracle:
+    """Create an oracle from the command line options given in GWei."""
+    override = int(gas_price_gwei) * 10**9 if gas_price_gwei else None
+    max_gas_price = int(max_gas_price_gwei) * 10**9 if max_gas_price_gwei else None
+    return GasPriceOracle(web3, strategy, max_gas_price=max_gas_price, override=override)
@@ -0,0 +1,253 @@
+"""Crash-safe local journal for bulk distribution commands.
+
+Bulk commands (distribute-tokens, token-vault load, rebuild-crowdsale) record every row they are going to process to a SQLite file: planned amount, the transaction carrying the row, its nonce and the outcome from the receipt. When a run is interrupted and restarted with the same journal, rows that are already confirmed are skipped without touching the node and only the transactions that were in flight are polled again.
+
+A stuck transaction may be replaced with the same nonce and a higher gas price. Rows keep pointing to the original txid until one of the versions is mined, and then to the version that landed.
+
+Row states:
+
+* ``planned`` - row is known, but we have not sent a transaction for it, or the transaction was dropped
+
+* ``sent`` - transaction broadcasted, waiting for a receipt
+
+* ``confirmed`` - transaction mined successfully
+
+* ``failed`` - transaction mined, but Solidity code threw
+"""
+import logging
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from web3 import Web3
+
+from ico.utils import confirm_replaced_transactions
+from ico.utils import make_batch_request
+from ico.utils import txid_to_hex
+
+
+logger = logging.getLogger(__name__)
+
+
+PLANNED = "planned"
+SENT = "sent"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rows (
+    key TEXT PRIMARY KEY,
+    amount TEXT,
+    status TEXT NOT NULL,
+    nonce INTEGER,
+    txid TEXT,
+    gas_price TEXT,
+    block_number INTEGER,
+    gas_used INTEGER,
+    updated_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS rows_txid ON rows (txid);
+CREATE INDEX IF NOT EXISTS rows_status ON rows (status);
+
+CREATE TABLE IF NOT EXISTS versions (
+    txid TEXT PRIMARY KEY,
+    original_txid TEXT NOT NULL,
+    gas_price TEXT,
+    created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS versions_original_txid ON versions (original_txid);
+"""
+
+
+class Journal:
+    """SQLite backed journal of rows processed by a bulk command.
+
+    Every state change is committed before we return, so the journal is consistent even if the process is killed.
+
+    Example::
+
+        journal = Journal("distribution.sqlite", context="distribute-tokens:{}".format(issuer.address))
+        journal.recover(web3)
+        done = journal.get_confirmed_keys()
+        journal.plan([(addr, tokens) for addr, tokens in rows if addr not in done])
+    """
+
+    def __init__(self, path: str, context: str):
+        """
+        :param path: SQLite file, created if it does not exist
+        :param context: Identifies the command and the target contract. A journal cannot be reused for a different context, so that we do not skip rows based on some other distribution.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+        # Survive power loss, not just process crashes
+        self.conn.execute("PRAGMA synchronous=FULL")
+
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('context', ?)", (context,))
+
+        stored_context = self.conn.execute("SELECT value FROM meta WHERE name='context'").fetchone()[0]
+        if stored_context != context:
+            raise RuntimeError("Journal {} belongs to {}, not to {}".format(path, stored_context, context))
+
+    def close(self):
+        self.conn.close()
+
+    def plan(self, rows: Iterable[Tuple[str, Optional[int]]]):
+        """Record rows we are going to process.
+
+        Rows already in the journal keep their state.
+
+        :param rows: (key, raw amount) tuples
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO rows (key, amount, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(str(key), str(amount) if amount is not None else None, PLANNED, now) for key, amount in rows])
+
+    def get_status(self, key: str) -> Optional[str]:
+        """Get the state of a row, or None if the row is not in the journal."""
+        row = self.conn.execute("SELECT status FROM rows WHERE key=?", (str(key),)).fetchone()
+        return row[0] if row else None
+
+    def get_confirmed_keys(self) -> Set[str]:
+        """Keys of the rows we know to be done."""
+        return set(key for key, in self.conn.execute("SELECT key FROM rows WHERE status=?", (CONFIRMED,)))
+
+    def get_counts(self) -> Dict[str, int]:
+        """How many rows are in each state."""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM rows GROUP BY status"))
+
+    def get_in_flight(self) -> Dict[str, List[str]]:
+        """Transactions sent, but not seen mined.
+
+        :return: txid -> keys of the rows the transaction carries
+        """
+        in_flight = {}
+        for key, txid in self.conn.execute("SELECT key, txid FROM rows WHERE status=? ORDER BY nonce", (SENT,)):
+            in_flight.setdefault(txid, []).append(key)
+        return in_flight
+
+    def mark_sent(self, keys: Iterable[str], txid, nonce: int, gas_price: Optional[int]=None):
+        """Record that a transaction carrying rows has been broadcasted."""
+        txid = txid_to_hex(txid)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows (key, amount, status, nonce, txid, gas_price, updated_at) "
+                "VALUES (?, (SELECT amount FROM rows WHERE key=?), ?, ?, ?, ?, ?)",
+                [(str(key), str(key), SENT, nonce, txid, str(gas_price) if gas_price is not None else None, now) for key in keys])
+
+    def mark_replaced(self, original_txid, txid, gas_price: int):
+        """Record a replacement of a stuck transaction.
+
+        :param original_txid: The first version of the transaction
+        :param txid: The new version with the same nonce
+        """
+        original_txid = txid_to_hex(original_txid)
+        txid = txid_to_hex(txid)
+        now = time.time()
+        with self.conn:
+            # Keep the gas price of the original version around in case it gets mined after all
+            self.conn.execute(
+                "INSERT OR IGNORE INTO versions (txid, original_txid, gas_price, created_at) "
+                "VALUES (?, ?, (SELECT gas_price FROM rows WHERE txid=? LIMIT 1), ?)",
+                (original_txid, original_txid, original_txid, now))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO versions (txid, original_txid, gas_price, created_at) VALUES (?, ?, ?, ?)",
+                (txid, original_txid, str(gas_price), now))
+
+    def get_versions(self, original_txid) -> List[str]:
+        """All broadcasted versions of a transaction, starting from the original."""
+        original_txid = txid_to_hex(original_txid)
+        versions = [txid for txid, in self.conn.execute("SELECT txid FROM versions WHERE original_txid=? ORDER BY created_at", (original_txid,))]
+        return versions or [original_txid]
+
+    def mark_mined(self, txid, receipt: dict, failed: bool):
+        """Record the outcome of a transaction for all rows it carried.
+
+        :param txid: Any version of the transaction, the one that got mined
+        """
+        txid = txid_to_hex(txid)
+        version = self.conn.execute("SELECT original_txid, gas_price FROM versions WHERE txid=?", (txid,)).fetchone()
+        with self.conn:
+            if version:
+                original_txid, gas_price = version
+                self.conn.execute(
+                    "UPDATE rows SET status=?, txid=?, gas_price=?, block_number=?, gas_used=?, updated_at=? WHERE txid=?",
+                    (FAILED if failed else CONFIRMED, txid, gas_price, receipt["blockNumber"], receipt["gasUsed"], time.time(), original_txid))
+            else:
+                self.conn.execute(
+                    "UPDATE rows SET status=?, block_number=?, gas_used=?, updated_at=? WHERE txid=?",
+                    (FAILED if failed else CONFIRMED, receipt["blockNumber"], receipt["gasUsed"], time.time(), txid))
+
+    def mark_dropped(self, txid):
+        """Transaction never made it to the chain, rows can be sent again."""
+        txid = txid_to_hex(txid)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE rows SET status=?, nonce=NULL, txid=NULL, gas_price=NULL, updated_at=? WHERE txid=?",
+                (PLANNED, time.time(), txid))
+
+    def recover(self, web3: Web3, timeout=1800) -> Tuple[int, int, int]:
+        """Resolve transactions that were in flight when the previous run stopped.
+
+        Transactions of which the node no longer knows any version are dropped and their rows go back to planned state.
+        The rest are waited for, whichever version gets mined.
+
+        :return: Tuple (confirmed, failed, dropped) transaction counts
+        """
+        in_flight = list(self.get_in_flight().keys())
+        if not in_flight:
+            return 0, 0, 0
+
+        logger.info("Journal %s has %d transactions in flight", self.path, len(in_flight))
+
+        groups = [self.get_versions(txid) for txid in in_flight]
+        versions = [txid for group in groups for txid in group]
+        txinfos = dict(zip(versions, make_batch_request(web3, [("eth_getTransactionByHash", [txid]) for txid in versions])))
+        known = []
+        dropped = 0
+        for original_txid, group in zip(in_flight, groups):
+            if any(txinfos[txid] for txid in group):
+                known.append(group)
+            else:
+                self.mark_dropped(original_txid)
+                dropped += 1
+
+        confirmed = failed = 0
+        for mined_txid, receipt, tx_failed in confirm_replaced_transactions(web3, known, timeout=timeout):
+            self.mark_mined(mined_txid, receipt, tx_failed)
+            if tx_failed:
+                failed += 1
+            else:
+                confirmed += 1
+
+        return confirmed, failed, dropped
+
+
+def open_journal(web3: Web3, path: Optional[str], context: str) -> Tuple[Optional[Journal], Set[str]]:
+    """Open the journal of a bulk command and resolve transactions the previous run left in flight.
+
+    :param path: Journal file, None to run without a journal
+    :return: Tuple (journal or None, keys of confirmed rows)
+    """
+    if not path:
+        return None, set()
+
+    journal = Journal(path, context)
+    confirmed_count, failed_count, dropped_count = journal.recover(web3)
+    print("Journal", path, "resolved", confirmed_count, "confirmed,", failed_count, "failed and", dropped_count, "dropped transactions from the previous run")
+    journaled = journal.get_confirmed_keys()
+    print("Journal has", len(journaled), "confirmed rows")
+    return journal, journaled
@@ -0,0 +1,135 @@
+"""Chunked event log scanning.
+
+Walks a block range with ``eth_getLogs`` in adaptive chunks, for one or several contracts, and yields decoded events as they come.
+"""
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from eth_utils import event_abi_to_log_topic
+from requests.exceptions import RequestException
+from web3 import Web3
+from web3.utils.events import get_event_data
+
+
+logger = logging.getLogger(__name__)
+
+
+class LogScanner:
+    """Scan event logs over a block range in adaptive chunks.
+
+    Example::
+
+        scanner = LogScanner(web3)
+        for event in scanner.scan(crowdsale.events.Invested(), from_block=deployment_block):
+            print(event["args"]["investor"])
+    """
+
+    def __init__(self, web3: Web3, initial_chunk=2000, min_chunk=1, max_chunk=100000, target_logs=1000):
+        """
+        :param initial_chunk: How many blocks we ask in the first request
+        :param min_chunk: Give up if the node fails a range this small
+        :param max_chunk: Never ask more blocks than this in one request
+        :param target_logs: Shrink the chunk if a response has more logs than this, grow it if there are less than half
+        """
+        self.web3 = web3
+        self.chunk = initial_chunk
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.target_logs = target_logs
+
+        #: How many eth_getLogs requests we have made
+        self.request_count = 0
+
+    def get_logs(self, address, topics: list, start: int, end: int) -> list:
+        """
+        :param address: Contract address or list of addresses
+        :param topics: Topic filter, the first item can be a list of alternative event topics
+        """
+        self.request_count += 1
+        return self.web3.eth.getLogs({"address": address, "topics": topics, "fromBlock": start, "toBlock": end})
+
+    def scan(self, event, from_block=0, to_block: Optional[int]=None) -> Iterable[dict]:
+        """Yield decoded events in block order.
+
+        :param event: Contract event instance, e.g. ``crowdsale.events.Invested()``
+        :param from_block: First block to scan, e.g. the contract deployment block
+        :param to_block: Last block to scan, the latest block if not given
+        """
+        return self.scan_many([event], from_block, to_block)
+
+    def scan_many(self, events: List, from_block=0, to_block: Optional[int]=None) -> Iterable[dict]:
+        """Yield decoded events of several contracts in block order with one sweep over the block range.
+
+        :param events: Contract event instances, e.g. ``[crowdsale.events.Invested(), forwarder.events.PaymentForwarded()]``
+        """
+        for start, end, decoded in self.scan_chunks(events, from_block, to_block):
+            yield from decoded
+
+    def scan_chunks(self, events: List, from_block=0, to_block: Optional[int]=None) -> Iterable[Tuple[int, int, List[dict]]]:
+        """Like :py:meth:`scan_many`, but yield the events of each scanned block range together.
+
+        :return: Iterator of (first block, last block, decoded events) tuples covering the whole range
+        """
+        if to_block is None:
+            to_block = self.web3.eth.blockNumber
+
+        # (address, topic) -> event we decode the log with
+        decoders = {}
+        addresses = []
+        topics = []
+        for event in events:
+            topic = Web3.toHex(event_abi_to_log_topic(event.abi))
+            decoders[(event.address.lower(), topic)] = event
+            if event.address not in addresses:
+                addresses.append(event.address)
+            if topic not in topics:
+                topics.append(topic)
+
+        address = addresses[0] if len(addresses) == 1 else addresses
+        topics = [topics[0] if len(topics) == 1 else topics]
+        event_names = ", ".join(sorted(set(event.event_name for event in events)))
+
+        start = from_block
+        while start <= to_block:
+            end, logs = self._get_logs_adaptive(address, topics, start, to_block)
+            logger.debug("Blocks %d - %d had %d %s events", start, end, len(logs), event_names)
+            decoded = []
+            for log in logs:
+                event = decoders.get((log["address"].lower(), Web3.toHex(log["topics"][0])))
+                if event:
+                    decoded.append(get_event_data(event.abi, log))
+            yield start, end, decoded
+            start = end + 1
+
+    def _get_logs_adaptive(self, address, topics: list, start: int, to_block: int) -> Tuple[int, list]:
+        """Get logs of the next chunk starting from a block.
+
+        The chunk shrinks on errors and after lots of logs, and grows after few logs.
+
+        :return: Tuple (last block of the chunk, logs)
+        """
+        while True:
+            end = min(start + self.chunk - 1, to_block)
+            try:
+                logs = self.get_logs(address, topics, start, end)
+                break
+            except (ValueError, RequestException) as e:
+                # Timeout or too many results, try a smaller range
+                if self.chunk <= self.min_chunk:
+                    raise
+                self.chunk = max(self.min_chunk, self.chunk // 2)
+                logger.warning("getLogs failed for blocks %d - %d: %s, chunk size now %d", start, end, e, self.chunk)
+
+        if len(logs) > self.target_logs:
+            self.chunk = max(self.min_chunk, self.chunk // 2)
+        elif len(logs) < self.target_logs // 2:
+            self.chunk = min(self.max_chunk, self.chunk * 2)
+        return end, logs
+
+
+def scan_events(event, from_block=0, to_block: Optional[int]=None) -> Iterable[dict]:
+    """Yield all events of a contract with the default scanner settings.
+
+    :param event: Contract event instance, e.g. ``crowdsale.events.Invested()``
+    """
+    return LogScanner(event.web3).scan(event, from_block, to_block)
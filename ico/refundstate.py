@@ -0,0 +1,289 @@
+"""Refund state as an append-only, fsync'd JSON lines log where the latest record of each refund id wins."""
+
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+from web3 import Web3
+
+from ico.utils import confirm_replaced_transactions
+from ico.utils import make_batch_request
+from ico.utils import txid_to_hex
+
+
+logger = logging.getLogger(__name__)
+
+
+#: We are about to broadcast the refund transaction with the recorded nonce
+SENDING = "sending"
+
+#: Refund transaction was never broadcasted, it is safe to send again
+UNSENT = "unsent"
+
+#: Refund transaction broadcasted, outcome unknown
+SENT = "sent"
+
+#: Refund transaction mined successfully
+CONFIRMED = "confirmed"
+
+#: Refund transaction mined, but failed
+FAILED = "failed"
+
+
+class RefundStateLog:
+    """Line delimited, fsync'd log of refund state with an in-memory index.
+
+    Each line is a JSON object with at least ``id`` field. Later lines update the fields of earlier lines with the same id.
+
+    Example::
+
+        log = RefundStateLog("refund-state.jsonl")
+        if not log.is_refunded(id):
+            txid = web3.eth.sendTransaction(...)
+            log.record(id, address=addr, amount_wei=amount_wei, txid=txid, status=SENT)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        #: id -> merged record
+        self.state: Dict[str, dict] = {}
+
+        #: txid -> id
+        self.txids: Dict[str, str] = {}
+
+        #: How many lines there are in the log, to decide when compaction pays off
+        self.line_count = 0
+
+        if os.path.exists(path):
+            self.load()
+
+        self.out = open(path, "ab")
+
+    def load(self):
+        """Read the log to the in-memory index.
+
+        A partial last line, left by a crash in the middle of a write, is discarded and truncated away.
+        """
+        with open(self.path, "rb") as inp:
+            data = inp.read()
+
+        good_length = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                logger.warning("Discarding torn last line in %s: %s", self.path, line)
+                break
+
+            good_length += len(line)
+
+            if not line.strip():
+                continue
+
+            record = json.loads(line.decode("utf-8"))
+            self.state.setdefault(record["id"], {}).update(record)
+            if "txid" in record:
+                self.txids[record["txid"]] = record["id"]
+            for txid in record.get("replaced_txids", []):
+                self.txids[txid] = record["id"]
+            self.line_count += 1
+
+        if good_length != len(data):
+            with open(self.path, "r+b") as out:
+                out.truncate(good_length)
+                os.fsync(out.fileno())
+
+    def close(self):
+        self.out.close()
+
+    def record(self, id: str, **fields) -> dict:
+        """Durably record new state of a refund.
+
+        The record is on the disk when we return.
+
+        :return: Merged record of the refund
+        """
+        record = dict(fields, id=id)
+        self.out.write(json.dumps(record).encode("utf-8") + b"\n")
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.line_count += 1
+
+        merged = self.state.setdefault(id, {})
+        merged.update(record)
+        if "txid" in record:
+            self.txids[record["txid"]] = id
+        for txid in record.get("replaced_txids", []):
+            self.txids[txid] = id
+        return merged
+
+    def get(self, id: str) -> Optional[dict]:
+        return self.state.get(id)
+
+    def is_refunded(self, id: str) -> bool:
+        """Have we sent a refund for this id that has not failed.
+
+        Sent but unconfirmed refunds count as refunded, so that we never pay twice.
+        """
+        record = self.state.get(id)
+        return record is not None and record.get("status") not in (FAILED, UNSENT)
+
+    def mark_sent(self, keys: Iterable[str], txid, nonce: int, gas_price: Optional[int]=None):
+        """Record a broadcasted refund.
+
+        Called by :py:class:`ico.sender.PipelinedSender`.
+        """
+        for id in keys:
+            self.record(id, txid=txid_to_hex(txid), nonce=nonce, gas_price=gas_price, status=SENT)
+
+    def mark_replaced(self, original_txid, txid, gas_price: int):
+        """Record a replacement of a stuck refund transaction.
+
+        Called by :py:class:`ico.sender.PipelinedSender`.
+        """
+        id = self.txids[txid_to_hex(original_txid)]
+        replaced_txids = self.state[id].get("replaced_txids", []) + [self.state[id]["txid"]]
+        self.record(id, txid=txid_to_hex(txid), gas_price=gas_price, replaced_txids=replaced_txids)
+
+    def mark_mined(self, txid, receipt: dict, failed: bool):
+        """Record the outcome of a refund transaction.
+
+        Called by :py:class:`ico.sender.PipelinedSender`.
+
+        :param txid: Any version of the refund transaction, the one that got mined
+        """
+        txid = txid_to_hex(txid)
+        id = self.txids[txid]
+        self.record(id, txid=txid, status=FAILED if failed else CONFIRMED, block_number=receipt["blockNumber"], gas_used=receipt["gasUsed"])
+
+    def recover(self, web3: Web3, address: str, timeout=1800) -> Tuple[int, int, int, int]:
+        """Resolve refunds that were in flight when the previous run stopped.
+
+        * Refunds we were about to send are unsent if the hot wallet nonce has not moved past their nonce. Otherwise the node got the transaction, but we do not know its txid, and the refund stays counted as sent.
+
+        * Sent refunds are waited for if the node knows any version of the transaction. Unknown transactions are left as sent for manual checking.
+
+        :return: Tuple (confirmed, failed, unsent, unknown) counts
+        """
+        confirmed = failed = unsent = unknown = 0
+
+        sending = [record for record in self.state.values() if record.get("status") == SENDING]
+        if sending:
+            next_nonce = web3.eth.getTransactionCount(address, "pending")
+            for record in sending:
+                if record["nonce"] >= next_nonce:
+                    self.record(record["id"], status=UNSENT)
+                    unsent += 1
+                else:
+                    logger.warning("Refund %s with nonce %d was broadcasted, but its txid was not recorded", record["id"], record["nonce"])
+                    self.record(record["id"], status=SENT)
+                    unknown += 1
+
+        groups = [record.get("replaced_txids", []) + [record["txid"]] for record in self.state.values() if record.get("status") == SENT and record.get("txid")]
+        if not groups:
+            return confirmed, failed, unsent, unknown
+
+        versions = [txid for group in groups for txid in group]
+        txinfos = dict(zip(versions, make_batch_request(web3, [("eth_getTransactionByHash", [txid]) for txid in versions])))
+        known = []
+        for group in groups:
+            if any(txinfos[txid] for txid in group):
+                known.append(group)
+            else:
+                logger.warning("Node does not know refund transaction %s", group[-1])
+                unknown += 1
+
+        for mined_txid, receipt, tx_failed in confirm_replaced_transactions(web3, known, timeout=timeout):
+            self.mark_mined(mined_txid, receipt, tx_failed)
+            if tx_failed:
+                failed += 1
+            else:
+                confirmed += 1
+
+        return confirmed, failed, unsent, unknown
+
+    def needs_compaction(self, ratio=2) -> bool:
+        """Is the log considerably longer than the state it holds."""
+        return self.line_count > ratio * max(len(self.state), 1)
+
+    def compact(self):
+        """Rewrite the log with one line per refund id.
+
+        The new log is written next to the old one and atomically moved over it, so a crash leaves either the old or the new log intact.
+        """
+        tmp_path = self.path + ".compact"
+        with open(tmp_path, "wb") as out:
+            for record in self.state.values():
+                out.write(json.dumps(record).encode("utf-8") + b"\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+        self.out.close()
+        os.replace(tmp_path, self.path)
+        fsync_dir(self.path)
+        self.out = open(self.path, "ab")
+        self.line_count = len(self.state)
+
+    def migrate_json(self, json_path: str) -> int:
+        """Import the old style JSON state file.
+
+        The old file maps refund id to txid, written right after the refund was broadcasted.
+
+        :return: Number of imported refunds
+        """
+        with open(json_path, "rt") as inp:
+            old_state = json.load(inp)
+
+        imported = 0
+        for id, txid in old_state.items():
+            if id in self.state:
+                continue
+            self.state[id] = {"id": id, "txid": txid, "status": SENT}
+            imported += 1
+
+        # Write all imported records in one go
+        self.compact()
+        return imported
+
+
+def fsync_dir(path: str):
+    """Make a rename in the directory durable."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def open_state_log(state_file: str) -> RefundStateLog:
+    """Open the refund state log of the refund command.
+
+    An old style JSON state file, e.g. ``refund-state.json``, is imported once to ``refund-state.jsonl`` next to it and left untouched.
+    A log with lots of superseded lines is compacted.
+    """
+    if state_file.endswith(".json"):
+        legacy_state_file = state_file
+        state_file = state_file[0:-len(".json")] + ".jsonl"
+    else:
+        legacy_state_file = None
+
+    migrate = legacy_state_file and os.path.exists(legacy_state_file) and not os.path.exists(state_file)
+    state = RefundStateLog(state_file)
+    if migrate:
+        print("Migrating", state.migrate_json(legacy_state_file), "refunds from", legacy_state_file, "to", state_file)
+    elif state.needs_compaction():
+        print("Compacting state file", state_file)
+        state.compact()
+
+    print("State file", state_file, "has", len(state.state), "refunds")
+    return state
+
+
+def resume_refunds(state: RefundStateLog, web3: Web3, address: str) -> Tuple[int, int, int, int]:
+    """Resolve refunds in flight when the previous run stopped and tell how they went.
+
+    :return: Tuple (confirmed, failed, unsent, unknown) counts, see :py:meth:`RefundStateLog.recover`
+    """
+    confirmed, failed, unsent, unknown = state.recover(web3, address)
+    print("Previous run had", confirmed, "confirmed,", failed, "failed,", unsent, "unsent refunds and", unknown, "refunds that need manual checking")
+    return confirmed, failed, unsent, unknown
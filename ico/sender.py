@@ -0,0 +1,496 @@
+"""Pipelined transaction sending with local nonce management.
+
+Keeps a window of transactions in flight and refills it as soon as any of them confirms.
+"""
+import abc
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+from eth_account import Account
+from web3 import Web3
+from web3.contract import Contract
+
+from ico.costs import CostTracker
+from ico.gaslimit import GasLimitPlanner
+from ico.gaslimit import get_gas_class
+from ico.journal import Journal
+from ico.utils import TransactionFailure
+from ico.utils import check_multiple_succesful_txs
+from ico.utils import make_batch_request
+from ico.utils import multicall
+from ico.utils import txid_to_hex
+
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionSender(abc.ABC):
+    """Interface through which bulk commands send their transactions.
+
+    Senders that broadcast, sign to a bundle or only simulate all implement it, so a command can use any of them.
+    Each sender has a :py:class:`ico.costs.CostTracker` as ``costs``.
+    """
+
+    @abc.abstractmethod
+    def transact(self, func, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a contract function call.
+
+        :param func: Bound contract function, e.g. ``issuer.functions.issue(addr, amount)``
+        :param tx_params: Transaction parameters. ``from`` and ``nonce`` are filled in.
+        :param journal_keys: Journal rows this transaction carries
+        :param rows: How many input rows this transaction carries for cost accounting. Defaults to the number of journal keys or one.
+        :return: Transaction hash
+        """
+
+    @abc.abstractmethod
+    def send_transaction(self, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a plain transaction, e.g. ETH value transfer.
+
+        :return: Transaction hash
+        """
+
+    @abc.abstractmethod
+    def flush(self):
+        """Wait until everything sent has been dealt with."""
+
+
+class PendingTransaction:
+    """A transaction we have broadcasted, but have not seen mined yet.
+
+    A stuck transaction can be replaced with the same nonce and a higher gas price. Any of the versions may be mined.
+    """
+
+    def __init__(self, txid: str, nonce: int, tx: dict, sent_at: float, journal_keys: tuple=(), rows=1, send: Optional[Callable]=None):
+        self.txid = txid
+        self.nonce = nonce
+        self.tx = tx
+        self.sent_at = sent_at
+        self.journal_keys = journal_keys
+        self.rows = rows
+
+        #: Function that broadcasts tx, for replacements
+        self.send = send
+
+        #: All broadcasted versions of this transaction: txid -> gas price
+        self.versions = OrderedDict([(txid, tx.get("gasPrice"))])
+
+        #: When the latest version was broadcasted
+        self.last_sent_at = sent_at
+
+        #: Bound contract function and its gas class for :py:meth:`PipelinedSender.resend_out_of_gas`
+        self.func = None
+        self.gas_class = None
+
+
+class PipelinedSender(TransactionSender):
+    """Send transactions from a single account keeping N transactions in flight.
+
+    * Nonce is read from the node once and then incremented locally
+
+    * :py:meth:`transact` blocks only when the window is full
+
+    * Receipts of all in-flight transactions are polled together in one JSON-RPC batch
+
+    * With ``stuck_timeout``, a transaction not mined in time is rebroadcasted with the same nonce and a bumped gas price, so that one underpriced nonce does not stall the whole pipeline
+
+    Example::
+
+        sender = PipelinedSender(web3, address, max_in_flight=64)
+        for addr, amount in rows:
+            sender.transact(issuer.functions.issue(addr, amount), {"gasPrice": gas_price, "gas": 200000})
+        sender.flush()
+    """
+
+    def __init__(self, web3: Web3, address: str, max_in_flight=16, poll_interval=1.0, timeout=1800, journal: Optional[Journal]=None, costs: Optional[CostTracker]=None, stuck_timeout: Optional[float]=None, gas_bump=1.2, max_gas_price: Optional[int]=None, gas_planner: Optional[GasLimitPlanner]=None):
+        """
+        :param address: The account that signs and pays for the transactions. Either unlocked on the node or with a signing middleware installed.
+        :param max_in_flight: How many unconfirmed transactions we can have in the mempool
+        :param poll_interval: Seconds to sleep between receipt polls when the window is full
+        :param timeout: Give up if a transaction has not been mined in this many seconds
+        :param journal: Record sent and mined transactions of journaled rows here. :py:class:`ico.journal.Journal` or any object with the same ``mark_sent()``, ``mark_replaced()`` and ``mark_mined()`` methods.
+        :param costs: Cost tracker, give the same tracker to multiple senders to get the grand total
+        :param stuck_timeout: Replace a transaction not mined in this many seconds. None disables the replacement.
+        :param gas_bump: Gas price multiplier for a replacement. Nodes require at least 10% bump.
+        :param max_gas_price: Never bump gas price over this ceiling in wei
+        :param gas_planner: When a contract call runs out of gas, estimate its class again with this planner and resend it
+        """
+        assert max_in_flight > 0
+        self.web3 = web3
+        self.address = address
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.journal = journal
+        self.stuck_timeout = stuck_timeout
+        self.gas_bump = gas_bump
+        self.max_gas_price = max_gas_price
+        self.gas_planner = gas_planner
+        self.nonce = web3.eth.getTransactionCount(address, "pending")
+
+        #: txid -> PendingTransaction, in nonce order
+        self.pending = OrderedDict()
+
+        #: How many transactions we have seen mined successfully
+        self.confirmed_count = 0
+
+        #: Cost of mined transactions, summed up from the receipts
+        self.costs = costs or CostTracker()
+
+        #: How many replacement transactions we have broadcasted
+        self.replaced_count = 0
+
+    def transact(self, func, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a contract function call, blocking while the window is full.
+
+        See :py:meth:`TransactionSender.transact`.
+        """
+        txid = self._send(func.transact, tx_params, journal_keys, rows)
+        if self.gas_planner:
+            self.pending[txid].func = func
+            self.pending[txid].gas_class = get_gas_class(func)
+        return txid
+
+    def send_transaction(self, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a plain transaction, e.g. ETH value transfer.
+
+        :return: Transaction hash
+        """
+        return self._send(self.web3.eth.sendTransaction, tx_params, journal_keys, rows)
+
+    def _send(self, send: Callable, tx_params: dict, journal_keys: Iterable[str], rows: Optional[int]) -> str:
+
+        while len(self.pending) >= self.max_in_flight:
+            self.poll()
+            if len(self.pending) >= self.max_in_flight:
+                time.sleep(self.poll_interval)
+
+        tx = dict(tx_params)
+        tx["from"] = self.address
+        tx["nonce"] = self.nonce
+
+        try:
+            txid = send(tx)
+        except Exception:
+            # The node may or may not have accepted the nonce, resync before the caller decides what to do
+            self.nonce = self.web3.eth.getTransactionCount(self.address, "pending")
+            raise
+
+        self.nonce += 1
+        journal_keys = tuple(journal_keys)
+        if self.journal and journal_keys:
+            self.journal.mark_sent(journal_keys, txid, tx["nonce"], tx.get("gasPrice"))
+        if rows is None:
+            rows = len(journal_keys) or 1
+        self.pending[txid] = PendingTransaction(txid, tx["nonce"], tx, time.time(), journal_keys, rows, send)
+        logger.debug("Sent %s with nonce %d, %d transactions in flight", txid, tx["nonce"], len(self.pending))
+        return txid
+
+    def replace(self, pending_tx: PendingTransaction) -> Optional[str]:
+        """Rebroadcast a stuck transaction with the same nonce and a bumped gas price.
+
+        :return: Replacement transaction hash or None if we could not replace
+        """
+        gas_price = pending_tx.tx.get("gasPrice")
+        if gas_price is None:
+            gas_price = self.web3.eth.getTransaction(pending_tx.txid)["gasPrice"]
+
+        new_gas_price = int(gas_price * self.gas_bump)
+        if self.max_gas_price and new_gas_price > self.max_gas_price:
+            if gas_price * 1.1 >= self.max_gas_price:
+                logger.warning("Transaction %s is stuck, but gas price %d is already at the ceiling", txid_to_hex(pending_tx.txid), gas_price)
+                pending_tx.last_sent_at = time.time()
+                return None
+            new_gas_price = self.max_gas_price
+
+        tx = dict(pending_tx.tx, gasPrice=new_gas_price)
+        try:
+            new_txid = pending_tx.send(tx)
+        except ValueError as e:
+            # Typically "nonce too low" when the old version got mined meanwhile,
+            # we will see its receipt on the next poll
+            logger.warning("Could not replace %s: %s", txid_to_hex(pending_tx.txid), e)
+            pending_tx.last_sent_at = time.time()
+            return None
+
+        logger.info("Replaced stuck %s with %s, nonce %d, gas price %d -> %d", txid_to_hex(pending_tx.txid), txid_to_hex(new_txid), pending_tx.nonce, gas_price, new_gas_price)
+
+        pending_tx.tx = tx
+        pending_tx.versions[new_txid] = new_gas_price
+        pending_tx.last_sent_at = time.time()
+        self.replaced_count += 1
+
+        if self.journal and pending_tx.journal_keys:
+            self.journal.mark_replaced(pending_tx.txid, new_txid, new_gas_price)
+
+        return new_txid
+
+    def resend_out_of_gas(self, pending_tx: PendingTransaction, receipt: dict) -> Optional[str]:
+        """Send a contract call that ran out of gas again with a fresh gas estimate.
+
+        The call is resent only if the node can estimate it and the new gas limit is higher than the one that ran out, otherwise it threw for some other reason.
+
+        :return: Hash of the new transaction or None if we did not resend
+        """
+        gas = pending_tx.tx.get("gas")
+        if not (self.gas_planner and pending_tx.func and gas == receipt["gasUsed"]):
+            return None
+
+        self.gas_planner.invalidate(pending_tx.gas_class)
+        try:
+            gas_limit = self.gas_planner.get_gas_limit(pending_tx.func, pending_tx.tx)
+        except Exception as e:
+            logger.warning("Could not estimate %s again: %s", txid_to_hex(pending_tx.txid), e)
+            return None
+
+        if gas_limit <= gas:
+            return None
+
+        del self.pending[pending_tx.txid]
+        tx_params = {key: value for key, value in pending_tx.tx.items() if key not in ("from", "nonce")}
+        tx_params["gas"] = gas_limit
+        txid = self.transact(pending_tx.func, tx_params, pending_tx.journal_keys, pending_tx.rows)
+        logger.warning("%s ran out of %d gas, sent again as %s with gas limit %d", txid_to_hex(pending_tx.txid), gas, txid_to_hex(txid), gas_limit)
+        return txid
+
+    def _resend_out_of_gas(self, pending_tx: PendingTransaction, receipt: dict, mined_txid):
+        """Deal with a failed transaction in :py:meth:`poll`.
+
+        :raise TransactionFailure: If the transaction could not be resent
+        """
+        if self.resend_out_of_gas(pending_tx, receipt):
+            # Rows are carried by the new transaction, we only pay the gas of this one
+            pending_tx.rows = 0
+            self.account_cost(pending_tx, receipt, mined_txid)
+            return
+
+        # We pay for failed transactions too
+        self.account_cost(pending_tx, receipt, mined_txid)
+        if self.journal and pending_tx.journal_keys:
+            self.journal.mark_mined(mined_txid, receipt, failed=True)
+        raise TransactionFailure("Transaction failed: {}".format(pending_tx.txid))
+
+    def check_receipt(self, pending_tx: PendingTransaction, receipt: dict):
+        """See if the mined transaction went through (Solidity code did not throw).
+
+        :raise TransactionFailure: If the transaction consumed all gas or has failed status
+        """
+
+        # Byzantium receipts carry the status flag
+        if receipt.get("status") == 0:
+            raise TransactionFailure("Transaction failed: {}".format(pending_tx.txid))
+
+        gas = pending_tx.tx.get("gas")
+        if gas is None:
+            gas = self.web3.eth.getTransaction(pending_tx.txid)["gas"]
+
+        # EVM has only one error mode and it's consume all gas
+        if gas == receipt["gasUsed"]:
+            raise TransactionFailure("Transaction failed: {}".format(pending_tx.txid))
+
+    def account_cost(self, pending_tx: PendingTransaction, receipt: dict, mined_txid):
+        """Add a mined transaction to :py:attr:`costs`."""
+        gas_price = pending_tx.versions.get(mined_txid)
+        if gas_price is None:
+            gas_price = self.web3.eth.getTransaction(mined_txid)["gasPrice"]
+        cost = self.costs.add(receipt["gasUsed"], gas_price, pending_tx.rows)
+        logger.debug("Mined %s, gas used %d, cost %d wei", pending_tx.txid, receipt["gasUsed"], cost)
+
+    def poll(self) -> int:
+        """Check receipts of in-flight transactions.
+
+        :return: How many transactions got confirmed
+        """
+        confirmed = 0
+        pending_txs = list(self.pending.values())
+
+        # Poll all versions of all pending transactions
+        versions = [(pending_tx, version_txid) for pending_tx in pending_txs for version_txid in pending_tx.versions]
+        receipts = make_batch_request(self.web3, [("eth_getTransactionReceipt", [txid_to_hex(version_txid)]) for pending_tx, version_txid in versions])
+
+        mined = {}
+        for (pending_tx, version_txid), receipt in zip(versions, receipts):
+            if receipt and receipt.get("blockNumber") is not None:
+                mined[pending_tx.txid] = (version_txid, receipt)
+
+        now = time.time()
+        for pending_tx in pending_txs:
+            txid = pending_tx.txid
+            if txid not in mined:
+                if now - pending_tx.sent_at > self.timeout:
+                    raise RuntimeError("Did not get receipt for {} in {} seconds".format(txid, self.timeout))
+                if self.stuck_timeout is not None and now - pending_tx.last_sent_at > self.stuck_timeout:
+                    self.replace(pending_tx)
+                continue
+
+            mined_txid, receipt = mined[txid]
+
+            try:
+                self.check_receipt(pending_tx, receipt)
+            except TransactionFailure:
+                self._resend_out_of_gas(pending_tx, receipt, mined_txid)
+                continue
+
+            self.account_cost(pending_tx, receipt, mined_txid)
+            if self.journal and pending_tx.journal_keys:
+                self.journal.mark_mined(mined_txid, receipt, failed=False)
+            del self.pending[txid]
+            confirmed += 1
+
+        self.confirmed_count += confirmed
+        return confirmed
+
+    def flush(self):
+        """Wait until all in-flight transactions have been mined."""
+        while self.pending:
+            self.poll()
+            if self.pending:
+                time.sleep(self.poll_interval)
+
+
+class ShardedSender(TransactionSender):
+    """Spread transactions over multiple accounts, each with its own nonce sequence.
+
+    A single account can only have so many transactions in the mempool before the nodes start to drop them. With N accounts we get N independent nonce pipelines.
+
+    Transactions are given to the senders in turns, skipping senders whose window is full.
+    All senders must be allowed to perform the same contract calls, e.g. with :py:meth:`BatchIssuer.setIssuer`.
+    """
+
+    def __init__(self, senders: List[PipelinedSender], poll_interval=1.0):
+        assert senders
+        self.senders = senders
+        self.poll_interval = poll_interval
+        self.next_idx = 0
+
+        #: Grand total of all senders
+        self.costs = CostTracker()
+        for sender in senders:
+            sender.costs = self.costs
+
+    @property
+    def confirmed_count(self) -> int:
+        return sum(sender.confirmed_count for sender in self.senders)
+
+    @property
+    def pending(self) -> OrderedDict:
+        """All in-flight transactions of all senders."""
+        pending = OrderedDict()
+        for sender in self.senders:
+            pending.update(sender.pending)
+        return pending
+
+    def pick_sender(self) -> PipelinedSender:
+        """Get the next sender with room in its window, wait if all are full."""
+        while True:
+            for i in range(len(self.senders)):
+                sender = self.senders[(self.next_idx + i) % len(self.senders)]
+                if len(sender.pending) < sender.max_in_flight:
+                    self.next_idx = (self.next_idx + i + 1) % len(self.senders)
+                    return sender
+
+            if not sum(sender.poll() for sender in self.senders):
+                time.sleep(self.poll_interval)
+
+    def transact(self, func, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a contract function call from the next free sender.
+
+        See :py:meth:`PipelinedSender.transact`.
+        """
+        return self.pick_sender().transact(func, tx_params, journal_keys, rows)
+
+    def send_transaction(self, tx_params: dict, journal_keys: Iterable[str]=(), rows: Optional[int]=None) -> str:
+        """Send a plain transaction from the next free sender."""
+        return self.pick_sender().send_transaction(tx_params, journal_keys, rows)
+
+    def poll(self) -> int:
+        return sum(sender.poll() for sender in self.senders)
+
+    def flush(self):
+        for sender in self.senders:
+            sender.flush()
+
+
+def read_private_keys(fname: str) -> List[str]:
+    """Read a file of hex encoded private keys, one per line.
+
+    Empty lines and lines starting with # are ignored.
+    """
+    with open(fname, "rt") as inp:
+        lines = [line.strip() for line in inp]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def get_key_addresses(private_keys: List[str]) -> List[str]:
+    """Checksummed addresses of private keys."""
+    return [Account.privateKeyToAccount(key).address for key in private_keys]
+
+
+def create_sender(web3: Web3, address: str, sender_addresses: Optional[List[str]]=None, **kwargs):
+    """Create a sender for a bulk command.
+
+    :param address: The main account used when no sender pool is given
+    :param sender_addresses: Pool of accounts to shard transactions over
+    :param kwargs: Passed to :py:class:`PipelinedSender`
+    :return: :py:class:`PipelinedSender` or :py:class:`ShardedSender`
+    """
+    if not sender_addresses:
+        return PipelinedSender(web3, address, **kwargs)
+
+    senders = [PipelinedSender(web3, sender_address, **kwargs) for sender_address in sender_addresses]
+    return ShardedSender(senders, poll_interval=kwargs.get("poll_interval", 1.0))
+
+
+def build_sender(web3: Web3, address: str, sender_addresses: Optional[List[str]]=None, bundle_file: Optional[str]=None, signing_key: Optional[str]=None, chain_id: Optional[int]=None, dry_run=False, **kwargs) -> TransactionSender:
+    """Create the sender for the mode a bulk command runs in.
+
+    * ``dry_run``: :py:class:`ico.dryrun.DryRunSender` simulates the transactions
+
+    * ``bundle_file``: :py:class:`ico.bundle.BundleSigner` signs the transactions with ``signing_key`` for ``chain_id`` to the bundle
+
+    * Otherwise transactions are sent, see :py:func:`create_sender`
+
+    :param kwargs: Passed to :py:func:`create_sender`. ``journal`` is also given to the bundle signer.
+    """
+    # These modules subclass TransactionSender, so they cannot be imported at the top
+    from ico.bundle import BundleSigner
+    from ico.dryrun import DryRunSender
+
+    if dry_run:
+        return DryRunSender(web3, address)
+    if bundle_file:
+        return BundleSigner(web3, signing_key, bundle_file, chain_id=chain_id, journal=kwargs.get("journal"))
+    return create_sender(web3, address, sender_addresses, **kwargs)
+
+
+def grant_sender_pool(contract: Contract, owner: str, sender_addresses: List[str], getter: str, setter: str, tx_params: dict, aggregator: Optional[Contract]=None) -> int:
+    """Give sender pool accounts the right to call a contract.
+
+    Also checks that all pool accounts have ETH to pay for the gas.
+
+    Example::
+
+        grant_sender_pool(issuer, owner, sender_addresses, "issuers", "setIssuer", {"gasPrice": gas_price})
+
+    :param owner: Contract owner account that can grant rights
+    :param getter: Contract function telling if an account has the right
+    :param setter: Owner function that grants the right, taking (address, True) arguments
+    :return: How many accounts were granted the right
+    """
+    web3 = contract.web3
+
+    balances = make_batch_request(web3, [("eth_getBalance", [sender_address, "latest"]) for sender_address in sender_addresses])
+    for sender_address, balance in zip(sender_addresses, balances):
+        if not balance:
+            raise RuntimeError("Sender account {} has no ETH to pay for gas".format(sender_address))
+
+    granted = multicall(web3, [(contract, getter, [sender_address]) for sender_address in sender_addresses], aggregator)
+    txids = []
+    for sender_address, already_granted in zip(sender_addresses, granted):
+        if not already_granted:
+            func = getattr(contract.functions, setter)(sender_address, True)
+            txids.append(func.transact(dict(tx_params, **{"from": owner})))
+
+    check_multiple_succesful_txs(web3, txids)
+    return len(txids)
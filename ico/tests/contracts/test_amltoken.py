@@ -47,3 +47,44 @@ def test_transfer_to_owner_only_owner(aml_token: Contract, team_multisig: str, m
 
     with pytest.raises(TransactionFailed):
         aml_token.functions.transferToOwner(malicious_address).transact({"from": malicious_address})
+
+
+def test_transfer_to_owner_many(aml_token: Contract, team_multisig: str, malicious_address: str, customer: str, empty_address: str):
+    """Owner can reclaim from multiple addresses at once, zero balances are skipped."""
+
+    starting_amount = aml_token.functions.balanceOf(team_multisig).call()
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    aml_token.functions.transfer(malicious_address, 1000000).transact({"from": team_multisig})
+    aml_token.functions.transfer(customer, 2000000).transact({"from": team_multisig})
+
+    aml_token.functions.transferToOwnerMany([malicious_address, empty_address, customer]).transact({"from": team_multisig})
+
+    assert aml_token.functions.balanceOf(malicious_address).call() == 0
+    assert aml_token.functions.balanceOf(customer).call() == 0
+    assert starting_amount == aml_token.functions.balanceOf(team_multisig).call()
+
+    events = aml_token.events.OwnerReclaim().createFilter(fromBlock=0).get_all_entries()
+    assert len(events) == 2
+
+
+def test_transfer_to_owner_many_after_release(aml_token: Contract, team_multisig: str, malicious_address: str):
+    """Bulk reclaim is not possible after releasing."""
+
+    aml_token.functions.setReleaseAgent(team_multisig).transact({"from": team_multisig})
+    aml_token.functions.releaseTokenTransfer().transact({"from": team_multisig})
+
+    aml_token.functions.transfer(malicious_address, 1000000).transact({"from": team_multisig})
+
+    with pytest.raises(TransactionFailed):
+        aml_token.functions.transferToOwnerMany([malicious_address]).transact({"from": team_multisig})
+
+
+def test_transfer_to_owner_many_only_owner(aml_token: Contract, team_multisig: str, malicious_address: str):
+    """Other parties cannot do bulk AML reclaim."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    aml_token.functions.transfer(malicious_address, 1000000).transact({"from": team_multisig})
+
+    with pytest.raises(TransactionFailed):
+        aml_token.functions.transferToOwnerMany([malicious_address]).transact({"from": malicious_address})
@@ -0,0 +1,121 @@
+"""Batch issuer."""
+import pytest
+import datetime
+
+from eth_tester.exceptions import TransactionFailed
+from web3.contract import Contract
+
+
+@pytest.fixture
+def token(chain, team_multisig) -> Contract:
+    """Create the token contract."""
+
+    args = [team_multisig, "Foobar", "FOOB", 1000000, 0, int((datetime.datetime(2017, 4, 22, 16, 0) - datetime.datetime(1970, 1, 1)).total_seconds())]
+
+    tx = {
+        "from": team_multisig
+    }
+
+    contract, hash = chain.provider.deploy_contract('CentrallyIssuedToken', deploy_args=args, deploy_transaction=tx)
+
+    contract.functions.releaseTokenTransfer().transact({"from": team_multisig})
+    return contract
+
+
+@pytest.fixture
+def issue_script_owner(web3,  accounts):
+    """Ethereum account that interacts with issuer contract."""
+    return web3.toChecksumAddress(accounts[8])
+
+
+@pytest.fixture
+def issuer(chain, team_multisig, token, issue_script_owner):
+    args = [issue_script_owner, team_multisig, token.address]
+
+    tx = {
+        "from": team_multisig
+    }
+
+    contract, hash = chain.provider.deploy_contract('BatchIssuer', deploy_args=args, deploy_transaction=tx)
+
+    # Set issuance allowance
+    assert token.functions.balanceOf(team_multisig).call() > 2000
+    token.functions.approve(contract.address, 2000).transact({"from": team_multisig})
+
+    return contract
+
+
+def test_issue_many(web3, issuer, issue_script_owner, customer, customer_2, token, team_multisig):
+    """Issue tokens to multiple addresses in one transaction."""
+
+    team_multisig_begin = token.functions.balanceOf(team_multisig).call()
+    issuer.functions.issueMany([customer, customer_2], [500, 700]).transact({"from": issue_script_owner})
+    assert issuer.functions.issuedCount().call() == 1200
+    assert issuer.functions.issued(customer).call()
+    assert issuer.functions.issued(customer_2).call()
+    assert token.functions.balanceOf(customer).call() == 500
+    assert token.functions.balanceOf(customer_2).call() == 700
+    team_multisig_end = token.functions.balanceOf(team_multisig).call()
+    assert team_multisig_begin - team_multisig_end == 1200
+
+    events = issuer.events.Issued().createFilter(fromBlock=0).get_all_entries()
+    assert len(events) == 2
+    assert events[0]["args"]["benefactor"] == customer
+    assert events[1]["args"]["amount"] == 700
+
+
+def test_issue_many_skips_issued(web3, issuer, issue_script_owner, customer, customer_2, token):
+    """Resending a batch does not issue twice."""
+
+    issuer.functions.issue(customer, 500).transact({"from": issue_script_owner})
+    issuer.functions.issueMany([customer, customer_2], [500, 700]).transact({"from": issue_script_owner})
+    issuer.functions.issueMany([customer, customer_2], [500, 700]).transact({"from": issue_script_owner})
+    assert token.functions.balanceOf(customer).call() == 500
+    assert token.functions.balanceOf(customer_2).call() == 700
+    assert issuer.functions.issuedCount().call() == 1200
+
+
+def test_issue_many_mismatch(web3, issuer, issue_script_owner, customer, customer_2):
+    """Benefactor and amount arrays must be the same length."""
+    with pytest.raises(TransactionFailed):
+        issuer.functions.issueMany([customer, customer_2], [500]).transact({"from": issue_script_owner})
+
+
+def test_issue_many_too_many(web3, issuer, issue_script_owner, customer, customer_2, token):
+    """The whole batch fails if it goes over allowance."""
+    with pytest.raises(TransactionFailed):
+        issuer.functions.issueMany([customer, customer_2], [1500, 1500]).transact({"from": issue_script_owner})
+    assert token.functions.balanceOf(customer).call() == 0
+
+
+def test_issue_twice(web3, issuer, issue_script_owner, customer):
+    """Single issue() still guards against double issuance."""
+    issuer.functions.issue(customer, 500).transact({"from": issue_script_owner})
+    with pytest.raises(TransactionFailed):
+        issuer.functions.issue(customer, 500).transact({"from": issue_script_owner})
+
+
+def test_issue_many_not_an_owner(web3, issuer, customer, customer_2):
+    """Somebody tries to issue for themselves."""
+    with pytest.raises(TransactionFailed):
+        issuer.functions.issueMany([customer, customer_2], [500, 500]).transact({"from": customer})
+
+
+def test_additional_issuer(web3, issuer, issue_script_owner, allowed_party, customer, customer_2, token):
+    """Owner can let other accounts issue."""
+
+    issuer.functions.setIssuer(allowed_party, True).transact({"from": issue_script_owner})
+    assert issuer.functions.issuers(allowed_party).call()
+
+    issuer.functions.issueMany([customer], [500]).transact({"from": allowed_party})
+    assert token.functions.balanceOf(customer).call() == 500
+
+    issuer.functions.setIssuer(allowed_party, False).transact({"from": issue_script_owner})
+    with pytest.raises(TransactionFailed):
+        issuer.functions.issue(customer_2, 500).transact({"from": allowed_party})
+
+
+def test_set_issuer_not_an_owner(web3, issuer, malicious_address):
+    """Only owner can add issuers."""
+    with pytest.raises(TransactionFailed):
+        issuer.functions.setIssuer(malicious_address, True).transact({"from": malicious_address})
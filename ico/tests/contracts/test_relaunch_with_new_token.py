@@ -301,3 +301,56 @@ def test_rebuild_success_crowdsale_with_new_token(chain, new_token, relaunched_c
     assert new_token.functions.totalSupply().call() == int(before_final * 1.20)
 
     assert new_token.functions.released().call()
+
+
+def test_rebuild_many_with_new_token(chain, new_token, relaunched_crowdsale, success_sample_data, team_multisig, customer, customer_2):
+    """Restore multiple investments in one transaction."""
+
+    time_travel(chain, relaunched_crowdsale.functions.startsAt().call() + 1)
+
+    addrs = [data["Address"] for data in success_sample_data]
+    weis = [to_wei(data["Invested ETH"], "ether") for data in success_sample_data]
+    tokens = [int(data["Received tokens"]) for data in success_sample_data]
+    orig_txids = [int(data["Tx hash"], 16) for data in success_sample_data]
+
+    relaunched_crowdsale.functions.setInvestorDataAndIssueNewTokenMany(addrs, weis, tokens, orig_txids).transact({"from": team_multisig})
+
+    for orig_txid in orig_txids:
+        assert relaunched_crowdsale.functions.getRestoredTransactionStatus(orig_txid).call()
+
+    assert relaunched_crowdsale.functions.investorCount().call() == 2
+    assert relaunched_crowdsale.functions.tokensSold().call() == sum(tokens)
+    assert relaunched_crowdsale.functions.weiRaised().call() == sum(weis)
+    assert new_token.functions.balanceOf(customer_2).call() == 1222
+    assert new_token.functions.totalSupply().call() == sum(tokens)
+
+    # Resending the batch does not double issue
+    relaunched_crowdsale.functions.setInvestorDataAndIssueNewTokenMany(addrs, weis, tokens, orig_txids).transact({"from": team_multisig})
+    assert new_token.functions.totalSupply().call() == sum(tokens)
+
+    events = relaunched_crowdsale.events.RestoredInvestment().createFilter(fromBlock=0).get_all_entries()
+    assert len(events) == 3
+
+
+def test_rebuild_many_mismatch(chain, relaunched_crowdsale, sample_data, team_multisig):
+    """Restore data arrays must be the same length."""
+
+    addrs = [data["Address"] for data in sample_data]
+    weis = [to_wei(data["Invested ETH"], "ether") for data in sample_data]
+    tokens = [int(data["Received tokens"]) for data in sample_data]
+    orig_txids = [int(data["Tx hash"], 16) for data in sample_data]
+
+    with pytest.raises(TransactionFailed):
+        relaunched_crowdsale.functions.setInvestorDataAndIssueNewTokenMany(addrs, weis, tokens[:1], orig_txids).transact({"from": team_multisig})
+
+
+def test_rebuild_many_not_owner(chain, relaunched_crowdsale, sample_data, malicious_address):
+    """Only owner can restore investments."""
+
+    addrs = [data["Address"] for data in sample_data]
+    weis = [to_wei(data["Invested ETH"], "ether") for data in sample_data]
+    tokens = [int(data["Received tokens"]) for data in sample_data]
+    orig_txids = [int(data["Tx hash"], 16) for data in sample_data]
+
+    with pytest.raises(TransactionFailed):
+        relaunched_crowdsale.functions.setInvestorDataAndIssueNewTokenMany(addrs, weis, tokens, orig_txids).transact({"from": malicious_address})
@@ -175,6 +175,57 @@ def test_load_vault_twice(loaded_token_vault, team_multisig, token, token_vault_
             loaded_token_vault.functions.setInvestor(address, balance, 0).transact({"from": team_multisig})
 
 
+def test_load_vault_bulk(token_vault, team_multisig, customer, customer_2):
+    """We load multiple investors in one transaction."""
+    token_vault.functions.setInvestors([customer, customer_2], [1000, 2000], [0, 1]).transact({"from": team_multisig})
+    assert token_vault.functions.balances(customer).call() == 1000
+    assert token_vault.functions.balances(customer_2).call() == 2000
+    assert token_vault.functions.tokensPerSecond(customer_2).call() == 1
+    assert token_vault.functions.investorCount().call() == 2
+    assert token_vault.functions.tokensAllocatedTotal().call() == 3000
+
+    events = token_vault.events.Allocated().createFilter(fromBlock=0).get_all_entries()
+    assert len(events) == 2
+
+
+def test_load_vault_bulk_twice(loaded_token_vault, team_multisig, customer, customer_2):
+    """Bulk loading cannot reset investor data either."""
+    with pytest.raises(TransactionFailed):
+        loaded_token_vault.functions.setInvestors([customer], [1000], [0]).transact({"from": team_multisig})
+    assert loaded_token_vault.functions.tokensAllocatedTotal().call() == 3000
+
+
+def test_load_vault_bulk_mismatch(token_vault, team_multisig, customer, customer_2):
+    """Investor data arrays must be the same length."""
+    with pytest.raises(TransactionFailed):
+        token_vault.functions.setInvestors([customer, customer_2], [1000, 2000], [0]).transact({"from": team_multisig})
+
+
+def test_load_vault_bulk_not_owner(token_vault, malicious_address, customer, customer_2):
+    """Unknown party cannot bulk set investors."""
+    with pytest.raises(TransactionFailed):
+        token_vault.functions.setInvestors([customer, customer_2], [1000, 2000], [0, 0]).transact({"from": malicious_address})
+
+
+def test_load_vault_loader(token_vault, team_multisig, allowed_party, customer, customer_2):
+    """Owner can let other accounts load investor data."""
+    token_vault.functions.setLoader(allowed_party, True).transact({"from": team_multisig})
+    assert token_vault.functions.loaders(allowed_party).call()
+
+    token_vault.functions.setInvestors([customer], [1000], [0]).transact({"from": allowed_party})
+    assert token_vault.functions.balances(customer).call() == 1000
+
+    token_vault.functions.setLoader(allowed_party, False).transact({"from": team_multisig})
+    with pytest.raises(TransactionFailed):
+        token_vault.functions.setInvestor(customer_2, 2000, 0).transact({"from": allowed_party})
+
+
+def test_set_loader_not_owner(token_vault, malicious_address):
+    """Unknown party cannot make themselves a loader."""
+    with pytest.raises(TransactionFailed):
+        token_vault.functions.setLoader(malicious_address, True).transact({"from": malicious_address})
+
+
 def test_lock(loaded_token_vault, team_multisig, token, customer, customer_2):
     """We can lock with correct data."""
     assert loaded_token_vault.functions.getState().call() == TokenVaultState.Loading
@@ -254,6 +305,19 @@ def test_load_after_lock(token_vault_single, team_multisig, token, customer, cus
         token_vault.functions.setInvestor(customer_2, 2000, 0).transact({"from": team_multisig})
 
 
+def test_bulk_load_after_lock(token_vault_single, team_multisig, token, customer, customer_2):
+    """After locking, no new invetors can be bulk added."""
+
+    token_vault = token_vault_single
+    token_vault.functions.setInvestors([customer], [1000], [0]).transact({"from": team_multisig})
+
+    token.functions.transfer(token_vault.address, 1000).transact({"from": team_multisig})
+    token_vault.functions.lock().transact({"from": team_multisig})
+
+    with pytest.raises(TransactionFailed):
+        token_vault.functions.setInvestors([customer_2], [2000], [0]).transact({"from": team_multisig})
+
+
 def test_claim(distributing_token_vault, team_multisig, token, customer, customer_2):
     """Tokens can be claimed after freeze time is over."""
 
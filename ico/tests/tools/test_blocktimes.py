@@ -0,0 +1,78 @@
+"""Block timestamp cache."""
+import json
+
+import pytest
+
+from ico.blocktimes import BlockTimestampCache, fetch_block_timestamps, open_timestamp_cache
+
+
+@pytest.fixture
+def cache_file(tmpdir) -> str:
+    return str(tmpdir.join("block-timestamps.sqlite"))
+
+
+def test_cached_across_runs(web3, cache_file, team_multisig, empty_address):
+    """Second run does not ask the node."""
+
+    for i in range(3):
+        web3.eth.sendTransaction({"from": team_multisig, "to": empty_address, "value": 1})
+    blocks = list(range(1, web3.eth.blockNumber + 1))
+
+    cache = open_timestamp_cache(web3, cache_file)
+    assert cache.prefetch(web3, blocks) == len(blocks)
+    assert cache.prefetch(web3, blocks) == 0
+    cache.close()
+
+    cache = open_timestamp_cache(web3, cache_file)
+    assert [cache.get_timestamp(web3, block) for block in blocks] == [web3.eth.getBlock(block)["timestamp"] for block in blocks]
+    assert cache.fetch_count == 0
+
+
+def test_import_json(tmpdir, cache_file):
+    """Old JSON cache with string keys is usable."""
+
+    json_file = str(tmpdir.join("block-timestamps.json"))
+    with open(json_file, "wt") as out:
+        json.dump({1: 1500000000, 2: 1500000015}, out)
+
+    cache = BlockTimestampCache(cache_file, "1")
+    assert cache.import_json(json_file) == 2
+    assert cache.get(2) == 1500000015
+    assert cache.get_many([1, 2, 3]) == {1: 1500000000, 2: 1500000015}
+
+
+def test_wrong_network(cache_file):
+    """Timestamps of one network are not used for another."""
+
+    BlockTimestampCache(cache_file, "1").close()
+    with pytest.raises(RuntimeError):
+        BlockTimestampCache(cache_file, "3")
+
+
+def test_timestamp_events(web3, cache_file, team_multisig, empty_address):
+    """Events get their timestamps in order, each block is fetched once."""
+
+    for i in range(4):
+        web3.eth.sendTransaction({"from": team_multisig, "to": empty_address, "value": 1})
+    blocks = list(range(1, web3.eth.blockNumber + 1))
+    events = [{"blockNumber": block, "idx": idx} for idx, block in enumerate(blocks + blocks[::-1])]
+
+    cache = open_timestamp_cache(web3, cache_file)
+    cache.batch_size = 2
+    result = list(cache.timestamp_events(web3, iter(events), window=3))
+    assert [e["idx"] for e, timestamp in result] == list(range(len(events)))
+    assert [timestamp for e, timestamp in result] == [web3.eth.getBlock(e["blockNumber"])["timestamp"] for e in events]
+    assert cache.fetch_count == len(blocks)
+
+
+def test_fetch_concurrent(web3, team_multisig, empty_address):
+    """Asking for concurrent fetches gives the same result as serial batches.
+
+    The tester provider is not shared between threads, so the batches are fetched one at a time.
+    """
+
+    for i in range(5):
+        web3.eth.sendTransaction({"from": team_multisig, "to": empty_address, "value": 1})
+    blocks = list(range(1, web3.eth.blockNumber + 1))
+
+    assert fetch_block_timestamps(web3, blocks, batch_size=2, max_workers=3) == fetch_block_timestamps(web3, blocks)
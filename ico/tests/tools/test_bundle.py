@@ -0,0 +1,78 @@
+"""Offline signed transaction bundles."""
+import pytest
+
+from ico.bundle import Bundle, BundleSigner, broadcast_bundle, get_chain_id, is_already_sent
+from ico.sender import get_key_addresses
+from ico.utils import confirm_transactions
+
+
+#: Throwaway key for the signer account
+PRIVATE_KEY = "0x" + "11" * 32
+
+#: Tester chain does not support eth_chainId, it takes transactions signed for chain 1
+CHAIN_ID = 1
+
+
+@pytest.fixture
+def signer_address(web3, team_multisig) -> str:
+    """Account of the signing key with some ETH for gas."""
+    address = get_key_addresses([PRIVATE_KEY])[0]
+    web3.eth.sendTransaction({"from": team_multisig, "to": address, "value": 10**18})
+    return address
+
+
+@pytest.fixture
+def bundle_file(tmpdir) -> str:
+    return str(tmpdir.join("test.bundle"))
+
+
+def test_sign_and_broadcast(web3, signer_address, empty_address, bundle_file):
+    """Signed transfers hit the chain only when the bundle is broadcasted."""
+
+    signer = BundleSigner(web3, PRIVATE_KEY, bundle_file, chain_id=CHAIN_ID)
+    txids = [signer.send_transaction({"to": empty_address, "value": 1000, "gas": 50000, "gasPrice": 10**9}) for i in range(3)]
+    signer.flush()
+    assert web3.eth.getBalance(empty_address) == 0
+
+    bundle = Bundle.read(bundle_file)
+    assert bundle.address == signer_address
+    assert bundle.get_txids() == txids
+    assert bundle.end_nonce == bundle.start_nonce + 3
+
+    broadcasted = broadcast_bundle(web3, bundle, batch_size=2)
+    assert broadcasted == txids
+    assert all(not failed for receipt, failed in confirm_transactions(web3, broadcasted))
+    assert web3.eth.getBalance(empty_address) == 3000
+
+    # Rerun skips transactions already in the chain
+    assert broadcast_bundle(web3, bundle) == []
+
+
+def test_torn_bundle(web3, signer_address, empty_address, bundle_file):
+    """Partial last line from an interrupted signer is ignored."""
+
+    signer = BundleSigner(web3, PRIVATE_KEY, bundle_file, chain_id=CHAIN_ID)
+    signer.send_transaction({"to": empty_address, "value": 1000, "gas": 50000, "gasPrice": 10**9})
+    signer.flush()
+
+    with open(bundle_file, "at") as out:
+        out.write("0xf86b")
+
+    assert len(Bundle.read(bundle_file).raw_transactions) == 1
+
+
+def test_chain_id_required(web3, signer_address, bundle_file):
+    """Network id is not used as the chain id, if the node cannot tell the chain id it must be given."""
+
+    assert get_chain_id(web3) is None
+    with pytest.raises(RuntimeError):
+        BundleSigner(web3, PRIVATE_KEY, bundle_file)
+
+
+def test_already_sent_errors():
+    """Rebroadcast errors of the nodes are told apart from real failures."""
+
+    assert is_already_sent(ValueError({"code": -32000, "message": "known transaction: 0x12"}))
+    assert is_already_sent(ValueError({"code": -32000, "message": "already known"}))
+    assert is_already_sent(ValueError({"code": -32000, "message": "nonce too low"}))
+    assert not is_already_sent(ValueError({"code": -32000, "message": "insufficient funds for gas * price + value"}))
@@ -0,0 +1,36 @@
+"""Batched transaction confirmation."""
+from web3.contract import Contract
+
+from ico.utils import check_multiple_succesful_txs, check_succesful_tx, confirm_transactions
+
+
+def test_confirm_in_submission_order(web3, aml_token: Contract, team_multisig, customer, customer_2):
+    """Receipts come back in the same order we gave the transactions."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    txids = [
+        aml_token.functions.transfer(customer, 1000).transact({"from": team_multisig}),
+        aml_token.functions.transfer(customer_2, 2000).transact({"from": team_multisig}),
+        aml_token.functions.transfer(customer, 3000).transact({"from": team_multisig}),
+    ]
+
+    results = confirm_transactions(web3, txids, poll_interval=0)
+    assert [receipt["transactionHash"] for receipt, failed in results] == txids
+    assert not any(failed for receipt, failed in results)
+
+    receipts = check_multiple_succesful_txs(web3, txids)
+    assert [receipt["transactionHash"] for receipt in receipts] == txids
+
+
+def test_confirm_single(web3, team_multisig, empty_address):
+    """Single transaction confirmation goes through the batch confirmer."""
+
+    txid = web3.eth.sendTransaction({"from": team_multisig, "to": empty_address, "value": 1, "gas": 50000})
+    receipt = check_succesful_tx(web3, txid)
+    assert receipt["transactionHash"] == txid
+
+
+def test_confirm_nothing(web3):
+    """Empty batches do not touch the node."""
+    assert check_multiple_succesful_txs(web3, []) == []
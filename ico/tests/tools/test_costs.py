@@ -0,0 +1,38 @@
+"""Receipt based cost accounting."""
+from web3.contract import Contract
+
+from ico.costs import CostTracker
+from ico.sender import PipelinedSender
+
+
+def test_cost_tracker():
+    """Totals and projections."""
+
+    costs = CostTracker()
+    assert costs.estimate_remaining(10) is None
+
+    assert costs.add(50000, 10, rows=5) == 500000
+    costs.add(30000, 10, rows=5)
+    assert costs.total_wei == 800000
+    assert costs.gas_used == 80000
+    assert costs.tx_count == 2
+    assert costs.last_tx_wei == 300000
+    assert costs.get_average_per_row() == 80000
+    assert costs.estimate_remaining(10) == 800000
+    assert "projected" in costs.get_summary(rows_left=10)
+
+
+def test_sender_costs(web3, aml_token: Contract, team_multisig, customer):
+    """Sender sums up costs from the receipts."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    start_balance = web3.eth.getBalance(team_multisig)
+    sender = PipelinedSender(web3, team_multisig, poll_interval=0)
+    sender.transact(aml_token.functions.transfer(customer, 1000), {"gas": 100000, "gasPrice": 2 * 10**9}, rows=3)
+    sender.send_transaction({"to": customer, "value": 0})
+    sender.flush()
+
+    assert sender.costs.tx_count == 2
+    assert sender.costs.row_count == 4
+    assert sender.costs.total_wei == start_balance - web3.eth.getBalance(team_multisig)
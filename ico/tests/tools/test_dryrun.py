@@ -0,0 +1,62 @@
+"""Dry run of bulk commands."""
+import csv
+from io import StringIO
+
+from web3.contract import Contract
+
+from ico.amlreclaim import prepare_csv, reclaim_all
+from ico.dryrun import DryRunSender
+
+
+def test_dry_run_reclaim(web3, aml_token: Contract, team_multisig, customer, customer_2, tmpdir):
+    """Reclaim is simulated without touching the chain."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    aml_token.functions.transfer(customer, 1000000).transact({"from": team_multisig})
+    aml_token.functions.transfer(customer_2, 2000000).transact({"from": team_multisig})
+
+    rows = prepare_csv(StringIO("address,label\n{},customer\n{},customer 2\n".format(customer, customer_2)), "address", "label")
+    sender = DryRunSender(web3, team_multisig)
+    assert reclaim_all(aml_token, rows, {"from": team_multisig}, batch_size=1, sender=sender) == 2
+    assert aml_token.functions.balanceOf(customer).call() == 1000000
+
+    assert len(sender.results) == 2
+    assert not sender.get_failed()
+    assert sender.costs.row_count == 2
+    assert sender.costs.gas_used > 0
+
+    report = str(tmpdir.join("dry-run.csv"))
+    sender.write_report(report)
+    with open(report, "rt") as inp:
+        assert inp.readline().startswith("# ")
+        assert len(list(csv.DictReader(inp))) == 2
+
+
+def test_dry_run_failure(web3, aml_token: Contract, customer, malicious_address):
+    """Transactions that would throw are reported as failed."""
+
+    sender = DryRunSender(web3, malicious_address)
+    sender.transact(aml_token.functions.transferToOwner(customer), {"gas": 100000}, journal_keys=[customer])
+    sender.flush()
+
+    failed = sender.get_failed()
+    assert len(failed) == 1
+    assert failed[0].keys == (customer,)
+    assert sender.costs.row_count == 0
+
+
+def test_dry_run_allowance(web3, aml_token: Contract, team_multisig, customer, customer_2, empty_address):
+    """Rows past a shared limit fail even if each of them would succeed alone."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    sender = DryRunSender(web3, team_multisig)
+    sender.add_limit("allowance", 2500)
+    for addr in (customer, customer_2, empty_address):
+        sender.spend(1000)
+        sender.transact(aml_token.functions.transfer(addr, 1000), {"gas": 100000}, journal_keys=[addr])
+    sender.flush()
+
+    assert [result.keys for result in sender.get_failed()] == [(empty_address,)]
+    assert "allowance" in sender.get_failed()[0].error
+    assert sender.costs.row_count == 2
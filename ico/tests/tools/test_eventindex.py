@@ -0,0 +1,108 @@
+"""Incremental event index."""
+import pytest
+from web3.contract import Contract
+from web3.datastructures import AttributeDict
+
+from ico.eventindex import EventIndex, open_event_index
+from ico.logscan import LogScanner
+
+
+@pytest.fixture
+def index_file(tmpdir) -> str:
+    return str(tmpdir.join("event-index.sqlite"))
+
+
+def make_transfers(aml_token: Contract, team_multisig, customer, values):
+    for value in values:
+        aml_token.functions.transfer(customer, value).transact({"from": team_multisig})
+
+
+def test_incremental(web3, aml_token: Contract, team_multisig, customer, index_file):
+    """Second update only scans the new blocks."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    make_transfers(aml_token, team_multisig, customer, [1000, 1001, 1002])
+
+    index = open_event_index(web3, index_file, reorg_depth=2)
+    assert index.update(aml_token.events.Transfer()) == 3
+    last_block = web3.eth.blockNumber
+    assert index.get_progress(aml_token.address, "Transfer") == (0, last_block)
+    index.close()
+
+    make_transfers(aml_token, team_multisig, customer, [1003, 1004])
+
+    class CountingScanner(LogScanner):
+
+        def scan_chunks(self, events, from_block=0, to_block=None):
+            self.scanned = (from_block, to_block)
+            return super().scan_chunks(events, from_block, to_block)
+
+    index = open_event_index(web3, index_file, reorg_depth=2)
+    scanner = CountingScanner(web3)
+    index.update(aml_token.events.Transfer(), scanner=scanner)
+    assert scanner.scanned == (last_block - 1, web3.eth.blockNumber)
+
+    events = list(index.get_events(aml_token.address, "Transfer"))
+    assert [e["args"]["value"] for e in events] == [1000, 1001, 1002, 1003, 1004]
+
+    # Looks the same as the events from the node
+    node_events = aml_token.events.Transfer().createFilter(fromBlock=0).get_all_entries()
+    assert index.count_events(aml_token.address, "Transfer") == 5
+    assert [dict(e["args"]) for e in events] == [dict(e["args"]) for e in node_events]
+    assert [e["transactionHash"] for e in events] == [e["transactionHash"] for e in node_events]
+
+
+def test_reorg(web3, aml_token: Contract, team_multisig, customer, index_file):
+    """Events of the last reorg_depth blocks are replaced by what the node says now."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    make_transfers(aml_token, team_multisig, customer, [1000, 1001, 1002, 1003])
+
+    index = open_event_index(web3, index_file, reorg_depth=2)
+    index.update(aml_token.events.Transfer())
+
+    class ReorgScanner(LogScanner):
+        """Last block was reorganised away and the transfer before it got a different value."""
+
+        def scan_chunks(self, events, from_block=0, to_block=None):
+            for start, end, decoded in super().scan_chunks(events, from_block, to_block - 1):
+                decoded = [AttributeDict(dict(e, args=AttributeDict(dict(e["args"], value=2002)))) if e["args"]["value"] == 1002 else e for e in decoded]
+                yield start, end, decoded
+            yield to_block, to_block, []
+
+    assert index.update(aml_token.events.Transfer(), scanner=ReorgScanner(web3)) == 1
+    assert [e["args"]["value"] for e in index.get_events(aml_token.address, "Transfer")] == [1000, 1001, 2002]
+
+
+def test_resume(web3, aml_token: Contract, team_multisig, customer, index_file):
+    """Chunks scanned before an interruption are kept."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    make_transfers(aml_token, team_multisig, customer, [1000, 1001, 1002, 1003])
+    last_block = web3.eth.blockNumber
+
+    class CrashingScanner(LogScanner):
+
+        def scan_chunks(self, events, from_block=0, to_block=None):
+            for chunk in super().scan_chunks(events, from_block, to_block):
+                yield chunk
+                if chunk[1] >= last_block - 1:
+                    raise KeyboardInterrupt()
+
+    index = open_event_index(web3, index_file, reorg_depth=1)
+    with pytest.raises(KeyboardInterrupt):
+        index.update(aml_token.events.Transfer(), scanner=CrashingScanner(web3, initial_chunk=1, max_chunk=1))
+    assert index.get_progress(aml_token.address, "Transfer") == (0, last_block - 1)
+    assert index.count_events(aml_token.address, "Transfer") == 3
+
+    scanner = LogScanner(web3)
+    assert index.update(aml_token.events.Transfer(), scanner=scanner) == 2
+    assert [e["args"]["value"] for e in index.get_events(aml_token.address, "Transfer")] == [1000, 1001, 1002, 1003]
+
+
+def test_wrong_network(index_file):
+    """Events of one network are not used for another."""
+
+    EventIndex(index_file, "1").close()
+    with pytest.raises(RuntimeError):
+        EventIndex(index_file, "3")
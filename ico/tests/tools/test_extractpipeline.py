@@ -0,0 +1,37 @@
+"""Streaming extraction pipeline stages."""
+import csv
+
+from ico.extractpipeline import investment_rows, investor_rows, merge_investors, write_csv
+
+
+def make_events(count):
+    """Invested events from two investors, generated lazily."""
+    for i in range(count):
+        yield {
+            "event": "Invested",
+            "address": "0x{:040x}".format(0xc0de),
+            "args": {"investor": "0x{:040x}".format(i % 2), "weiAmount": 10**18, "tokenAmount": 5 * 10**18},
+            "transactionHash": "0x{:064x}".format(i),
+            "transactionIndex": 0,
+        }, 1500000000 + i
+
+
+def test_stream_rows(tmpdir):
+    """Rows are formatted and written as they come."""
+
+    csv_file = str(tmpdir.join("investments.csv"))
+    assert write_csv(csv_file, ["Address", "Payment at", "Tx hash", "Tx index", "Invested ETH", "Received tokens"], investment_rows(make_events(1000), 10**18)) == 1000
+
+    with open(csv_file, "rt") as inp:
+        rows = list(csv.reader(inp))
+    assert len(rows) == 1001
+    assert rows[1] == ["0x" + "0" * 40, "2017-07-14T02:40:00+00:00", "0x" + "0" * 64, "0", "1", "5"]
+
+
+def test_merge_investors():
+    """Investments of one address are merged."""
+
+    address_data = merge_investors(make_events(5))
+    assert len(address_data) == 2
+    rows = list(investor_rows(address_data))
+    assert rows[0] == ["0x" + "0" * 40, "2017-07-14T02:40:00+00:00", "3", str(15 * 10**18)]
@@ -0,0 +1,41 @@
+"""Gas limit planner."""
+import pytest
+from web3.contract import Contract
+
+from ico.gaslimit import GasLimitPlanner, get_gas_class
+
+
+@pytest.fixture
+def planner(web3, team_multisig) -> GasLimitPlanner:
+    return GasLimitPlanner(web3, team_multisig)
+
+
+def test_estimate_once_per_shape(planner, aml_token: Contract, customer, customer_2, empty_address):
+    """Calls with the same argument shape share the estimate."""
+
+    transfer_limit = planner.get_gas_limit(aml_token.functions.transfer(customer, 1000))
+    assert planner.get_gas_limit(aml_token.functions.transfer(customer_2, 2000)) == transfer_limit
+    assert planner.estimate_count == 1
+
+    planner.get_gas_limit(aml_token.functions.transferToOwnerMany([customer]))
+    planner.get_gas_limit(aml_token.functions.transferToOwnerMany([customer, customer_2]))
+    planner.get_gas_limit(aml_token.functions.transferToOwnerMany([customer_2, empty_address]))
+    assert planner.estimate_count == 3
+
+
+def test_invalidate(planner, aml_token: Contract, customer):
+    """Class is estimated again after a failure."""
+
+    func = aml_token.functions.transfer(customer, 1000)
+    planner.get_gas_limit(func)
+    planner.invalidate(get_gas_class(func))
+    planner.get_gas_limit(func)
+    assert planner.estimate_count == 2
+
+
+def test_fallback(web3, aml_token: Contract, customer, malicious_address):
+    """Throwing call gets the fallback limit and is not cached."""
+
+    planner = GasLimitPlanner(web3, malicious_address)
+    assert planner.get_gas_limit(aml_token.functions.transferToOwner(customer), fallback_gas=100000) == 100000
+    assert not planner.cache
@@ -0,0 +1,59 @@
+"""Gas price oracle."""
+import pytest
+
+from ico.gasprice import GasPriceOracle, percentile
+
+
+def test_percentile():
+    """Nearest rank percentile."""
+    values = [1, 2, 3, 4, 5]
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 3
+    assert percentile(values, 100) == 5
+    assert percentile([7], 75) == 7
+
+
+def test_sample_recent_blocks(web3, team_multisig, customer):
+    """Oracle picks up gas prices of mined transactions."""
+
+    for gas_price in (1 * 10**9, 2 * 10**9, 3 * 10**9):
+        web3.eth.sendTransaction({"from": team_multisig, "to": customer, "value": 1, "gasPrice": gas_price})
+
+    oracle = GasPriceOracle(web3, "distribute", block_count=3)
+    assert oracle.get_gas_price() == 2 * 10**9
+
+    oracle = GasPriceOracle(web3, "deploy", block_count=3)
+    assert oracle.get_gas_price() == 3 * 10**9
+
+
+def test_ceiling(web3, team_multisig, customer):
+    """We never pay more than the ceiling."""
+
+    web3.eth.sendTransaction({"from": team_multisig, "to": customer, "value": 1, "gasPrice": 100 * 10**9})
+    oracle = GasPriceOracle(web3, "distribute", block_count=1, max_gas_price=20 * 10**9)
+    assert oracle.get_gas_price() == 20 * 10**9
+
+
+def test_cache(web3, team_multisig, customer):
+    """Suggested price is reused until TTL expires."""
+
+    web3.eth.sendTransaction({"from": team_multisig, "to": customer, "value": 1, "gasPrice": 5 * 10**9})
+    oracle = GasPriceOracle(web3, "distribute", block_count=1, ttl=3600)
+    assert oracle.get_gas_price() == 5 * 10**9
+
+    web3.eth.sendTransaction({"from": team_multisig, "to": customer, "value": 1, "gasPrice": 7 * 10**9})
+    assert oracle.get_gas_price() == 5 * 10**9
+
+    oracle.ttl = 0
+    assert oracle.get_gas_price() == 7 * 10**9
+
+
+def test_override(web3):
+    """User given gas price is used as is."""
+    oracle = GasPriceOracle(web3, "refund", override=123)
+    assert oracle.get_gas_price() == 123
+
+
+def test_unknown_strategy(web3):
+    with pytest.raises(ValueError):
+        GasPriceOracle(web3, "yolo")
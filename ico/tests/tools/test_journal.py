@@ -0,0 +1,90 @@
+"""Bulk command journal."""
+import pytest
+from web3.contract import Contract
+
+from ico.journal import Journal, PLANNED, SENT, CONFIRMED
+from ico.sender import PipelinedSender
+
+
+@pytest.fixture
+def journal_file(tmpdir) -> str:
+    return str(tmpdir.join("journal.sqlite"))
+
+
+def test_journal_states(journal_file):
+    """Rows move from planned to sent to confirmed and survive reopening."""
+
+    journal = Journal(journal_file, context="test")
+    journal.plan([("a", 1000), ("b", 2000)])
+    assert journal.get_status("a") == PLANNED
+    assert journal.get_status("c") is None
+
+    journal.mark_sent(["a", "b"], "0x01", nonce=5)
+    assert journal.get_in_flight() == {"0x01": ["a", "b"]}
+
+    journal.mark_mined("0x01", {"blockNumber": 10, "gasUsed": 50000}, failed=False)
+    journal.close()
+
+    journal = Journal(journal_file, context="test")
+    assert journal.get_confirmed_keys() == {"a", "b"}
+    assert journal.get_counts() == {CONFIRMED: 2}
+    assert not journal.get_in_flight()
+
+    # Planning again does not reset the state
+    journal.plan([("a", 1000)])
+    assert journal.get_status("a") == CONFIRMED
+
+
+def test_journal_replaced(journal_file):
+    """Rows follow the version of a replaced transaction that got mined."""
+
+    journal = Journal(journal_file, context="test")
+    journal.plan([("a", 1000)])
+    journal.mark_sent(["a"], "0x01", nonce=5, gas_price=100)
+    journal.mark_replaced("0x01", "0x02", 120)
+    journal.mark_replaced("0x01", "0x03", 144)
+    assert journal.get_versions("0x01") == ["0x01", "0x02", "0x03"]
+
+    journal.mark_mined("0x02", {"blockNumber": 10, "gasUsed": 50000}, failed=False)
+    assert journal.get_status("a") == CONFIRMED
+    assert journal.conn.execute("SELECT txid, gas_price FROM rows WHERE key='a'").fetchone() == ("0x02", "120")
+
+
+def test_journal_wrong_context(journal_file):
+    """Journal of one distribution cannot be used for another."""
+
+    Journal(journal_file, context="distribute-tokens:0x1").close()
+    with pytest.raises(RuntimeError):
+        Journal(journal_file, context="distribute-tokens:0x2")
+
+
+def test_sender_journal(web3, aml_token: Contract, team_multisig, customer, customer_2, journal_file):
+    """Sender records mined transactions to the journal."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    journal = Journal(journal_file, context="test")
+    journal.plan([(customer, 1000), (customer_2, 2000)])
+
+    sender = PipelinedSender(web3, team_multisig, poll_interval=0, journal=journal)
+    sender.transact(aml_token.functions.transfer(customer, 1000), {"gas": 100000}, journal_keys=[customer])
+    sender.transact(aml_token.functions.transfer(customer_2, 2000), {"gas": 100000}, journal_keys=[customer_2])
+    sender.flush()
+
+    assert journal.get_confirmed_keys() == {customer, customer_2}
+
+
+def test_recover(web3, team_multisig, empty_address, journal_file):
+    """Restart resolves mined transactions and releases dropped ones."""
+
+    journal = Journal(journal_file, context="test")
+    journal.plan([("mined", 1), ("dropped", 1)])
+
+    txid = web3.eth.sendTransaction({"from": team_multisig, "to": empty_address, "value": 1, "gas": 50000})
+    journal.mark_sent(["mined"], txid, nonce=0)
+    journal.mark_sent(["dropped"], "0x" + "00" * 32, nonce=1)
+    assert journal.get_status("dropped") == SENT
+
+    assert journal.recover(web3) == (1, 0, 1)
+    assert journal.get_status("mined") == CONFIRMED
+    assert journal.get_status("dropped") == PLANNED
@@ -0,0 +1,63 @@
+"""Chunked event log scanning."""
+import pytest
+from web3.contract import Contract
+
+from ico.logscan import LogScanner, scan_events
+
+
+@pytest.fixture
+def transfers(web3, aml_token: Contract, team_multisig, customer, customer_2) -> int:
+    """Make some Transfer events, one per block."""
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    start_block = web3.eth.blockNumber
+    for i in range(5):
+        aml_token.functions.transfer(customer if i % 2 else customer_2, 1000 + i).transact({"from": team_multisig})
+    return start_block
+
+
+def test_scan_chunks(web3, aml_token: Contract, transfers):
+    """Small chunks give the same events as one big query."""
+
+    all_events = aml_token.events.Transfer().createFilter(fromBlock=0).get_all_entries()
+
+    scanner = LogScanner(web3, initial_chunk=1, max_chunk=2)
+    events = list(scanner.scan(aml_token.events.Transfer()))
+    assert [e["args"]["value"] for e in events] == [e["args"]["value"] for e in all_events]
+    assert scanner.request_count > 1
+
+    # Start from a known block
+    events = list(scan_events(aml_token.events.Transfer(), from_block=transfers + 1))
+    assert [e["args"]["value"] for e in events] == [1000, 1001, 1002, 1003, 1004]
+
+
+def test_shrink_on_error(web3, aml_token: Contract, transfers):
+    """Range is split when the node refuses it."""
+
+    class FlakyScanner(LogScanner):
+
+        def get_logs(self, address, topics, start, end):
+            if end - start >= 2:
+                raise ValueError("query returned more than 10000 results")
+            return super().get_logs(address, topics, start, end)
+
+    scanner = FlakyScanner(web3, initial_chunk=100)
+    events = list(scanner.scan(aml_token.events.Transfer(), from_block=transfers + 1))
+    assert len(events) == 5
+    assert scanner.chunk <= 4
+
+
+def test_scan_many(web3, chain, aml_token: Contract, transfers, team_multisig, customer, token_name, token_symbol, initial_supply):
+    """Events of two contracts come from one sweep."""
+
+    other_token, _ = chain.provider.deploy_contract('AMLToken', deploy_args=[token_name, token_symbol, initial_supply, 0, True], deploy_transaction={"from": team_multisig})
+    other_token.functions.approve(customer, 2000).transact({"from": team_multisig})
+    other_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    other_token.functions.transfer(customer, 3000).transact({"from": team_multisig})
+
+    scanner = LogScanner(web3, initial_chunk=1000)
+    events = list(scanner.scan_many([aml_token.events.Transfer(), other_token.events.Approval()], from_block=transfers + 1))
+    assert scanner.request_count == 1
+
+    # Transfer of the other token is not asked for
+    assert [(e["address"], e["event"]) for e in events] == [(aml_token.address, "Transfer")] * 5 + [(other_token.address, "Approval")]
+    assert events[-1]["args"]["value"] == 2000
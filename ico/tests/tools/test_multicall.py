@@ -0,0 +1,51 @@
+"""Aggregated contract reads."""
+import pytest
+from web3.contract import Contract
+
+from ico.utils import multicall
+
+
+@pytest.fixture
+def read_aggregator(chain) -> Contract:
+    """Stateless ReadAggregator contract."""
+    contract, hash = chain.provider.deploy_contract('ReadAggregator')
+    return contract
+
+
+@pytest.fixture
+def token_holders(aml_token: Contract, team_multisig, customer, customer_2):
+    """Give some tokens to customers."""
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+    aml_token.functions.transfer(customer, 1000).transact({"from": team_multisig})
+    aml_token.functions.transfer(customer_2, 2000).transact({"from": team_multisig})
+
+
+def test_multicall_aggregator(web3, token_holders, read_aggregator: Contract, aml_token: Contract, customer, customer_2, empty_address):
+    """ReadAggregator returns the same values as individual calls."""
+
+    calls = [
+        (aml_token, "balanceOf", [customer]),
+        (aml_token, "balanceOf", [customer_2]),
+        (aml_token, "balanceOf", [empty_address]),
+        (aml_token, "released", []),
+        (aml_token, "owner", []),
+    ]
+
+    expected = [getattr(contract.functions, fn_name)(*args).call() for contract, fn_name, args in calls]
+    assert expected[0:3] == [1000, 2000, 0]
+    assert multicall(web3, calls, read_aggregator) == expected
+    assert multicall(web3, calls) == expected
+
+
+def test_multicall_chunks(web3, token_holders, read_aggregator: Contract, aml_token: Contract, customer, customer_2):
+    """Calls are split over several aggregate() calls."""
+
+    calls = [(aml_token, "balanceOf", [customer]), (aml_token, "balanceOf", [customer_2])] * 5
+    assert multicall(web3, calls, read_aggregator, chunk_size=3) == [1000, 2000] * 5
+
+
+def test_multicall_dynamic_output(web3, read_aggregator: Contract, aml_token: Contract):
+    """Functions returning dynamic data cannot go through the aggregator."""
+
+    with pytest.raises(ValueError):
+        multicall(web3, [(aml_token, "name", [])], read_aggregator)
@@ -4,13 +4,19 @@ from io import StringIO
 import pytest
 from web3.contract import Contract
 
-from ico.amlreclaim import prepare_csv, count_tokens_to_reclaim, reclaim_all
+from ico.amlreclaim import prepare_csv, count_tokens_to_reclaim, reclaim_all, get_balances
 
 
 CSV_SOURCE = """address,label
 {}, customer
 """
 
+CSV_SOURCE_MULTIPLE = """address,label
+{}, customer
+{}, customer 2
+{}, empty
+"""
+
 
 @pytest.fixture
 def aml_reclaim_setup(aml_token: Contract, team_multisig: str, customer: str, customer_2):
@@ -63,3 +69,19 @@ def test_reclaim_twice(csv_stream, customer, aml_token: Contract, team_multisig)
     performed_op_count = reclaim_all(aml_token, rows, {"from": team_multisig})
     assert performed_op_count == 0
 
+
+def test_reclaim_with_snapshot(aml_reclaim_setup, customer, customer_2, empty_address, aml_token: Contract, team_multisig):
+    """One balance snapshot is used for both counting and reclaiming."""
+
+    stream = StringIO(CSV_SOURCE_MULTIPLE.format(customer, customer_2, empty_address))
+    rows = prepare_csv(stream, "address", "label")
+    balances = get_balances(aml_token, rows)
+    assert balances == [1000000, 2000000, 0]
+    assert count_tokens_to_reclaim(aml_token, rows, balances) == 3000000
+
+    start_owner_balance = aml_token.functions.balanceOf(team_multisig).call()
+    performed_op_count = reclaim_all(aml_token, rows, {"from": team_multisig}, balances=balances, batch_size=1)
+    assert performed_op_count == 2
+    assert aml_token.functions.balanceOf(customer).call() == 0
+    assert aml_token.functions.balanceOf(customer_2).call() == 0
+    assert aml_token.functions.balanceOf(team_multisig).call() == start_owner_balance + 3000000
@@ -0,0 +1,136 @@
+"""Refund state log."""
+import json
+
+import pytest
+
+from ico.refundstate import RefundStateLog, SENDING, UNSENT, SENT, CONFIRMED, FAILED
+from ico.sender import PipelinedSender
+
+
+@pytest.fixture
+def log_file(tmpdir) -> str:
+    return str(tmpdir.join("refund-state.jsonl"))
+
+
+def test_record_and_reload(log_file):
+    """State survives reopening the log."""
+
+    log = RefundStateLog(log_file)
+    log.record("a@example.com", address="0x1", amount_wei=100, txid="0xaa", status=SENT)
+    log.record("a@example.com", status=CONFIRMED)
+    log.record("b@example.com", address="0x2", amount_wei=200, txid="0xbb", status=SENT)
+    log.record("b@example.com", status=FAILED)
+    log.close()
+
+    log = RefundStateLog(log_file)
+    assert log.get("a@example.com") == {"id": "a@example.com", "address": "0x1", "amount_wei": 100, "txid": "0xaa", "status": CONFIRMED}
+    assert log.is_refunded("a@example.com")
+    assert not log.is_refunded("b@example.com")
+    assert not log.is_refunded("c@example.com")
+
+
+def test_replaced(log_file):
+    """Any version of a replaced refund can be mined."""
+
+    log = RefundStateLog(log_file)
+    log.mark_sent(["a@example.com"], "0xaa", nonce=1, gas_price=100)
+    log.mark_replaced("0xaa", "0xbb", 120)
+    log.close()
+
+    log = RefundStateLog(log_file)
+    assert log.get("a@example.com")["replaced_txids"] == ["0xaa"]
+    log.mark_mined("0xaa", {"blockNumber": 1, "gasUsed": 21000}, failed=False)
+    assert log.get("a@example.com")["txid"] == "0xaa"
+    assert log.get("a@example.com")["status"] == CONFIRMED
+
+
+def test_torn_write(log_file):
+    """Partial last line from a crash is discarded."""
+
+    log = RefundStateLog(log_file)
+    log.record("a@example.com", txid="0xaa", status=SENT)
+    log.close()
+
+    with open(log_file, "at") as out:
+        out.write('{"id": "b@exa')
+
+    log = RefundStateLog(log_file)
+    assert log.is_refunded("a@example.com")
+    assert not log.is_refunded("b@example.com")
+
+    # We can continue appending after the torn line
+    log.record("b@example.com", txid="0xbb", status=SENT)
+    log.close()
+
+    log = RefundStateLog(log_file)
+    assert log.is_refunded("b@example.com")
+
+
+def test_compact(log_file):
+    """Compaction leaves one line per refund."""
+
+    log = RefundStateLog(log_file)
+    for i in range(3):
+        log.record(str(i), txid="0x0{}".format(i), status=SENT)
+        log.record(str(i), status=CONFIRMED)
+    assert log.needs_compaction(ratio=1)
+
+    log.compact()
+    log.record("3", txid="0x03", status=SENT)
+    log.close()
+
+    with open(log_file, "rt") as inp:
+        assert len(inp.readlines()) == 4
+
+    log = RefundStateLog(log_file)
+    assert log.get("0")["status"] == CONFIRMED
+    assert log.get("3")["status"] == SENT
+
+
+def test_migrate_json(tmpdir, log_file):
+    """Old style JSON state is imported."""
+
+    json_file = str(tmpdir.join("refund-state.json"))
+    with open(json_file, "wt") as out:
+        json.dump({"a@example.com": "0xaa", "b@example.com": "0xbb"}, out)
+
+    log = RefundStateLog(log_file)
+    assert log.migrate_json(json_file) == 2
+    log.close()
+
+    log = RefundStateLog(log_file)
+    assert log.is_refunded("a@example.com")
+    assert log.get("b@example.com")["txid"] == "0xbb"
+
+
+def test_pipelined_refunds(web3, log_file, team_multisig, customer, customer_2):
+    """Sender records refund outcomes to the log."""
+
+    log = RefundStateLog(log_file)
+    sender = PipelinedSender(web3, team_multisig, max_in_flight=1, poll_interval=0, journal=log)
+    for id, addr in (("a@example.com", customer), ("b@example.com", customer_2)):
+        log.record(id, address=addr, amount_wei=1000, nonce=sender.nonce, status=SENDING)
+        sender.send_transaction({"to": addr, "value": 1000, "gas": 100000}, journal_keys=[id])
+    sender.flush()
+    log.close()
+
+    log = RefundStateLog(log_file)
+    assert log.get("a@example.com")["status"] == CONFIRMED
+    assert log.get("b@example.com")["status"] == CONFIRMED
+    assert log.get("b@example.com")["nonce"] == log.get("a@example.com")["nonce"] + 1
+
+
+def test_recover(web3, log_file, team_multisig, customer):
+    """Restart tells apart broadcasted and never sent refunds."""
+
+    nonce = web3.eth.getTransactionCount(team_multisig, "pending")
+
+    log = RefundStateLog(log_file)
+    txid = web3.eth.sendTransaction({"from": team_multisig, "to": customer, "value": 1000, "gas": 100000})
+    log.record("sent@example.com", nonce=nonce, txid="0x" + bytes(txid).hex(), status=SENT)
+    log.record("crashed@example.com", nonce=nonce + 1, status=SENDING)
+
+    assert log.recover(web3, team_multisig) == (1, 0, 1, 0)
+    assert log.get("sent@example.com")["status"] == CONFIRMED
+    assert log.get("crashed@example.com")["status"] == UNSENT
+    assert not log.is_refunded("crashed@example.com")
@@ -0,0 +1,136 @@
+"""Pipelined transaction sender."""
+import pytest
+from eth_tester.exceptions import TransactionFailed
+from web3.contract import Contract
+
+from ico.gaslimit import GasLimitPlanner, get_gas_class
+from ico.sender import PendingTransaction, PipelinedSender, ShardedSender, create_sender, get_key_addresses
+
+
+def test_send_more_than_window(web3, aml_token: Contract, team_multisig, customer, customer_2):
+    """We can send more transactions than fits in the in-flight window."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    sender = PipelinedSender(web3, team_multisig, max_in_flight=2, poll_interval=0)
+    start_nonce = sender.nonce
+    for i in range(5):
+        sender.transact(aml_token.functions.transfer(customer, 1000), {"gas": 100000})
+    sender.transact(aml_token.functions.transfer(customer_2, 1000), {"gas": 100000})
+    sender.flush()
+
+    assert sender.nonce == start_nonce + 6
+    assert sender.confirmed_count == 6
+    assert not sender.pending
+    assert aml_token.functions.balanceOf(customer).call() == 5000
+    assert aml_token.functions.balanceOf(customer_2).call() == 1000
+
+
+def test_send_value(web3, team_multisig, empty_address):
+    """Plain ETH transfers go through the same pipeline."""
+
+    sender = PipelinedSender(web3, team_multisig, poll_interval=0)
+    sender.send_transaction({"to": empty_address, "value": 1000})
+    sender.send_transaction({"to": empty_address, "value": 1000})
+    sender.flush()
+    assert web3.eth.getBalance(empty_address) == 2000
+
+
+def test_nonce_resync_after_failure(web3, aml_token: Contract, team_multisig, customer, malicious_address):
+    """A rejected transaction does not leave a gap in our local nonces."""
+
+    sender = PipelinedSender(web3, malicious_address, poll_interval=0)
+    start_nonce = sender.nonce
+
+    with pytest.raises(TransactionFailed):
+        sender.transact(aml_token.functions.transferToOwner(customer), {"gas": 100000})
+
+    assert sender.nonce == start_nonce
+    sender.send_transaction({"to": customer, "value": 1})
+    sender.flush()
+    assert sender.nonce == start_nonce + 1
+
+
+def test_replace_stuck(web3, team_multisig, empty_address, tmpdir):
+    """Stuck transaction is rebroadcasted with the same nonce and bumped gas price, up to the ceiling."""
+
+    broadcasted = []
+
+    def send(tx):
+        broadcasted.append(tx)
+        return "0x{:064x}".format(len(broadcasted))
+
+    sender = PipelinedSender(web3, team_multisig, poll_interval=0, stuck_timeout=0, max_gas_price=140)
+    tx = {"from": team_multisig, "to": empty_address, "value": 1, "nonce": 7, "gasPrice": 100}
+    pending_tx = PendingTransaction("0x" + "00" * 32, 7, tx, 0, send=send)
+
+    assert sender.replace(pending_tx) == "0x{:064x}".format(1)
+    assert broadcasted[0]["nonce"] == 7
+    assert broadcasted[0]["gasPrice"] == 120
+
+    # Bump capped to the ceiling
+    sender.replace(pending_tx)
+    assert broadcasted[1]["gasPrice"] == 140
+
+    # Already at the ceiling, nothing to do
+    assert sender.replace(pending_tx) is None
+    assert list(pending_tx.versions.values()) == [100, 120, 140]
+    assert sender.replaced_count == 2
+
+
+def test_resend_out_of_gas(web3, aml_token: Contract, team_multisig, customer):
+    """A contract call that ran out of its cached gas limit is estimated again and resent."""
+
+    aml_token.functions.setTransferAgent(team_multisig, True).transact({"from": team_multisig})
+
+    planner = GasLimitPlanner(web3, team_multisig)
+    sender = PipelinedSender(web3, team_multisig, poll_interval=0, gas_planner=planner)
+
+    # Pretend a transfer with a too low cached gas limit got mined out of gas
+    func = aml_token.functions.transfer(customer, 1000)
+    planner.cache[get_gas_class(func)] = 25000
+    pending_tx = PendingTransaction("0x" + "00" * 32, 0, {"from": team_multisig, "nonce": 0, "gas": 25000}, 0, rows=3, send=func.transact)
+    pending_tx.func = func
+    pending_tx.gas_class = get_gas_class(func)
+    sender.pending[pending_tx.txid] = pending_tx
+
+    txid = sender.resend_out_of_gas(pending_tx, {"gasUsed": 25000})
+    assert txid
+    assert pending_tx.txid not in sender.pending
+    assert sender.pending[txid].rows == 3
+    assert sender.pending[txid].tx["gas"] > 25000
+    assert planner.cache[get_gas_class(func)] > 25000
+    sender.flush()
+    assert aml_token.functions.balanceOf(customer).call() == 1000
+
+    # A call that throws is not resent
+    func = aml_token.functions.transfer(customer, 10**40)
+    pending_tx = PendingTransaction("0x" + "00" * 32, 0, {"from": team_multisig, "nonce": 0, "gas": 25000}, 0, send=func.transact)
+    pending_tx.func = func
+    pending_tx.gas_class = get_gas_class(func)
+    assert sender.resend_out_of_gas(pending_tx, {"gasUsed": 25000}) is None
+
+    # Neither is a call that did not use all of its gas
+    assert sender.resend_out_of_gas(pending_tx, {"gasUsed": 24000}) is None
+
+
+def test_sharded_sender(web3, team_multisig, customer, empty_address):
+    """Transactions are spread over multiple accounts."""
+
+    start_nonces = [web3.eth.getTransactionCount(addr) for addr in (team_multisig, customer)]
+
+    sender = create_sender(web3, team_multisig, [team_multisig, customer], max_in_flight=1, poll_interval=0)
+    assert isinstance(sender, ShardedSender)
+    for i in range(4):
+        sender.send_transaction({"to": empty_address, "value": 1000, "gas": 50000}, rows=2)
+    sender.flush()
+
+    assert web3.eth.getBalance(empty_address) == 4000
+    assert [web3.eth.getTransactionCount(addr) for addr in (team_multisig, customer)] == [nonce + 2 for nonce in start_nonces]
+    assert sender.confirmed_count == 4
+    assert sender.costs.row_count == 8
+
+
+def test_key_addresses():
+    """Private keys map to checksummed addresses."""
+    assert get_key_addresses(["0x" + "11" * 32]) == ["0x19E7E376E7C213B7E7e7e46cc70A5dD086DAff2A"]
@@ -0,0 +1,88 @@
+"""Token vault inspect and vesting math."""
+import csv
+import io
+import time
+
+import pytest
+from web3.contract import Contract
+
+from ico.cmd.tokenvault import inspect
+from ico.vaultmodel import VaultInvestor, VaultSnapshot, get_currently_claimable, get_final_claim_at
+
+
+@pytest.fixture
+def token_vault(chain, aml_token: Contract, team_multisig, customer, customer_2) -> Contract:
+    """Vault with two tapped investors."""
+    args = [
+        team_multisig,
+        int(time.time()) + 3600,
+        aml_token.address,
+        3000,
+    ]
+    contract, hash = chain.provider.deploy_contract('TokenVault', deploy_args=args)
+    contract.functions.setInvestor(customer, 1000, 1).transact({"from": team_multisig})
+    contract.functions.setInvestor(customer_2, 2000, 0).transact({"from": team_multisig})
+    return contract
+
+
+def test_inspect(web3, chain, token_vault: Contract, customer, customer_2):
+    """All investors are written, an earlier snapshot does not see later investors."""
+
+    out = io.StringIO()
+    inspect(chain, token_vault.address, 0, chunk_size=1, out=out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row["address"] for row in rows] == [customer, customer_2]
+    assert [float(row["amount"]) for row in rows] == [1000, 2000]
+    assert [float(row["currently claimable"]) for row in rows] == [0, 0]
+
+    out = io.StringIO()
+    inspect(chain, token_vault.address, 0, at_block=web3.eth.blockNumber - 1, out=out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row["address"] for row in rows] == [customer]
+
+
+def test_vesting_math():
+    """Claimable amount follows TokenVault.getCurrentlyClaimableAmount()."""
+
+    freeze_ends_at = 1000
+    assert get_currently_claimable(600, 0, freeze_ends_at, 0, 3, 999) == 0
+    assert get_currently_claimable(600, 0, freeze_ends_at, 0, 3, 1010) == 30
+    assert get_currently_claimable(600, 30, freeze_ends_at, 1010, 3, 1020) == 30
+    assert get_currently_claimable(600, 30, freeze_ends_at, 1010, 3, 9999) == 570
+
+    # No tap, everything at once
+    assert get_currently_claimable(600, 0, freeze_ends_at, 0, 0, 1000) == 600
+
+    assert get_final_claim_at(600, freeze_ends_at, 3) == 1200
+    assert get_final_claim_at(601, freeze_ends_at, 3) == 1201
+    assert get_final_claim_at(10**27 + 1, freeze_ends_at, 10**18) == freeze_ends_at + 10**9 + 1
+    assert get_final_claim_at(600, freeze_ends_at, 0) == 1000
+
+
+def test_snapshot(web3, token_vault: Contract, customer, customer_2, tmpdir):
+    """Snapshot survives a save and load."""
+
+    snapshot = VaultSnapshot.read(web3, token_vault, decimals=0)
+    path = str(tmpdir.join("vault.json"))
+    snapshot.save(path)
+
+    snapshot = VaultSnapshot.load(path)
+    assert snapshot.investors == [VaultInvestor(customer, 1000, 0, 0, 1), VaultInvestor(customer_2, 2000, 0, 0, 0)]
+    assert snapshot.get_claimable(snapshot.freeze_ends_at + 10) == {customer: 10, customer_2: 2000}
+
+
+def test_unlock_curve():
+    """Sweep gives the same curve as summing every investor at every point."""
+
+    freeze_ends_at = 1000
+    investors = [VaultInvestor("0x{:040x}".format(i), 1000 + i * 37, 0, 0, i % 7) for i in range(50)]
+    snapshot = VaultSnapshot("0x" + "0" * 40, 1, 900, freeze_ends_at, 0, investors)
+
+    def unlocked(now):
+        if now < freeze_ends_at:
+            return 0
+        return sum(min(i.balance, (now - freeze_ends_at) * i.tokens_per_second) if i.tokens_per_second else i.balance for i in investors)
+
+    curve = list(snapshot.get_unlock_curve(900, snapshot.get_last_unlock_at(), 25))
+    assert [total for timestamp, delta, total in curve] == [unlocked(timestamp) for timestamp, delta, total in curve]
+    assert sum(delta for timestamp, delta, total in curve) == sum(i.balance for i in investors)
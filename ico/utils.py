@@ -1,16 +1,23 @@
-from typing import Optional
+from typing import Iterable, Optional, List, Tuple
 
 from decimal import Decimal
 
+import json
 import time
+from itertools import islice
 import web3
 from eth_utils import is_hex_address, is_checksum_address, add_0x_prefix
+from hexbytes import HexBytes
 from populus.utils.contracts import CONTRACT_FACTORY_FIELDS
 from web3 import Web3
 from web3.contract import Contract
-from web3.utils.abi import get_constructor_abi, merge_args_and_kwargs
+from web3.middleware.pythonic import block_formatter, receipt_formatter, transaction_formatter, to_integer_if_hex
+from web3.providers.rpc import HTTPProvider
+from eth_abi import decode_abi
+from web3.utils.abi import get_constructor_abi, merge_args_and_kwargs, get_abi_output_types, map_abi_data
+from web3.utils.normalizers import BASE_RETURN_NORMALIZERS
 from web3.utils.contracts import encode_abi
-from web3.utils.transactions import wait_for_transaction_receipt
+from web3.utils.request import make_post_request
 
 from populus.chain.base import BaseChain
 from populus.contracts.contract import build_populus_meta, PopulusContract
@@ -43,6 +50,248 @@ def asbool(s):
     return s.lower() in truthy
 
 
+#: Turn raw JSON-RPC results from a batch to the same Python values Web3 gives us
+BATCH_RESULT_FORMATTERS = {
+    "eth_blockNumber": to_integer_if_hex,
+    "eth_call": HexBytes,
+    "eth_estimateGas": to_integer_if_hex,
+    "eth_gasPrice": to_integer_if_hex,
+    "eth_getBalance": to_integer_if_hex,
+    "eth_getBlockByNumber": block_formatter,
+    "eth_getTransactionByHash": transaction_formatter,
+    "eth_getTransactionCount": to_integer_if_hex,
+    "eth_getTransactionReceipt": receipt_formatter,
+    "eth_sendRawTransaction": HexBytes,
+}
+
+
+def txid_to_hex(txid) -> str:
+    """Transaction hashes come as HexBytes from Web3 and as strings from CSV/JSON files."""
+    if isinstance(txid, str):
+        return txid
+    return Web3.toHex(txid)
+
+
+def _make_serial_requests(web3: Web3, calls: List[Tuple[str, list]], return_errors: bool) -> list:
+    """Fallback of :py:func:`make_batch_request` for providers that do not do batches."""
+    if not return_errors:
+        return [web3.manager.request_blocking(method, params) for method, params in calls]
+
+    results = []
+    for method, params in calls:
+        try:
+            results.append(web3.manager.request_blocking(method, params))
+        except Exception as e:
+            # Tester chain raises its own exception types for reverts
+            results.append(ValueError(str(e)))
+    return results
+
+
+def make_batch_request(web3: Web3, calls: List[Tuple[str, list]], return_errors=False) -> list:
+    """Perform multiple JSON-RPC calls in a single round trip.
+
+    With a HTTP provider all calls are posted as one JSON-RPC batch.
+    Other providers (tester chain, IPC) do not support batches and we fall back to one request per call.
+
+    :param calls: List of (method, params) tuples. Params must be in JSON-RPC wire format, e.g. hex strings for hashes and block numbers.
+    :param return_errors: Give a failed call a :py:class:`ValueError` instance as its result instead of raising it
+    :return: Results in the same order as the calls
+    :raise ValueError: If any of the calls returned an error
+    """
+
+    if not calls:
+        return []
+
+    provider = web3.providers[0]
+    if not isinstance(provider, HTTPProvider):
+        return _make_serial_requests(web3, calls, return_errors)
+
+    payload = [
+        {"jsonrpc": "2.0", "method": method, "params": params, "id": idx}
+        for idx, (method, params) in enumerate(calls)
+    ]
+    raw_response = make_post_request(provider.endpoint_uri, json.dumps(payload).encode("utf-8"), **provider.get_request_kwargs())
+    responses = json.loads(raw_response.decode("utf-8"))
+
+    if isinstance(responses, dict):
+        # Node does not do batches and complains about the whole request
+        raise ValueError(responses.get("error", responses))
+
+    results = [None] * len(calls)
+    for response in responses:
+        idx = response["id"]
+        if "error" in response:
+            if return_errors:
+                results[idx] = ValueError(response["error"])
+                continue
+            raise ValueError(response["error"])
+        method = calls[idx][0]
+        formatter = BATCH_RESULT_FORMATTERS.get(method)
+        result = response.get("result")
+        results[idx] = formatter(result) if formatter and result is not None else result
+    return results
+
+
+def decode_function_output(func, data: bytes):
+    """Decode eth_call return data of a contract function the same way ContractFunction.call() does."""
+    output_types = get_abi_output_types(func.abi)
+    output = decode_abi(output_types, HexBytes(data))
+    normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, output)
+    if len(normalized) == 1:
+        return normalized[0]
+    return normalized
+
+
+def bulk_call(web3: Web3, funcs: list, block_identifier="latest", chunk_size=500) -> list:
+    """Read contract state for many calls using JSON-RPC batches.
+
+    Example::
+
+        balances = bulk_call(web3, [token.functions.balanceOf(addr) for addr in addresses])
+
+    :param funcs: Bound contract functions
+    :param block_identifier: Block number or "latest" - use a fixed block number to read a consistent snapshot
+    :param chunk_size: How many calls to fit in one JSON-RPC batch
+    :return: Decoded return values in the same order as funcs
+    """
+
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+
+    results = []
+    for chunk in chunked(funcs, chunk_size):
+        calls = [("eth_call", [{"to": func.address, "data": func._encode_transaction_data()}, block_identifier]) for func in chunk]
+        for func, data in zip(chunk, make_batch_request(web3, calls)):
+            results.append(decode_function_output(func, data))
+    return results
+
+
+def multicall(web3: Web3, calls: List[Tuple[Contract, str, list]], aggregator: Optional[Contract]=None, block_identifier="latest", chunk_size=200) -> list:
+    """Read contract state for many calls at once.
+
+    With a deployed ReadAggregator contract each chunk of calls is a single eth_call.
+    Without one we fall back to JSON-RPC batches with :py:func:`bulk_call`.
+
+    Example::
+
+        issued = multicall(web3, [(issuer, "issued", [addr]) for addr in addresses], aggregator)
+
+    :param calls: List of (contract, function name, arguments) tuples. Functions must return a single static value.
+    :param aggregator: ReadAggregator contract or None
+    :param block_identifier: Block number or "latest" - use a fixed block number to read a consistent snapshot
+    :return: Decoded return values in the same order as calls
+    """
+
+    funcs = [getattr(contract.functions, fn_name)(*args) for contract, fn_name, args in calls]
+
+    if aggregator is None:
+        return bulk_call(web3, funcs, block_identifier=block_identifier)
+
+    for func in funcs:
+        output_types = get_abi_output_types(func.abi)
+        if len(output_types) != 1 or output_types[0] in ("string", "bytes") or output_types[0].endswith("]"):
+            raise ValueError("ReadAggregator cannot return {} of {}".format(output_types, func.fn_name))
+
+    results = []
+    for chunk in chunked(funcs, chunk_size):
+        targets = [func.address for func in chunk]
+        call_datas = [HexBytes(func._encode_transaction_data()) for func in chunk]
+        words = aggregator.functions.aggregate(targets, [len(data) for data in call_datas], b"".join(call_datas)).call(block_identifier=block_identifier)
+        for func, word in zip(chunk, words):
+            results.append(decode_function_output(func, word))
+    return results
+
+
+def get_read_aggregator(chain: BaseChain, address: Optional[str]) -> Optional[Contract]:
+    """Get ReadAggregator contract for :py:func:`multicall` if the user gave us one."""
+    if not address:
+        return None
+    ReadAggregator = chain.provider.get_base_contract_factory('ReadAggregator')
+    return ReadAggregator(address=address)
+
+
+def confirm_transactions(web3: Web3, tx_list: list, timeout=1800, poll_interval=1.0) -> List[Tuple[dict, bool]]:
+    """Wait multiple transactions to be mined, polling all of them together.
+
+    On every poll tick receipts of all still pending transactions are fetched in one JSON-RPC batch.
+    A failed transaction does not stop us from waiting the rest.
+
+    :param tx_list: Transaction hashes
+    :return: List of (receipt, failed) tuples in the same order as tx_list
+    :raise RuntimeError: If all transactions were not mined within the timeout
+    """
+
+    txids = [txid_to_hex(txid) for txid in tx_list]
+    results = [None] * len(txids)
+    pending = list(range(len(txids)))
+    deadline = time.time() + timeout
+
+    while pending:
+        receipts = make_batch_request(web3, [("eth_getTransactionReceipt", [txids[idx]]) for idx in pending])
+        mined = [(idx, receipt) for idx, receipt in zip(pending, receipts) if receipt and receipt.get("blockNumber") is not None]
+
+        # We need the gas limit of the transaction to see if it run out of gas
+        txinfos = make_batch_request(web3, [("eth_getTransactionByHash", [txids[idx]]) for idx, receipt in mined])
+
+        for (idx, receipt), txinfo in zip(mined, txinfos):
+            if not txinfo:
+                # This is some sort of geth flakiness issue, retry on the next tick
+                continue
+
+            # EVM has only one error mode and it's consume all gas,
+            # Byzantium receipts also give us the status flag
+            failed = txinfo["gas"] == receipt["gasUsed"] or receipt.get("status") == 0
+            results[idx] = (receipt, failed)
+
+        pending = [idx for idx in pending if results[idx] is None]
+
+        if pending:
+            if time.time() > deadline:
+                raise RuntimeError("Did not get receipts for {}".format(", ".join(txids[idx] for idx in pending)))
+            time.sleep(poll_interval)
+
+    return results
+
+
+def confirm_replaced_transactions(web3: Web3, tx_groups: List[List[str]], timeout=1800, poll_interval=1.0) -> List[Tuple[str, dict, bool]]:
+    """Wait transactions that may have been replaced with the same nonce.
+
+    Each group has all versions of one transaction. Only one of them can be mined.
+
+    :param tx_groups: List of transaction hash lists
+    :return: List of (mined txid, receipt, failed) tuples in the same order as tx_groups
+    :raise RuntimeError: If all groups were not mined within the timeout
+    """
+
+    tx_groups = [[txid_to_hex(txid) for txid in group] for group in tx_groups]
+    results = [None] * len(tx_groups)
+    pending = list(range(len(tx_groups)))
+    deadline = time.time() + timeout
+
+    while pending:
+        versions = [(idx, txid) for idx in pending for txid in tx_groups[idx]]
+        receipts = make_batch_request(web3, [("eth_getTransactionReceipt", [txid]) for idx, txid in versions])
+        mined = {}
+        for (idx, txid), receipt in zip(versions, receipts):
+            if receipt and receipt.get("blockNumber") is not None:
+                mined[idx] = txid
+
+        if mined:
+            # Reuses receipt polling and failure detection
+            confirmed = confirm_transactions(web3, list(mined.values()), timeout=timeout, poll_interval=poll_interval)
+            for (idx, txid), (receipt, failed) in zip(mined.items(), confirmed):
+                results[idx] = (txid, receipt, failed)
+
+        pending = [idx for idx in pending if results[idx] is None]
+
+        if pending:
+            if time.time() > deadline:
+                raise RuntimeError("Did not get receipts for {}".format(", ".join(tx_groups[idx][0] for idx in pending)))
+            time.sleep(poll_interval)
+
+    return results
+
+
 def check_succesful_tx(web3: Web3, txid: str, timeout=600) -> dict:
     """See if transaction went through (Solidity code did not throw).
 
@@ -50,30 +299,59 @@ def check_succesful_tx(web3: Web3, txid: str, timeout=600) -> dict:
     """
 
     # http://ethereum.stackexchange.com/q/6007/620
-    receipt = wait_for_transaction_receipt(web3, txid, timeout=timeout)
-    txinfo = web3.eth.getTransaction(txid)
-    if not txinfo:
-        # This is some sort of geth flakiness issue, not sure what
-        # Try to mitigate it with timeout
-        time.sleep(1.0)
-        txinfo = web3.eth.getTransaction(txid)
-
-    if receipt is None:
-        raise RuntimeError("Did not get receipt for {}".format(txid))
-
-    if txinfo is None:
-        raise RuntimeError("Did not get txinfo for {}".format(txid))
-
-    # EVM has only one error mode and it's consume all gas
-    if txinfo["gas"] == receipt["gasUsed"]:
+    receipt, failed = confirm_transactions(web3, [txid], timeout=timeout)[0]
+    if failed:
         raise TransactionFailure("Transaction failed: {}".format(txid))
     return receipt
 
 
-def check_multiple_succesful_txs(web3: Web3, tx_list: list, timeout=1800):
-    """Check that multiple transactions confirmed"""
-    for tx in tx_list:
-        check_succesful_tx(web3, tx, timeout)
+def check_multiple_succesful_txs(web3: Web3, tx_list: list, timeout=1800) -> List[dict]:
+    """Check that multiple transactions confirmed.
+
+    All transactions are waited for before reporting failures.
+
+    :return: Transaction receipts in the same order as tx_list
+    :raise TransactionFailure: Listing all failed transactions
+    """
+    results = confirm_transactions(web3, tx_list, timeout=timeout)
+    failures = [txid for txid, (receipt, failed) in zip(tx_list, results) if failed]
+    if failures:
+        raise TransactionFailure("Transactions failed: {}".format(", ".join(txid_to_hex(txid) for txid in failures)))
+    return [receipt for receipt, failed in results]
+
+
+def get_chunk_size(web3: Web3, gas_per_item: int, max_items: int, base_gas=100000, block_gas_share=0.5) -> int:
+    """How many items we can pack in a single batch transaction.
+
+    The batch transaction must stay well under the block gas limit,
+    or miners will not pick it up.
+
+    :param gas_per_item: Worst case gas cost of processing a single item in the batch
+    :param max_items: Upper limit given by the user
+    :param base_gas: Gas cost of the transaction itself, excluding items
+    :param block_gas_share: How large portion of the current block gas limit one transaction may use
+    """
+    gas_limit = web3.eth.getBlock("latest")["gasLimit"]
+    fits = int((gas_limit * block_gas_share - base_gas) // gas_per_item)
+    return max(1, min(max_items, fits))
+
+
+def chunked(items: Iterable, chunk_size: int):
+    """Split a list to chunks of max chunk_size items.
+
+    Other iterables, like generators, are consumed one chunk at a time.
+    """
+    if isinstance(items, (list, tuple)):
+        for i in range(0, len(items), chunk_size):
+            yield items[i:i + chunk_size]
+        return
+
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
 
 def get_constructor_arguments(contract: Contract, args: Optional[list]=None, kwargs: Optional[dict]=None):
@@ -0,0 +1,184 @@
+"""TokenVault vesting math in Python.
+
+Mirrors ``TokenVault.getMaxClaimByNow()`` and ``TokenVault.getCurrentlyClaimableAmount()``, so that claimable amounts can be derived from raw vault storage (balances, claimed, lastClaimedAt, tokensPerSecond, freezeEndsAt) without calling the vault once per investor.
+
+A :py:class:`VaultSnapshot` of all investors can be saved to a JSON file and used to simulate the vesting schedule of the whole vault later without a node.
+"""
+import json
+from collections import namedtuple
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from web3 import Web3
+from web3.contract import Contract
+
+from ico.logscan import scan_events
+from ico.utils import chunked
+from ico.utils import multicall
+
+
+def get_max_claim_by_now(freeze_ends_at: int, last_claimed_at: int, tokens_per_second: int, now: int) -> int:
+    """See TokenVault.getMaxClaimByNow()."""
+    if now < freeze_ends_at:
+        return 0
+
+    # This investor has not claimed tokens yet.... start counting from the unfreeze time
+    previous_claim_at = last_claimed_at or freeze_ends_at
+    return (now - previous_claim_at) * tokens_per_second
+
+
+def get_currently_claimable(balance: int, claimed: int, freeze_ends_at: int, last_claimed_at: int, tokens_per_second: int, now: int) -> int:
+    """See TokenVault.getCurrentlyClaimableAmount()."""
+    max_tokens_left = balance - claimed
+
+    if now < freeze_ends_at:
+        return 0
+
+    if tokens_per_second > 0:
+        # This investor is vesting over time
+        return min(max_tokens_left, get_max_claim_by_now(freeze_ends_at, last_claimed_at, tokens_per_second, now))
+    else:
+        # This investor gets all tokens when the vault unlocks
+        return max_tokens_left
+
+
+def get_vesting_duration(balance: int, tokens_per_second: int) -> int:
+    """Seconds after the freeze end until the whole balance has been unlocked.
+
+    Rounds up with integer math, as token balances do not fit in a float.
+    """
+    if tokens_per_second > 0:
+        return -(-balance // tokens_per_second)
+    return 0
+
+
+def get_final_claim_at(balance: int, freeze_ends_at: int, tokens_per_second: int) -> int:
+    """UNIX timestamp when the whole balance has been unlocked."""
+    return freeze_ends_at + get_vesting_duration(balance, tokens_per_second)
+
+
+#: Vault storage of one investor
+VaultInvestor = namedtuple("VaultInvestor", ["address", "balance", "claimed", "last_claimed_at", "tokens_per_second"])
+
+
+def read_vault_investors(web3: Web3, token_vault: Contract, from_block=0, at_block: Optional[int]=None, aggregator: Optional[Contract]=None, chunk_size=500) -> Iterator[VaultInvestor]:
+    """Read the storage of all vault investors.
+
+    Investors are found from ``Allocated`` events and read a chunk at a time with :py:func:`multicall`.
+
+    :param at_block: Read the state at this block, the latest block if not given
+    """
+    if at_block is None:
+        at_block = web3.eth.blockNumber
+
+    participants = (e["args"]["investor"] for e in scan_events(token_vault.events.Allocated(), from_block, at_block))
+    for chunk in chunked(participants, chunk_size):
+        calls = []
+        for participant_addr in chunk:
+            calls += [
+                (token_vault, "balances", [participant_addr]),
+                (token_vault, "claimed", [participant_addr]),
+                (token_vault, "lastClaimedAt", [participant_addr]),
+                (token_vault, "tokensPerSecond", [participant_addr]),
+            ]
+        results = multicall(web3, calls, aggregator, block_identifier=at_block)
+        for idx, participant_addr in enumerate(chunk):
+            yield VaultInvestor(participant_addr, *results[idx*4:idx*4+4])
+
+
+class VaultSnapshot:
+    """State of all vault investors at one block, usable without a node.
+
+    Example::
+
+        snapshot = VaultSnapshot.read(web3, token_vault, decimals=18)
+        snapshot.save("vault-snapshot.json")
+
+        # Later, offline
+        snapshot = VaultSnapshot.load("vault-snapshot.json")
+        for timestamp, unlocked, total_unlocked in snapshot.get_unlock_curve(snapshot.freeze_ends_at, snapshot.get_last_unlock_at()):
+            print(timestamp, unlocked)
+    """
+
+    def __init__(self, vault_address: str, block_number: int, timestamp: int, freeze_ends_at: int, decimals: int, investors: List[VaultInvestor]):
+        self.vault_address = vault_address
+        self.block_number = block_number
+        self.timestamp = timestamp
+        self.freeze_ends_at = freeze_ends_at
+        self.decimals = decimals
+        self.investors = investors
+
+    @classmethod
+    def read(cls, web3: Web3, token_vault: Contract, decimals: int, from_block=0, at_block: Optional[int]=None, aggregator: Optional[Contract]=None) -> "VaultSnapshot":
+        """Read a snapshot from the node."""
+        if at_block is None:
+            at_block = web3.eth.blockNumber
+        timestamp = web3.eth.getBlock(at_block)["timestamp"]
+        freeze_ends_at = token_vault.functions.freezeEndsAt().call(block_identifier=at_block)
+        investors = list(read_vault_investors(web3, token_vault, from_block, at_block, aggregator))
+        return cls(token_vault.address, at_block, timestamp, freeze_ends_at, decimals, investors)
+
+    def save(self, path: str):
+        data = {
+            "vault": self.vault_address,
+            "block_number": self.block_number,
+            "timestamp": self.timestamp,
+            "freeze_ends_at": self.freeze_ends_at,
+            "decimals": self.decimals,
+            "investors": [investor._asdict() for investor in self.investors],
+        }
+        with open(path, "wt") as out:
+            json.dump(data, out, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "VaultSnapshot":
+        with open(path, "rt") as inp:
+            data = json.load(inp)
+        investors = [VaultInvestor(**investor) for investor in data["investors"]]
+        return cls(data["vault"], data["block_number"], data["timestamp"], data["freeze_ends_at"], data["decimals"], investors)
+
+    def get_claimable(self, now: int) -> Dict[str, int]:
+        """How much each investor could claim at a moment, assuming nobody claims after the snapshot."""
+        return {investor.address: get_currently_claimable(investor.balance, investor.claimed, self.freeze_ends_at, investor.last_claimed_at, investor.tokens_per_second, now) for investor in self.investors}
+
+    def get_last_unlock_at(self) -> int:
+        """UNIX timestamp when the last tokens of the vault unlock."""
+        return max([self.freeze_ends_at] + [get_final_claim_at(investor.balance, self.freeze_ends_at, investor.tokens_per_second) for investor in self.investors])
+
+    def get_unlock_curve(self, start: int, end: int, step=86400) -> Iterator[Tuple[int, int, int]]:
+        """Tokens unlocked by the vesting schedule over time, summed over all investors.
+
+        Each tapped investor unlocks ``tokensPerSecond`` from the freeze end until the whole balance is unlocked. Investors without a tap unlock everything at the freeze end. Investors are sorted by the moment they are fully unlocked, and the curve is evaluated with one sweep over them, so a curve over the whole vault costs O(investors * log(investors) + steps).
+
+        :param step: Seconds between the points, a day by default. The last point is always at ``end``.
+        :return: Iterator of (timestamp, tokens unlocked since the previous point, tokens unlocked in total) tuples. The first point counts everything unlocked by then.
+        """
+        # Seconds after the freeze end when each investor is fully unlocked
+        schedule = []
+        for investor in self.investors:
+            schedule.append((get_vesting_duration(investor.balance, investor.tokens_per_second), investor.balance, investor.tokens_per_second))
+        schedule.sort()
+
+        finished_balance = 0
+        vesting_rate = sum(tokens_per_second for duration, balance, tokens_per_second in schedule)
+        idx = 0
+        previous = 0
+        timestamps = range(start, end + 1, step)
+        if timestamps and timestamps[-1] != end:
+            # Always finish at the end of the range
+            timestamps = chain(timestamps, [end])
+
+        for timestamp in timestamps:
+            passed = timestamp - self.freeze_ends_at
+            if passed < 0:
+                total = 0
+            else:
+                while idx < len(schedule) and schedule[idx][0] <= passed:
+                    duration, balance, tokens_per_second = schedule[idx]
+                    finished_balance += balance
+                    vesting_rate -= tokens_per_second
+                    idx += 1
+                total = finished_balance + passed * vesting_rate
+
+            yield timestamp, total - previous, total
+            previous = total
@@ -75,5 +75,7 @@ setup(
     refund=ico.cmd.refund:main
     combine-csvs=ico.cmd.combine:main
     aml-reclaim=ico.cmd.amlreclaim:main
+    broadcast-bundle=ico.cmd.broadcast:main
+    vault-unlock-report=ico.cmd.vaultreport:main
     ''',
 )